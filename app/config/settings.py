@@ -1,10 +1,14 @@
 """
 Настройки приложения
 """
-from typing import List, Optional, Union
-from pydantic import Field, field_validator
+from typing import List, Literal, Optional, Union
+from pydantic import Field, ValidationInfo, field_validator
 from pydantic_settings import BaseSettings
 
+# Максимальный размер отправляемого файла в публичном и локальном Bot API
+CLOUD_API_UPLOAD_LIMIT = 50 * 1024 * 1024
+LOCAL_API_UPLOAD_LIMIT = 2000 * 1024 * 1024
+
 
 class Settings(BaseSettings):
     """Настройки приложения"""
@@ -12,6 +16,18 @@ class Settings(BaseSettings):
     # Telegram Bot
     bot_token: str = Field(..., description="Токен Telegram бота")
     admin_ids: List[int] = Field(default_factory=list, description="ID администраторов")
+    telegram_api_server: Optional[str] = Field(
+        default=None,
+        description="URL локального сервера Telegram Bot API (telegram-bot-api --local)"
+    )
+    telegram_api_download_path: Optional[str] = Field(
+        default=None,
+        description="Папка скачиваний, как ее видит локальный сервер Bot API, если путь отличается"
+    )
+    telegram_upload_timeout: int = Field(
+        default=600,
+        description="Таймаут отправки файла в Telegram в секундах"
+    )
     
     # Database
     database_url: str = Field(
@@ -24,6 +40,10 @@ class Settings(BaseSettings):
         default="redis://localhost:6379/0",
         description="URL подключения к Redis"
     )
+    redis_enabled: bool = Field(
+        default=False,
+        description="Использовать Redis для общих блокировок и кэшей"
+    )
     
     # YouTube Download
     download_path: str = Field(
@@ -36,7 +56,162 @@ class Settings(BaseSettings):
     )
     max_file_size: int = Field(
         default=50 * 1024 * 1024,  # 50MB
-        description="Максимальный размер файла в байтах"
+        description="Максимальный размер файла в байтах (не больше лимита Bot API)"
+    )
+    
+    # Caching
+    file_id_cache_size: int = Field(
+        default=10000,
+        description="Максимальное количество file_id в памяти"
+    )
+    media_cache_max_bytes: int = Field(
+        default=10 * 1024 * 1024 * 1024,  # 10GB
+        description="Максимальный объем кэша скачанных файлов в байтах"
+    )
+    media_cache_policy: Literal["lru", "lfu"] = Field(
+        default="lru",
+        description="Политика вытеснения из кэша файлов: lru или lfu"
+    )
+    info_cache_size: int = Field(
+        default=200,
+        description="Максимальное количество информации о видео в памяти"
+    )
+    info_cache_ttl: int = Field(
+        default=3 * 60 * 60,  # 3 часа
+        description="Максимальное время хранения информации о видео для скачивания в секундах"
+    )
+    video_refresh_ttl: int = Field(
+        default=6 * 60 * 60,  # 6 часов
+        description="Через сколько секунд информация о видео считается устаревшей"
+    )
+    video_refresh_queue_size: int = Field(
+        default=100,
+        description="Максимальное количество видео в очереди фонового обновления"
+    )
+    video_refresh_workers: int = Field(
+        default=1,
+        description="Количество обработчиков фонового обновления видео"
+    )
+    user_cache_size: int = Field(
+        default=10000,
+        description="Максимальное количество пользователей в кэше памяти"
+    )
+    user_cache_ttl: int = Field(
+        default=60,
+        description="Время хранения пользователя в кэше в секундах (блокировка в другом процессе применяется не позже)"
+    )
+    activity_flush_interval: float = Field(
+        default=5.0,
+        description="Как часто записывать накопленное время активности пользователей в базу в секундах"
+    )
+    counter_flush_interval: float = Field(
+        default=0.0,
+        description="Как часто записывать накопленные счетчики скачиваний в базу в секундах (0 - сразу после скачивания)"
+    )
+    
+    # Download coordination
+    download_workers: int = Field(
+        default=3,
+        description="Количество одновременных скачиваний"
+    )
+    download_per_user_limit: int = Field(
+        default=1,
+        description="Количество одновременных скачиваний одного пользователя"
+    )
+    download_queue_size: int = Field(
+        default=20,
+        description="Максимальное количество скачиваний в очереди"
+    )
+    extract_workers: int = Field(
+        default=4,
+        description="Количество потоков для получения информации о видео"
+    )
+    job_poll_interval: float = Field(
+        default=2.0,
+        description="Интервал опроса очереди скачиваний в секундах"
+    )
+    job_heartbeat_interval: int = Field(
+        default=15,
+        description="Интервал сигнала жизни обработчика очереди в секундах"
+    )
+    job_stale_timeout: int = Field(
+        default=120,
+        description="Через сколько секунд без сигнала жизни задание возвращается в очередь"
+    )
+    job_max_attempts: int = Field(
+        default=3,
+        description="Максимальное количество попыток выполнить задание"
+    )
+    download_bandwidth_limit: int = Field(
+        default=0,
+        description="Общее ограничение скорости всех скачиваний в байтах в секунду (0 - без ограничения)"
+    )
+    download_max_fragments: int = Field(
+        default=4,
+        ge=1,
+        description="Потоков скачивания фрагментов HLS/DASH у одного скачивания в простое, делятся между скачиваниями"
+    )
+    progress_edit_interval: float = Field(
+        default=2.5,
+        description="Минимальный интервал обновления прогресса в одном чате в секундах"
+    )
+    ytdlp_backend: Literal["thread", "process"] = Field(
+        default="thread",
+        description="Где выполнять yt-dlp: в пуле потоков или в пуле процессов"
+    )
+    single_flight_lock_ttl: int = Field(
+        default=600,
+        description="Время жизни распределенной блокировки скачивания в секундах"
+    )
+    partial_download_ttl: int = Field(
+        default=24 * 60 * 60,  # 24 часа
+        description="Время хранения недокачанных файлов для возобновления в секундах"
+    )
+    upload_workers: int = Field(
+        default=2,
+        description="Количество одновременных отправок файлов в Telegram"
+    )
+    upload_inflight_bytes: int = Field(
+        default=200 * 1024 * 1024,  # 200MB
+        description="Максимальный суммарный размер одновременно отправляемых файлов в байтах"
+    )
+    upload_max_attempts: int = Field(
+        default=5,
+        description="Попыток отправить файл при FloodWait и сетевых ошибках"
+    )
+    split_max_parts: int = Field(
+        default=4,
+        ge=1,
+        le=10,  # В альбоме Telegram не больше 10 файлов
+        description="На сколько частей можно разделить файл больше max_file_size (1 - не делить)"
+    )
+    split_workers: int = Field(
+        default=1,
+        description="Количество одновременных разбиений файлов на части"
+    )
+    stream_max_size: int = Field(
+        default=20 * 1024 * 1024,  # 20MB
+        description="Файлы до этого размера отправляются в Telegram потоком без записи на диск (0 - выключено)"
+    )
+    stream_buffer_size: int = Field(
+        default=1024 * 1024,  # 1MB
+        description="Буфер между чтением со ссылки и отправкой в Telegram при потоковой отправке в байтах"
+    )
+    derive_from_master: bool = Field(
+        default=True,
+        description="Получать более низкое качество и MP3 из уже скачанного видео вместо повторного скачивания"
+    )
+    audio_mode: Literal["mp3", "remux"] = Field(
+        default="mp3",
+        description="Аудио: mp3 - кодировать в MP3, remux - копировать поток без перекодирования (m4a/ogg)"
+    )
+    transcode_workers: int = Field(
+        default=1,
+        description="Количество одновременных перекодирований ffmpeg"
+    )
+    transcode_threads: int = Field(
+        default=2,
+        description="Потоков ffmpeg на одно перекодирование"
     )
     
     # Logging
@@ -46,9 +221,16 @@ class Settings(BaseSettings):
     # Rate limiting
     rate_limit_requests: int = Field(
         default=5,
-        description="Количество запросов в минуту на пользователя"
+        description="Бюджет запросов в минуту на пользователя: скачивание стоит 1, ссылка на видео 0.5, навигация 0.1"
     )
     
+    @field_validator('max_file_size')
+    @classmethod
+    def limit_max_file_size(cls, value: int, info: ValidationInfo) -> int:
+        """Ограничение размера файла лимитом Bot API: 50 МБ, с локальным сервером - 2000 МБ"""
+        limit = LOCAL_API_UPLOAD_LIMIT if info.data.get('telegram_api_server') else CLOUD_API_UPLOAD_LIMIT
+        return min(value, limit)
+    
     @field_validator('admin_ids', mode='before')
     @classmethod
     def parse_admin_ids(cls, value: Union[str, int, List[int]]) -> List[int]:
@@ -5,10 +5,25 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.exceptions import TelegramBadRequest
 
 from app.models import User
 from app.services.user_service import UserService
-from app.services.youtube_service import YouTubeService
+from app.services.youtube_service import YouTubeService, download_flight
+from app.services.file_id_cache import file_id_cache
+from app.services.media_cache import media_cache
+from app.services.media_splitter import media_splitter
+from app.services.transcoder import transcoder
+from app.services.stream_upload import stream_uploader
+from app.services.bandwidth_governor import bandwidth_governor
+from app.services.user_cache import user_cache
+from app.services.rate_limiter import rate_limiter
+from app.services.download_counters import download_counters
+from app.services.info_cache import info_cache
+from app.services.negative_cache import negative_cache
+from app.services.video_refresher import video_refresher
+from app.services.download_scheduler import download_scheduler
+from app.services.job_queue import DownloadJobQueue
 from app.services.logger import get_logger
 from app.middlewares import AdminMiddleware
 
@@ -54,6 +69,7 @@ async def admin_panel(message: Message, user: User):
     builder.button(text="🧹 Очистка файлов", callback_data="admin_cleanup")
     builder.button(text="📢 Рассылка", callback_data="admin_broadcast")
     builder.button(text="⚙️ Настройки", callback_data="admin_settings")
+    builder.button(text="⚡ Производительность", callback_data="admin_performance")
     builder.adjust(2)
     
     await message.answer(
@@ -127,6 +143,144 @@ async def admin_stats_callback(callback: CallbackQuery, user: User):
     )
 
 
+@router.callback_query(F.data == "admin_performance")
+async def admin_performance_callback(callback: CallbackQuery, user: User, job_queue: DownloadJobQueue):
+    """Статистика кэшей и очередей"""
+    
+    queue_stats = await job_queue.get_stats()
+    file_id_stats = file_id_cache.get_stats()
+    media_stats = media_cache.get_stats()
+    info_stats = info_cache.get_stats()
+    refresh_stats = video_refresher.get_stats()
+    negative_stats = negative_cache.get_stats()
+    flight_stats = download_flight.get_stats()
+    scheduler_stats = download_scheduler.get_stats()
+    upload_stats = job_queue.upload_queue.get_stats()
+    split_stats = media_splitter.get_stats()
+    transcode_stats = transcoder.get_stats()
+    stream_stats = stream_uploader.get_stats()
+    bandwidth_stats = bandwidth_governor.get_stats()
+    user_cache_stats = user_cache.get_stats()
+    rate_limit_stats = rate_limiter.get_stats()
+    counter_stats = download_counters.get_stats()
+    bandwidth_jobs_text = "\n".join(
+        f"  · {job['name']}: {job['speed'] / 1024 / 1024:.1f} МБ/с, "
+        f"{job['downloaded_bytes'] / 1024 / 1024:.0f} МБ, фрагментов {job['fragments']}"
+        for job in bandwidth_stats['jobs']
+    ) or "  · нет"
+    bandwidth_limit_text = (
+        f"{bandwidth_stats['limit'] / 1024 / 1024:.1f} МБ/с" if bandwidth_stats['limit'] else "без ограничения"
+    )
+    transcode_modes_text = "\n".join(
+        f"• {mode}: {stats['jobs']} файлов, {stats['output_bytes'] / 1024 / 1024:.0f} МБ, CPU {stats['cpu_time']:.0f}s"
+        for mode, stats in transcode_stats['modes'].items()
+    )
+    
+    performance_text = f"""
+⚡ <b>Производительность</b>
+
+📥 <b>Очередь скачиваний:</b>
+• Ожидают: {queue_stats['pending']}
+• Скачиваются (все процессы): {queue_stats['downloading']}
+• Самое долгое ожидание: {queue_stats['oldest_wait']:.0f}s
+
+⚙️ <b>Слоты этого процесса:</b>
+• Активных: {scheduler_stats['active']} из {scheduler_stats['workers']}
+• Ожидают слот: {scheduler_stats['queue_depth']}
+• Запущено: {scheduler_stats['started']}
+• Отклонено: {scheduler_stats['rejected']}
+• Среднее ожидание: {scheduler_stats['avg_wait_time']:.1f}s
+• Максимальное ожидание: {scheduler_stats['max_wait_time']:.1f}s
+
+📶 <b>Полоса скачивания ({bandwidth_limit_text}):</b>
+• Сейчас: {bandwidth_stats['throughput'] / 1024 / 1024:.1f} МБ/с, скачиваний {bandwidth_stats['active']}
+{bandwidth_jobs_text}
+• Завершено: {bandwidth_stats['completed']} ({bandwidth_stats['total_bytes'] / 1024 / 1024:.0f} МБ)
+• Средняя скорость скачивания: {bandwidth_stats['avg_throughput'] / 1024 / 1024:.1f} МБ/с
+
+📤 <b>Очередь отправки:</b>
+• Ожидают: {upload_stats['queue_depth']}
+• Отправляется: {upload_stats['inflight_bytes'] / 1024 / 1024:.0f} из {upload_stats['inflight_limit'] / 1024 / 1024:.0f} МБ
+• Отправлено: {upload_stats['uploaded']}
+• Повторов: {upload_stats['retries']} (FloodWait: {upload_stats['flood_waits']})
+• Ошибок: {upload_stats['failed']}
+• Разделено на части: {split_stats['splits']} файлов, {split_stats['parts_created']} частей
+• Отправлено потоком без диска: {stream_stats['streamed']} ({stream_stats['bytes_streamed'] / 1024 / 1024:.0f} МБ)
+• Поток не удался, скачано на диск: {stream_stats['fallbacks']}
+
+📎 <b>Кэш file_id:</b>
+• Записей в памяти: {file_id_stats['size']}
+• Попаданий: {file_id_stats['hits']}
+• Промахов: {file_id_stats['misses']}
+• Эффективность: {file_id_stats['hit_rate']:.1f}%
+• Инвалидировано: {file_id_stats['invalidations']}
+
+💽 <b>Кэш файлов ({media_stats['policy'].upper()}):</b>
+• Файлов: {media_stats['entries']}
+• Объем: {media_stats['size_bytes'] / 1024 / 1024:.0f} из {media_stats['max_bytes'] / 1024 / 1024:.0f} МБ
+• Эффективность: {media_stats['hit_rate']:.1f}%
+• Вытеснено: {media_stats['evictions']} ({media_stats['bytes_evicted'] / 1024 / 1024:.0f} МБ)
+
+🎞 <b>Перекодирование ({transcode_stats['audio_mode']} для аудио):</b>
+• Выполняется и ожидает: {transcode_stats['pending']} (обработчиков: {transcode_stats['workers']})
+{transcode_modes_text}
+• Выбрано повторное скачивание: {transcode_stats['refetch_chosen']}
+• Ошибок: {transcode_stats['failures']}
+• Средняя скорость скачивания: {transcode_stats['fetch_speed'] / 1024 / 1024:.1f} МБ/с
+
+🧾 <b>Кэш информации о видео:</b>
+• Записей в памяти: {info_stats['size']}
+• Эффективность: {info_stats['hit_rate']:.1f}%
+• Средний возраст: {info_stats['avg_age'] / 60:.0f} мин
+• Повторных извлечений: {info_stats['fallbacks']}
+
+🔄 <b>Обновление информации о видео:</b>
+• В очереди: {refresh_stats['queue_depth']} из {refresh_stats['queue_capacity']}
+• Обновлено: {refresh_stats['refreshed']}
+• Ошибок: {refresh_stats['failed']}
+• Повторных запросов объединено: {refresh_stats['deduplicated']}
+• Пропущено при заполненной очереди: {refresh_stats['dropped']}
+
+👤 <b>Кэш пользователей:</b>
+• Записей в памяти: {user_cache_stats['size']}
+• Эффективность: {user_cache_stats['hit_rate']:.1f}%
+• Сброшено после изменений: {user_cache_stats['invalidations']}
+• Активность: ожидает записи {user_cache_stats['pending_activity']}, записано {user_cache_stats['activity_written']} за {user_cache_stats['flushes']} запросов
+• Счетчики скачиваний: учтено {counter_stats['recorded']}, ожидает записи видео {counter_stats['pending_videos']} / пользователей {counter_stats['pending_users']}
+
+⏱ <b>Ограничение запросов ({rate_limit_stats['backend']}):</b>
+• Лимит: {rate_limit_stats['limit']} за {rate_limit_stats['period']:.0f}s
+• Разрешено / отклонено: {rate_limit_stats['allowed']} / {rate_limit_stats['rejected']}
+
+🚫 <b>Кэш отказов:</b>
+• Записей в памяти: {negative_stats['size']}
+• Отклонено без обращения к YouTube: {negative_stats['hits']}
+• Приватные / удаленные / регион: {negative_stats['stored']['private']} / {negative_stats['stored']['unavailable']} / {negative_stats['stored']['geo']}
+• Слишком длинные / временные сбои: {negative_stats['stored']['too_long']} / {negative_stats['stored']['transient']}
+
+🔗 <b>Объединение скачиваний:</b>
+• Выполняется сейчас: {flight_stats['in_flight']}
+• Запущено скачиваний: {flight_stats['leaders']}
+• Объединено запросов: {flight_stats['shared']}
+    """
+    
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🔄 Обновить", callback_data="admin_performance")
+    builder.button(text="◀️ Назад", callback_data="admin_back")
+    builder.adjust(1)
+    
+    try:
+        await callback.message.edit_text(
+            performance_text,
+            reply_markup=builder.as_markup(),
+            parse_mode="HTML"
+        )
+    except TelegramBadRequest:
+        # Статистика не изменилась с прошлого обновления
+        pass
+    await callback.answer()
+
+
 @router.callback_query(F.data == "admin_cleanup")
 async def admin_cleanup_callback(callback: CallbackQuery, user: User):
     """Очистка файлов"""
@@ -135,11 +289,13 @@ async def admin_cleanup_callback(callback: CallbackQuery, user: User):
     
     try:
         cleaned_count = await youtube_service.cleanup_old_files()
+        partial_count = await youtube_service.cleanup_partial_downloads()
         
         cleanup_text = f"""
 🧹 <b>Очистка завершена</b>
 
 ✅ Удалено файлов: {cleaned_count}
+🧩 Удалено недокачанных: {partial_count}
 📁 Освобождено место на диске
 
 Файлы старше 7 дней были удалены.
@@ -257,6 +413,7 @@ async def admin_back_callback(callback: CallbackQuery, user: User):
     builder.button(text="🧹 Очистка файлов", callback_data="admin_cleanup")
     builder.button(text="📢 Рассылка", callback_data="admin_broadcast")
     builder.button(text="⚙️ Настройки", callback_data="admin_settings")
+    builder.button(text="⚡ Производительность", callback_data="admin_performance")
     builder.adjust(2)
     
     await callback.message.edit_text(
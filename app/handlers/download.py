@@ -1,14 +1,16 @@
 """
 Хендлеры для скачивания видео
 """
-import os
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, FSInputFile
+from aiogram.types import Message, CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from aiogram.exceptions import TelegramBadRequest
 
-from app.models import User
+from app.models import User, Video
 from app.services.youtube_service import YouTubeService
+from app.services.delivery_service import DeliveryService
+from app.services.job_queue import DownloadJobQueue
+from app.services.download_scheduler import QueueFullError
+from app.services.negative_cache import VideoUnavailableError
 from app.services.logger import get_logger
 
 logger = get_logger(__name__)
@@ -18,6 +20,24 @@ router = Router()
 youtube_service = YouTubeService()
 
 
+def size_warning_text(video: Video, qualities: list) -> str:
+    """
+    Предупреждение, если форматы видео известны, но ни одно качество MP4
+    не помещается в ограничение размера и остается только MP3
+    """
+    if video.available_formats and not qualities:
+        return "⚠️ Видео слишком большое для отправки в MP4 любого качества, доступно только аудио.\n\n"
+    return ""
+
+
+def quality_button_text(quality: dict) -> str:
+    """Текст кнопки качества с оценкой размера файла"""
+    text = f"📹 {quality['name']} MP4"
+    if quality.get('estimated_size'):
+        text += f" ~{quality['estimated_size'] / 1024 / 1024:.0f} МБ"
+    return text
+
+
 @router.message(F.text.regexp(r'(?:https?://)?(?:www\.)?(?:youtube\.com|youtu\.be)'))
 async def youtube_url_handler(message: Message, user: User):
     """Обработчик YouTube ссылок"""
@@ -38,7 +58,11 @@ async def youtube_url_handler(message: Message, user: User):
     
     try:
         # Получаем или создаем видео в базе данных
-        video = await youtube_service.get_or_create_video(url)
+        try:
+            video = await youtube_service.get_or_create_video(url)
+        except VideoUnavailableError as e:
+            await loading_msg.edit_text(e.text)
+            return
         
         if not video:
             await loading_msg.edit_text(
@@ -47,6 +71,9 @@ async def youtube_url_handler(message: Message, user: User):
             )
             return
         
+        # Получаем доступные качества
+        qualities = await youtube_service.get_available_qualities(video)
+        
         # Создаем сообщение с информацией о видео
         view_count_text = f"{video.view_count:,}" if video.view_count else 'Неизвестно'
         info_text = f"""
@@ -57,23 +84,20 @@ async def youtube_url_handler(message: Message, user: User):
 👁 <b>Просмотры:</b> {view_count_text}
 📅 <b>Дата загрузки:</b> {video.upload_date.strftime('%d.%m.%Y') if video.upload_date else 'Неизвестно'}
 
-Выберите качество и формат для скачивания:
+{size_warning_text(video, qualities)}Выберите качество и формат для скачивания:
         """
         
         # Создаем клавиатуру с вариантами скачивания
         builder = InlineKeyboardBuilder()
         
-        # Получаем доступные качества
-        qualities = await youtube_service.get_available_qualities(video)
-        
         if qualities:
             # Добавляем кнопки для разных качеств MP4
             for quality in qualities[:5]:  # Ограничиваем до 5 качеств
                 builder.button(
-                    text=f"📹 {quality['name']} MP4",
+                    text=quality_button_text(quality),
                     callback_data=f"download:{video.id}:mp4:{quality['name']}"
                 )
-        else:
+        elif not video.available_formats:
             # Добавляем стандартные варианты
             builder.button(
                 text="📹 720p MP4",
@@ -117,7 +141,7 @@ async def youtube_url_handler(message: Message, user: User):
 
 
 @router.callback_query(F.data.startswith("download:"))
-async def download_callback(callback: CallbackQuery, user: User):
+async def download_callback(callback: CallbackQuery, user: User, job_queue: DownloadJobQueue):
     """Обработчик скачивания видео"""
     try:
         _, video_id, format_type, quality = callback.data.split(":")
@@ -129,93 +153,41 @@ async def download_callback(callback: CallbackQuery, user: User):
         
         await callback.answer("🚀 Начинаем скачивание...")
         
-        # Обновляем сообщение
+        # Файл уже загружался в Telegram - отправляем его без скачивания
+        delivery_service = DeliveryService(callback.bot)
+        if await delivery_service.send_cached(
+            callback.message.chat.id,
+            callback.message.message_id,
+            user,
+            video,
+            quality,
+            format_type
+        ):
+            return
+        
+        # Ставим скачивание в очередь, результат отправит обработчик очереди
+        try:
+            position = await job_queue.enqueue(
+                video=video,
+                user=user,
+                quality=quality,
+                format_type=format_type,
+                chat_id=callback.message.chat.id,
+                message_id=callback.message.message_id
+            )
+        except QueueFullError as e:
+            await callback.message.edit_text(job_queue.queue_full_text(e))
+            return
+        
         await callback.message.edit_text(
-            f"⏳ Скачиваем видео: <b>{video.title}</b>\n"
+            f"🕐 Скачивание в очереди: <b>{video.title}</b>\n"
             f"📹 Качество: {quality}\n"
             f"📁 Формат: {format_type.upper()}\n\n"
-            "Это может занять некоторое время...",
+            f"Ваша позиция в очереди: {position}\n"
+            "Файл придет в этот чат, как только будет готов.",
             parse_mode="HTML"
         )
         
-        # Скачиваем видео
-        download_record = await youtube_service.download_video(
-            video=video,
-            user=user,
-            quality=quality,
-            format_type=format_type
-        )
-        
-        if download_record and download_record.is_completed:
-            # Отправляем файл пользователю
-            if download_record.file_path and os.path.exists(download_record.file_path):
-                try:
-                    # Создаем объект файла
-                    file = FSInputFile(
-                        download_record.file_path,
-                        filename=f"{video.title[:50]}.{format_type}"
-                    )
-                    
-                    # Отправляем файл
-                    if format_type == "mp3":
-                        sent_message = await callback.message.answer_audio(
-                            file,
-                            caption=f"🎵 <b>{video.title}</b>\n📺 {video.channel_name}",
-                            parse_mode="HTML"
-                        )
-                    else:
-                        sent_message = await callback.message.answer_video(
-                            file,
-                            caption=f"🎬 <b>{video.title}</b>\n📺 {video.channel_name}",
-                            parse_mode="HTML"
-                        )
-                    
-                    # Сохраняем file_id для повторного использования
-                    if format_type == "mp3" and sent_message.audio:
-                        download_record.telegram_file_id = sent_message.audio.file_id
-                    elif sent_message.video:
-                        download_record.telegram_file_id = sent_message.video.file_id
-                    
-                    await download_record.save(update_fields=["telegram_file_id"])
-                    
-                    # Обновляем сообщение об успехе
-                    await callback.message.edit_text(
-                        f"✅ <b>Скачивание завершено!</b>\n\n"
-                        f"🎬 <b>Видео:</b> {video.title}\n"
-                        f"📹 <b>Качество:</b> {quality}\n"
-                        f"📁 <b>Формат:</b> {format_type.upper()}\n"
-                        f"💾 <b>Размер:</b> {video.file_size_formatted or 'Неизвестно'}",
-                        parse_mode="HTML"
-                    )
-                    
-                except TelegramBadRequest as e:
-                    logger.error(f"Ошибка отправки файла: {e}")
-                    await callback.message.edit_text(
-                        "❌ Файл слишком большой для отправки через Telegram.\n"
-                        "Попробуйте выбрать более низкое качество."
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка отправки файла: {e}")
-                    await callback.message.edit_text(
-                        "❌ Ошибка при отправке файла.\n"
-                        "Попробуйте позже."
-                    )
-            else:
-                await callback.message.edit_text(
-                    "❌ Файл не найден на сервере.\n"
-                    "Попробуйте скачать заново."
-                )
-        else:
-            # Скачивание провалилось
-            error_msg = download_record.error_message if download_record else "Неизвестная ошибка"
-            await callback.message.edit_text(
-                f"❌ <b>Ошибка скачивания:</b>\n{error_msg}\n\n"
-                "Попробуйте:\n"
-                "• Выбрать другое качество\n"
-                "• Проверить ссылку\n"
-                "• Повторить попытку позже"
-            )
-        
     except Exception as e:
         logger.error(f"Ошибка в download_callback: {e}")
         await callback.message.edit_text(
@@ -280,6 +252,8 @@ async def back_to_download_callback(callback: CallbackQuery, user: User):
         from app.models import Video
         video = await Video.get(id=video_id)
         
+        qualities = await youtube_service.get_available_qualities(video)
+        
         # Воссоздаем исходное сообщение
         info_text = f"""
 🎬 <b>{video.title}</b>
@@ -289,21 +263,19 @@ async def back_to_download_callback(callback: CallbackQuery, user: User):
 👁 <b>Просмотры:</b> {f"{video.view_count:,}" if video.view_count else 'Неизвестно'}
 📅 <b>Дата загрузки:</b> {video.upload_date.strftime('%d.%m.%Y') if video.upload_date else 'Неизвестно'}
 
-Выберите качество и формат для скачивания:
+{size_warning_text(video, qualities)}Выберите качество и формат для скачивания:
         """
         
         # Воссоздаем клавиатуру
         builder = InlineKeyboardBuilder()
         
-        qualities = await youtube_service.get_available_qualities(video)
-        
         if qualities:
             for quality in qualities[:5]:
                 builder.button(
-                    text=f"📹 {quality['name']} MP4",
+                    text=quality_button_text(quality),
                     callback_data=f"download:{video.id}:mp4:{quality['name']}"
                 )
-        else:
+        elif not video.available_formats:
             builder.button(text="📹 720p MP4", callback_data=f"download:{video.id}:mp4:720p")
             builder.button(text="📹 480p MP4", callback_data=f"download:{video.id}:mp4:480p")
             builder.button(text="📹 360p MP4", callback_data=f"download:{video.id}:mp4:360p")
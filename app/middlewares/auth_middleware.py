@@ -37,13 +37,14 @@ class AuthMiddleware(BaseMiddleware):
                 telegram_user = event.inline_query.from_user
         
         if telegram_user:
+            # Получаем или создаем пользователя (из кэша пользователей, без запросов к базе)
+            db_user = await UserService.get_or_create_user(telegram_user)
+            
             # Проверяем, не заблокирован ли пользователь
-            if await UserService.is_user_blocked(telegram_user.id):
+            if db_user.is_blocked:
                 logger.warning(f"Заблокированный пользователь {telegram_user.id} пытался использовать бота")
                 return
             
-            # Получаем или создаем пользователя в базе данных
-            db_user = await UserService.get_or_create_user(telegram_user)
             data["user"] = db_user
             data["telegram_user"] = telegram_user
             
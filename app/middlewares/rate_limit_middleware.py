@@ -1,24 +1,45 @@
 """
 Миддлвар для ограничения частоты запросов
 """
-import time
+import math
+import re
 from typing import Callable, Dict, Any, Awaitable
 from aiogram import BaseMiddleware
-from aiogram.types import TelegramObject, Update, Message
+from aiogram.types import TelegramObject, Update, User as TelegramUser
 
 from app.config.settings import settings
+from app.services.rate_limiter import MemoryRateLimiter, rate_limiter
 from app.services.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Стоимость действий в единицах бюджета rate_limit_requests: единица - одно
+# скачивание, навигация по меню почти бесплатна
+DOWNLOAD_COST = 1.0
+VIDEO_LINK_COST = 0.5
+NAVIGATION_COST = 0.1
+
+# Стоимость callback по префиксу данных, остальные callback - навигация
+CALLBACK_COSTS: Dict[str, float] = {
+    "download:": DOWNLOAD_COST,
+}
+
+# Ссылка запускает получение информации о видео через yt-dlp
+_VIDEO_LINK_RE = re.compile(r'(?:youtube\.com|youtu\.be)')
+
 
 class RateLimitMiddleware(BaseMiddleware):
-    """Миддлвар для ограничения частоты запросов"""
+    """
+    Миддлвар для ограничения частоты запросов.
+    
+    Регистрируется один раз на уровне Update: сообщения и callback тратят
+    общий бюджет пользователя, но каждое действие стоит по-своему - запуск
+    скачивания дорогой, кнопки навигации дешевые. Превысившему лимит
+    пользователю сообщается, через сколько секунд действие станет доступно.
+    """
     
-    def __init__(self):
-        self.user_requests = {}  # Хранилище запросов пользователей
-        self.cleanup_interval = 60  # Интервал очистки в секундах
-        self.last_cleanup = time.time()
+    def __init__(self, limiter: MemoryRateLimiter = None):
+        self.limiter = limiter or rate_limiter
     
     async def __call__(
         self,
@@ -27,82 +48,40 @@ class RateLimitMiddleware(BaseMiddleware):
         data: Dict[str, Any]
     ) -> Any:
         
-        # Получаем пользователя из события
-        user_id = None
+        # Пользователя события определяет UserContextMiddleware диспетчера
+        from_user: TelegramUser = data.get("event_from_user")
         
-        # Если это напрямую Message/CallbackQuery и т.д.
-        if hasattr(event, 'from_user'):
-            user_id = event.from_user.id
-        # Если это Update объект
-        elif isinstance(event, Update):
-            if event.message:
-                user_id = event.message.from_user.id
-            elif event.callback_query:
-                user_id = event.callback_query.from_user.id
-            elif event.inline_query:
-                user_id = event.inline_query.from_user.id
+        # Проверяем администраторов (для них нет ограничений)
+        if from_user is None or from_user.id in settings.admin_ids:
+            return await handler(event, data)
         
-        if user_id:
-            # Проверяем администраторов (для них нет ограничений)
-            if user_id in settings.admin_ids:
-                return await handler(event, data)
-            
-            current_time = time.time()
-            
-            # Очищаем старые записи
-            if current_time - self.last_cleanup > self.cleanup_interval:
-                await self._cleanup_old_requests(current_time)
-                self.last_cleanup = current_time
-            
-            # Проверяем лимит для пользователя
-            if await self._check_rate_limit(user_id, current_time):
-                return await handler(event, data)
-            else:
-                logger.warning(f"Пользователь {user_id} превысил лимит запросов")
-                # Можно отправить сообщение о превышении лимита
-                if hasattr(event, 'answer'):
-                    await event.answer(
-                        "⚠️ Вы превысили лимит запросов. Попробуйте позже."
-                    )
-                elif isinstance(event, Update) and event.message:
-                    await event.message.answer(
-                        "⚠️ Вы превысили лимит запросов. Попробуйте позже."
-                    )
-                return
+        retry_after = await self.limiter.acquire(from_user.id, self.action_cost(event))
+        if not retry_after:
+            return await handler(event, data)
         
-        return await handler(event, data)
+        logger.warning(f"Пользователь {from_user.id} превысил лимит запросов")
+        text = f"⚠️ Слишком много запросов. Повторите через {math.ceil(retry_after)} сек."
+        if isinstance(event, Update):
+            if event.callback_query:
+                # Ответ на callback убирает индикатор загрузки с кнопки
+                await event.callback_query.answer(text, show_alert=True)
+            elif event.message:
+                await event.message.answer(text)
+        return
     
-    async def _check_rate_limit(self, user_id: int, current_time: float) -> bool:
-        """Проверяет лимит запросов для пользователя"""
-        window_start = current_time - 60  # Окно в 1 минуту
+    @staticmethod
+    def action_cost(event: TelegramObject) -> float:
+        """Стоимость действия в единицах бюджета"""
+        if not isinstance(event, Update):
+            return NAVIGATION_COST
         
-        if user_id not in self.user_requests:
-            self.user_requests[user_id] = []
-        
-        # Удаляем старые запросы
-        self.user_requests[user_id] = [
-            req_time for req_time in self.user_requests[user_id]
-            if req_time > window_start
-        ]
-        
-        # Проверяем лимит
-        if len(self.user_requests[user_id]) >= settings.rate_limit_requests:
-            return False
-        
-        # Добавляем текущий запрос
-        self.user_requests[user_id].append(current_time)
-        return True
-    
-    async def _cleanup_old_requests(self, current_time: float) -> None:
-        """Очищает старые запросы"""
-        window_start = current_time - 60
+        if event.callback_query:
+            callback_data = event.callback_query.data or ""
+            for prefix, cost in CALLBACK_COSTS.items():
+                if callback_data.startswith(prefix):
+                    return cost
+            return NAVIGATION_COST
         
-        for user_id in list(self.user_requests.keys()):
-            self.user_requests[user_id] = [
-                req_time for req_time in self.user_requests[user_id]
-                if req_time > window_start
-            ]
-            
-            # Удаляем пустые записи
-            if not self.user_requests[user_id]:
-                del self.user_requests[user_id] 
\ No newline at end of file
+        if event.message and event.message.text and _VIDEO_LINK_RE.search(event.message.text):
+            return VIDEO_LINK_COST
+        return NAVIGATION_COST
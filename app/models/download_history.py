@@ -47,6 +47,15 @@ class DownloadHistory(Model):
     file_path = fields.TextField(null=True, description="Путь к скачанному файлу")
     telegram_file_id = fields.CharField(max_length=255, null=True, description="ID файла в Telegram")
     
+    # Доставка результата
+    chat_id = fields.BigIntField(null=True, description="ID чата для отправки файла")
+    message_id = fields.BigIntField(null=True, description="ID сообщения со статусом скачивания")
+    
+    # Очередь скачиваний
+    worker_id = fields.CharField(max_length=255, null=True, description="Обработчик, выполняющий скачивание")
+    heartbeat_at = fields.DatetimeField(null=True, description="Последний сигнал жизни обработчика")
+    attempts = fields.IntField(default=0, description="Количество попыток скачивания")
+    
     # Ошибки и дополнительная информация
     error_message = fields.TextField(null=True, description="Сообщение об ошибке")
     metadata = fields.JSONField(null=True, description="Дополнительные метаданные")
@@ -60,6 +69,7 @@ class DownloadHistory(Model):
         table = "download_history"
         table_description = "История скачиваний"
         ordering = ["-created_at"]
+        indexes = (("status", "created_at"),)
     
     def __str__(self) -> str:
         return f"Download(user={self.user_id}, video={self.video_id}, status={self.status})"
@@ -111,4 +121,12 @@ class DownloadHistory(Model):
         self.status = DownloadStatus.FAILED
         self.completed_at = datetime.utcnow()
         self.error_message = error_message
-        await self.save(update_fields=["status", "completed_at", "error_message"]) 
\ No newline at end of file
+        await self.save(update_fields=["status", "completed_at", "error_message"])
+    
+    async def mark_as_cancelled(self, reason: str = None) -> None:
+        """Отмечает скачивание как отмененное"""
+        from datetime import datetime
+        self.status = DownloadStatus.CANCELLED
+        self.completed_at = datetime.utcnow()
+        self.error_message = reason
+        await self.save(update_fields=["status", "completed_at", "error_message"])
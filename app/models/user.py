@@ -5,6 +5,7 @@ from datetime import datetime
 from typing import List, Optional
 from tortoise.models import Model
 from tortoise import fields
+from tortoise.expressions import F
 
 
 class User(Model):
@@ -44,10 +45,13 @@ class User(Model):
         await self.save(update_fields=["last_activity"])
     
     async def increment_downloads(self, file_size: int = 0) -> None:
-        """Увеличивает счетчик скачиваний"""
+        """Увеличивает счетчик скачиваний атомарно в базе, без чтения текущего значения"""
         self.total_downloads += 1
         self.total_download_size += file_size
-        await self.save(update_fields=["total_downloads", "total_download_size"])
+        await User.filter(id=self.id).update(
+            total_downloads=F("total_downloads") + 1,
+            total_download_size=F("total_download_size") + file_size
+        )
     
     @property
     def full_name(self) -> str:
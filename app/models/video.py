@@ -4,6 +4,7 @@
 from typing import Optional
 from tortoise.models import Model
 from tortoise import fields
+from tortoise.expressions import F
 
 
 class Video(Model):
@@ -33,6 +34,7 @@ class Video(Model):
     # Даты
     created_at = fields.DatetimeField(auto_now_add=True, description="Дата добавления")
     updated_at = fields.DatetimeField(auto_now=True, description="Дата обновления")
+    refreshed_at = fields.DatetimeField(null=True, description="Дата последнего получения информации с YouTube")
     
     # Связи
     download_history: fields.ReverseRelation["DownloadHistory"]
@@ -77,6 +79,6 @@ class Video(Model):
         return f"{self.file_size:.1f} ТБ"
     
     async def increment_download_count(self) -> None:
-        """Увеличивает счетчик скачиваний"""
+        """Увеличивает счетчик скачиваний атомарно в базе, без чтения текущего значения"""
         self.download_count += 1
-        await self.save(update_fields=["download_count"]) 
\ No newline at end of file
+        await Video.filter(id=self.id).update(download_count=F("download_count") + 1) 
\ No newline at end of file
@@ -1,9 +1,22 @@
 """
 Сервисы приложения
+
+Сервисы импортируются при первом обращении: рабочие процессы yt-dlp
+импортируют только app.services.ytdlp_worker и не должны загружать модели,
+настройки и глобальные экземпляры остальных сервисов.
 """
+from importlib import import_module
+
+_EXPORTS = {
+    "YouTubeService": ".youtube_service",
+    "UserService": ".user_service",
+    "setup_logger": ".logger",
+}
+
+__all__ = list(_EXPORTS)
 
-from .youtube_service import YouTubeService
-from .user_service import UserService
-from .logger import setup_logger
 
-__all__ = ["YouTubeService", "UserService", "setup_logger"] 
\ No newline at end of file
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(import_module(_EXPORTS[name], __name__), name)
@@ -0,0 +1,104 @@
+"""
+Распределение полосы пропускания между одновременными скачиваниями
+"""
+import time
+from typing import Any, Dict, Set
+
+from app.config.settings import settings
+from app.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class BandwidthJob:
+    """Скачивание, которому выделены потоки фрагментов и ограничение скорости"""
+
+    def __init__(self, name: str, fragments: int, rate_limit: int):
+        self.name = name
+        self.fragments = fragments
+        self.rate_limit = rate_limit
+        self.started_at = time.monotonic()
+        self.speed = 0.0
+        # Скачано байт по каждому файлу задания (видео и аудио скачиваются отдельно)
+        self._downloaded: Dict[str, int] = {}
+
+    @property
+    def downloaded_bytes(self) -> int:
+        return sum(self._downloaded.values())
+
+    def record(self, event: Dict[str, Any]) -> None:
+        """Учитывает событие прогресса yt-dlp"""
+        self.speed = event.get('speed') or 0.0
+        downloaded = event.get('downloaded_bytes')
+        if downloaded:
+            self._downloaded[event.get('filename') or ''] = downloaded
+
+
+class BandwidthGovernor:
+    """
+    Распределяет общую полосу download_bandwidth_limit между скачиваниями.
+
+    Каждое скачивание при старте получает часть из download_max_fragments
+    потоков фрагментов: одно скачивание в простое получает все потоки, при
+    нагрузке они делятся поровну. Сама скорость ограничивается в пуле yt-dlp
+    общим token bucket (ytdlp_worker): в режиме thread он один на все
+    скачивания, поэтому свободная полоса сразу достается оставшимся
+    скачиваниям; в режиме process у каждого процесса свой bucket, и
+    скачивание получает долю полосы на момент старта.
+    """
+
+    def __init__(self, limit: int = None, max_fragments: int = None):
+        self.limit = limit if limit is not None else settings.download_bandwidth_limit
+        self.max_fragments = max_fragments or settings.download_max_fragments
+        self._jobs: Set[BandwidthJob] = set()
+
+        self.completed = 0
+        self.total_bytes = 0
+        self.total_time = 0.0
+
+    def start_job(self, name: str) -> BandwidthJob:
+        """Регистрирует скачивание и выделяет ему потоки фрагментов и скорость"""
+        active = len(self._jobs) + 1
+        fragments = max(self.max_fragments // active, 1)
+        rate_limit = self.limit
+        if settings.ytdlp_backend == "process" and self.limit:
+            rate_limit = max(self.limit // active, 1)
+
+        job = BandwidthJob(name, fragments, rate_limit)
+        self._jobs.add(job)
+        logger.debug(f"Скачивание {name}: потоков фрагментов {fragments}, ограничение {rate_limit} байт/с")
+        return job
+
+    def finish_job(self, job: BandwidthJob) -> None:
+        """Снимает скачивание с учета"""
+        if job not in self._jobs:
+            return
+        self._jobs.discard(job)
+        self.completed += 1
+        self.total_bytes += job.downloaded_bytes
+        self.total_time += time.monotonic() - job.started_at
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает суммарную скорость и скорость каждого скачивания"""
+        return {
+            'limit': self.limit,
+            'max_fragments': self.max_fragments,
+            'active': len(self._jobs),
+            'throughput': sum(job.speed for job in self._jobs),
+            'jobs': [
+                {
+                    'name': job.name,
+                    'speed': job.speed,
+                    'fragments': job.fragments,
+                    'downloaded_bytes': job.downloaded_bytes,
+                }
+                for job in sorted(self._jobs, key=lambda job: job.started_at)
+            ],
+            'completed': self.completed,
+            'total_bytes': self.total_bytes,
+            'avg_throughput': (self.total_bytes / self.total_time) if self.total_time else 0.0,
+        }
+
+
+# Глобальный экземпляр
+bandwidth_governor = BandwidthGovernor()
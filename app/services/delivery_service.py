@@ -0,0 +1,341 @@
+"""
+Сервис доставки скачанных файлов пользователям
+"""
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from aiogram import Bot
+from aiogram.types import Message, FSInputFile, InputMediaAudio, InputMediaVideo
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from app.models import User, Video, DownloadHistory
+from app.config.settings import settings
+from app.services.youtube_service import YouTubeService
+from app.services.file_id_cache import file_id_cache, CachedFile
+from app.services.media_splitter import media_splitter
+from app.services.stream_upload import stream_uploader
+from app.services.download_scheduler import download_scheduler
+from app.services.single_flight import SingleFlight
+from app.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Объединение одновременных загрузок одного файла в Telegram
+upload_flight = SingleFlight("upload")
+
+
+class DeliveryService:
+    """Сервис отправки файлов и статусов скачивания в Telegram"""
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.youtube_service = YouTubeService()
+
+    async def send_media(
+        self,
+        chat_id: int,
+        video: Video,
+        format_type: str,
+        media: Union[FSInputFile, str]
+    ) -> Message:
+        """Отправляет файл (FSInputFile, file_id или file:// путь для локального Bot API) в чат"""
+        if format_type == "mp3":
+            return await self.bot.send_audio(
+                chat_id,
+                media,
+                caption=f"🎵 <b>{video.title}</b>\n📺 {video.channel_name}",
+                parse_mode="HTML",
+                request_timeout=settings.telegram_upload_timeout
+            )
+        return await self.bot.send_video(
+            chat_id,
+            media,
+            caption=f"🎬 <b>{video.title}</b>\n📺 {video.channel_name}",
+            parse_mode="HTML",
+            request_timeout=settings.telegram_upload_timeout
+        )
+
+    async def send_media_group(
+        self,
+        chat_id: int,
+        video: Video,
+        format_type: str,
+        parts: List[Union[FSInputFile, str]]
+    ) -> List[Message]:
+        """Отправляет части файла одним альбомом, подпись - у первой части"""
+        media_class = InputMediaAudio if format_type == "mp3" else InputMediaVideo
+        icon = "🎵" if format_type == "mp3" else "🎬"
+        caption = f"{icon} <b>{video.title}</b>\n📺 {video.channel_name}\n🧩 Частей: {len(parts)}"
+        
+        return await self.bot.send_media_group(
+            chat_id,
+            [
+                media_class(media=part, caption=caption if index == 0 else None, parse_mode="HTML")
+                for index, part in enumerate(parts)
+            ],
+            request_timeout=settings.telegram_upload_timeout
+        )
+
+    async def edit_status(self, chat_id: int, message_id: Optional[int], text: str) -> None:
+        """Обновляет сообщение со статусом скачивания"""
+        if not message_id:
+            await self.bot.send_message(chat_id, text, parse_mode="HTML")
+            return
+
+        try:
+            await self.bot.edit_message_text(
+                text,
+                chat_id=chat_id,
+                message_id=message_id,
+                parse_mode="HTML"
+            )
+        except TelegramBadRequest as e:
+            # Сообщение не изменилось или удалено пользователем
+            logger.debug(f"Не удалось обновить статус в чате {chat_id}: {e}")
+        except TelegramRetryAfter as e:
+            # Статус второстепенен - при FloodWait пропускаем обновление
+            logger.debug(f"FloodWait при обновлении статуса в чате {chat_id}: {e.retry_after}s")
+
+    async def send_cached(
+        self,
+        chat_id: int,
+        message_id: Optional[int],
+        user: User,
+        video: Video,
+        quality: str,
+        format_type: str
+    ) -> bool:
+        """Пробует отправить файл по закэшированному file_id"""
+        cached = await file_id_cache.get(video.id, quality, format_type)
+        if not cached:
+            return False
+
+        try:
+            await self._send_cached_file(chat_id, video, format_type, cached)
+        except TelegramBadRequest as e:
+            # Telegram больше не принимает этот file_id - скачиваем заново
+            logger.warning(f"Устаревший file_id для видео {video.video_id}: {e}")
+            await file_id_cache.invalidate(video.id, quality, format_type, cached.file_id)
+            return False
+
+        await self.youtube_service.register_cached_download(
+            video=video,
+            user=user,
+            quality=quality,
+            format_type=format_type,
+            telegram_file_id=cached.file_id,
+            file_size=cached.file_size,
+            part_file_ids=cached.parts
+        )
+        await self.edit_status(chat_id, message_id, self.success_text(video, quality, format_type))
+        return True
+
+    async def deliver(self, download: DownloadHistory, video: Video) -> None:
+        """
+        Отправляет результат скачивания в чат, из которого оно было запрошено.
+        
+        FloodWait и сетевые ошибки Telegram пробрасываются для повторной попытки.
+        """
+        chat_id = download.chat_id
+        quality = download.quality
+        format_type = download.format_type
+
+        if not download.is_completed:
+            error_msg = download.error_message or "Неизвестная ошибка"
+            await self.edit_status(
+                chat_id,
+                download.message_id,
+                f"❌ <b>Ошибка скачивания:</b>\n{error_msg}\n\n"
+                "Попробуйте:\n"
+                "• Выбрать другое качество\n"
+                "• Проверить ссылку\n"
+                "• Повторить попытку позже"
+            )
+            return
+
+        if not download.file_path or not os.path.exists(download.file_path):
+            await self.edit_status(
+                chat_id,
+                download.message_id,
+                "❌ Файл не найден на сервере.\n"
+                "Попробуйте скачать заново."
+            )
+            return
+
+        try:
+            # Одновременные запросы одного файла загружаются в Telegram один раз,
+            # остальные пользователи получают его по file_id
+            uploaded, shared = await upload_flight.run(
+                (video.id, quality, format_type),
+                lambda: self._upload_file(chat_id, video, format_type, download.file_path)
+            )
+            if shared:
+                if uploaded:
+                    await self._send_cached_file(chat_id, video, format_type, uploaded)
+                else:
+                    uploaded = await self._upload_file(chat_id, video, format_type, download.file_path)
+
+            # Сохраняем file_id (и file_id частей) для повторного использования
+            if uploaded:
+                download.telegram_file_id = uploaded.file_id
+                update_fields = ["telegram_file_id"]
+                if uploaded.parts:
+                    download.metadata = {**(download.metadata or {}), 'part_file_ids': list(uploaded.parts)}
+                    update_fields.append("metadata")
+                await download.save(update_fields=update_fields)
+                file_id_cache.put(video.id, quality, format_type, uploaded.file_id, download.file_size, uploaded.parts)
+
+            await self.edit_status(chat_id, download.message_id, self.success_text(video, quality, format_type))
+
+        except (TelegramRetryAfter, TelegramNetworkError, TelegramServerError):
+            # Повторную отправку выполняет очередь отправки
+            raise
+        except TelegramBadRequest as e:
+            logger.error(f"Ошибка отправки файла: {e}")
+            await self.edit_status(
+                chat_id,
+                download.message_id,
+                "❌ Файл слишком большой для отправки через Telegram.\n"
+                "Попробуйте выбрать более низкое качество."
+            )
+        except Exception as e:
+            logger.error(f"Ошибка отправки файла: {e}")
+            await self.edit_status(
+                chat_id,
+                download.message_id,
+                "❌ Ошибка при отправке файла.\n"
+                "Попробуйте позже."
+            )
+
+    async def deliver_stream(
+        self,
+        download: DownloadHistory,
+        video: Video,
+        user: User,
+        source: Dict[str, Any]
+    ) -> bool:
+        """
+        Отправляет файл потоком со ссылки формата, не записывая его на диск.
+        
+        Возвращает False, если отправить не удалось - тогда файл
+        скачивается на диск и отправляется обычным путем.
+        """
+        format_type = download.format_type
+        media = stream_uploader.input_file(source, f"{video.title[:50]}.{source['ext']}")
+        try:
+            # Поток занимает слот скачивания так же, как скачивание на диск
+            async with download_scheduler.slot(user.id):
+                sent_message = await self.send_media(download.chat_id, video, format_type, media)
+        except Exception as e:
+            stream_uploader.record_fallback()
+            logger.warning(f"Не удалось отправить видео {video.video_id} потоком, скачиваем на диск: {e}")
+            return False
+
+        stream_uploader.record_success(source['size'])
+        file_id = self._get_sent_file_id(sent_message, format_type)
+        await self.youtube_service.register_streamed_download(download, video, user, file_id, source['size'])
+        if file_id:
+            file_id_cache.put(video.id, download.quality, format_type, file_id, source['size'])
+
+        await self.edit_status(
+            download.chat_id,
+            download.message_id,
+            self.success_text(video, download.quality, format_type)
+        )
+        return True
+
+    @staticmethod
+    def success_text(video: Video, quality: str, format_type: str) -> str:
+        """Текст сообщения об успешном скачивании"""
+        return (
+            f"✅ <b>Скачивание завершено!</b>\n\n"
+            f"🎬 <b>Видео:</b> {video.title}\n"
+            f"📹 <b>Качество:</b> {quality}\n"
+            f"📁 <b>Формат:</b> {format_type.upper()}\n"
+            f"💾 <b>Размер:</b> {video.file_size_formatted or 'Неизвестно'}"
+        )
+
+    async def _upload_file(
+        self,
+        chat_id: int,
+        video: Video,
+        format_type: str,
+        file_path: str
+    ) -> Optional[CachedFile]:
+        """
+        Загружает файл с диска в Telegram и возвращает его file_id.
+        
+        Файл больше max_file_size делится на части без перекодирования
+        и отправляется альбомом.
+        """
+        file_size = os.path.getsize(file_path)
+        if file_size <= settings.max_file_size:
+            sent_message = await self.send_media(
+                chat_id, video, format_type, self._input_file(video, format_type, file_path)
+            )
+            file_id = self._get_sent_file_id(sent_message, format_type)
+            return CachedFile(file_id, file_size) if file_id else None
+        
+        parts_dir, parts = await media_splitter.split(file_path)
+        try:
+            sent_messages = await self.send_media_group(
+                chat_id,
+                video,
+                format_type,
+                [
+                    self._input_file(video, format_type, part, index)
+                    for index, part in enumerate(parts, start=1)
+                ]
+            )
+        finally:
+            shutil.rmtree(parts_dir, ignore_errors=True)
+        
+        file_ids = tuple(self._get_sent_file_id(message, format_type) for message in sent_messages)
+        if not all(file_ids):
+            return None
+        return CachedFile(file_ids[0], file_size, file_ids)
+    
+    async def _send_cached_file(self, chat_id: int, video: Video, format_type: str, cached: CachedFile) -> None:
+        """Отправляет уже загруженный в Telegram файл (или его части) по file_id"""
+        if cached.parts:
+            await self.send_media_group(chat_id, video, format_type, list(cached.parts))
+        else:
+            await self.send_media(chat_id, video, format_type, cached.file_id)
+    
+    @staticmethod
+    def _input_file(video: Video, format_type: str, file_path: str, part: Optional[int] = None) -> Union[FSInputFile, str]:
+        """
+        Файл для отправки. Локальный сервер Bot API читает файл с диска сам
+        по file:// пути, поэтому бот не передает его содержимое
+        """
+        if not settings.telegram_api_server:
+            suffix = f" ({part})" if part else ""
+            return FSInputFile(
+                file_path,
+                filename=f"{video.title[:50]}{suffix}{Path(file_path).suffix}"
+            )
+        
+        path = Path(file_path).resolve()
+        if settings.telegram_api_download_path:
+            # Папка скачиваний смонтирована на сервере Bot API по другому пути
+            relative = path.relative_to(Path(settings.download_path).resolve())
+            path = Path(settings.telegram_api_download_path) / relative
+        return path.as_uri()
+
+    @staticmethod
+    def _get_sent_file_id(sent_message: Message, format_type: str) -> Optional[str]:
+        """Возвращает file_id из отправленного сообщения"""
+        if format_type == "mp3" and sent_message.audio:
+            return sent_message.audio.file_id
+        if sent_message.video:
+            return sent_message.video.file_id
+        if sent_message.document:
+            return sent_message.document.file_id
+        return None
@@ -0,0 +1,146 @@
+"""
+Счетчики скачиваний видео и пользователей с пакетной записью в базу
+"""
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from app.models import User, Video
+from app.config.settings import settings
+from app.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Прибавляют накопленные приращения ко всем записям одним запросом
+_FLUSH_VIDEOS_SQL = """
+UPDATE "videos" AS v
+SET "download_count" = v."download_count" + d."downloads"
+FROM unnest($1::int[], $2::int[]) AS d("id", "downloads")
+WHERE v."id" = d."id"
+"""
+_FLUSH_USERS_SQL = """
+UPDATE "users" AS u
+SET "total_downloads" = u."total_downloads" + d."downloads",
+    "total_download_size" = u."total_download_size" + d."size"
+FROM unnest($1::int[], $2::int[], $3::bigint[]) AS d("id", "downloads", "size")
+WHERE u."id" = d."id"
+"""
+
+
+class DownloadCounters:
+    """
+    Учет завершенных скачиваний в счетчиках видео и пользователя.
+
+    При counter_flush_interval = 0 каждое скачивание сразу увеличивает
+    счетчики атомарными UPDATE (Video.increment_download_count и
+    User.increment_downloads). Иначе приращения копятся в памяти и раз в
+    counter_flush_interval секунд, а также при остановке бота записываются
+    двумя запросами для всех видео и пользователей; значения в переданных
+    объектах моделей увеличиваются сразу.
+    """
+
+    def __init__(self, flush_interval: float = None):
+        self.flush_interval = (
+            flush_interval if flush_interval is not None else settings.counter_flush_interval
+        )
+        # id видео -> скачиваний
+        self._videos: Dict[int, int] = {}
+        # id пользователя -> [скачиваний, байт]
+        self._users: Dict[int, List[int]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+        self.recorded = 0
+        self.flushes = 0
+
+    async def record(self, video: Video, user: User, file_size: int = 0) -> None:
+        """Учитывает завершенное скачивание"""
+        self.recorded += 1
+        if not self.flush_interval:
+            await video.increment_download_count()
+            await user.increment_downloads(file_size)
+            return
+
+        video.download_count += 1
+        user.total_downloads += 1
+        user.total_download_size += file_size
+        self._videos[video.id] = self._videos.get(video.id, 0) + 1
+        counters = self._users.setdefault(user.id, [0, 0])
+        counters[0] += 1
+        counters[1] += file_size
+
+    async def flush(self) -> int:
+        """Записывает накопленные приращения, возвращает количество обновленных записей"""
+        if not self._videos and not self._users:
+            return 0
+
+        videos, self._videos = self._videos, {}
+        users, self._users = self._users, {}
+        written = len(videos) + len(users)
+        try:
+            if videos:
+                await Video._meta.db.execute_query(
+                    _FLUSH_VIDEOS_SQL, [list(videos), list(videos.values())]
+                )
+            # Приращения видео записаны - при ошибке возвращаем только пользователей
+            videos = {}
+            if users:
+                await User._meta.db.execute_query(
+                    _FLUSH_USERS_SQL,
+                    [
+                        list(users),
+                        [downloads for downloads, _ in users.values()],
+                        [size for _, size in users.values()],
+                    ]
+                )
+        except Exception:
+            # Приращения, появившиеся за время записи, складываем с незаписанными
+            for video_id, downloads in videos.items():
+                self._videos[video_id] = self._videos.get(video_id, 0) + downloads
+            for user_id, (downloads, size) in users.items():
+                counters = self._users.setdefault(user_id, [0, 0])
+                counters[0] += downloads
+                counters[1] += size
+            raise
+
+        self.flushes += 1
+        return written
+
+    async def start(self) -> None:
+        """Запускает периодическую запись счетчиков"""
+        if self.flush_interval:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Останавливает запись счетчиков и записывает оставшиеся приращения"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+
+        try:
+            written = await self.flush()
+            if written:
+                logger.info(f"Записаны счетчики скачиваний при остановке: {written}")
+        except Exception as e:
+            logger.error(f"Не удалось записать счетчики скачиваний при остановке: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику счетчиков"""
+        return {
+            'batched': bool(self.flush_interval),
+            'recorded': self.recorded,
+            'pending_videos': len(self._videos),
+            'pending_users': len(self._users),
+            'flushes': self.flushes,
+        }
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи счетчиков скачиваний: {e}")
+
+
+# Глобальный экземпляр
+download_counters = DownloadCounters()
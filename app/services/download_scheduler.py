@@ -0,0 +1,234 @@
+"""
+Планировщик скачиваний с ограничением параллельности
+"""
+import asyncio
+import multiprocessing
+import queue
+from collections import Counter, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from app.config.settings import settings
+from app.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class QueueFullError(Exception):
+    """Очередь скачиваний переполнена"""
+
+    def __init__(self, position: int, capacity: int):
+        self.position = position
+        self.capacity = capacity
+        super().__init__(f"Очередь скачиваний переполнена (позиция {position}, мест {capacity})")
+
+
+class DownloadScheduler:
+    """
+    Планировщик скачиваний.
+
+    Ограничивает общее количество одновременных скачиваний и количество
+    скачиваний одного пользователя. Запросы сверх лимита ждут в очереди
+    ограниченного размера, при переполнении очереди запрос отклоняется.
+    Блокирующие вызовы yt-dlp выполняются в собственном пуле потоков
+    или процессов (настройка ytdlp_backend).
+    """
+
+    def __init__(
+        self,
+        workers: int = None,
+        per_user_limit: int = None,
+        max_queue_size: int = None,
+        backend: str = None
+    ):
+        self.workers = workers or settings.download_workers
+        self.per_user_limit = per_user_limit or settings.download_per_user_limit
+        self.max_queue_size = max_queue_size if max_queue_size is not None else settings.download_queue_size
+
+        self.backend = backend or settings.ytdlp_backend
+        self.executor = self._create_executor(self.workers + settings.extract_workers)
+        self._manager = None
+
+        self._active = 0
+        self._active_per_user: Counter = Counter()
+        self._waiting: Deque[Tuple[int, asyncio.Future]] = deque()
+
+        # Статистика
+        self.started = 0
+        self.rejected = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    async def run_blocking(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Выполняет блокирующую функцию в пуле планировщика.
+
+        В режиме process функция и аргументы должны сериализоваться через pickle.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def create_progress_channel(self) -> Any:
+        """Создает канал для передачи прогресса из пула обратно в event loop"""
+        if self.backend == "process":
+            if self._manager is None:
+                self._manager = multiprocessing.get_context("spawn").Manager()
+            return self._manager.Queue()
+        return queue.Queue()
+
+    @staticmethod
+    async def pump_progress(
+        channel: Any,
+        on_progress: Callable[[Dict[str, Any]], Any],
+        interval: float = 0.5
+    ) -> None:
+        """Читает события прогресса из канала до получения None"""
+        while True:
+            try:
+                event = channel.get_nowait()
+            except queue.Empty:
+                await asyncio.sleep(interval)
+                continue
+            except (EOFError, OSError):
+                # Менеджер очередей остановлен
+                return
+
+            if event is None:
+                return
+            try:
+                on_progress(event)
+            except Exception as e:
+                logger.warning(f"Ошибка обработки прогресса скачивания: {e}")
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        user_id: int,
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None
+    ):
+        """
+        Занимает слот скачивания для пользователя.
+
+        Если свободных слотов нет, ждет в очереди и вызывает on_queued
+        с позицией в очереди. При переполнении очереди выбрасывает QueueFullError.
+        """
+        loop = asyncio.get_running_loop()
+        enqueued_at = loop.time()
+
+        if len(self._waiting) >= self.max_queue_size and not self._can_start(user_id):
+            self.rejected += 1
+            raise QueueFullError(len(self._waiting) + 1, self.max_queue_size)
+
+        future = loop.create_future()
+        self._waiting.append((user_id, future))
+        self._dispatch()
+
+        try:
+            if not future.done():
+                position = self._waiter_position(future)
+                logger.info(f"Скачивание пользователя {user_id} поставлено в очередь, позиция {position}")
+                if on_queued:
+                    try:
+                        await on_queued(position)
+                    except Exception as e:
+                        # Уведомление о позиции второстепенно - ожидание слота продолжается
+                        logger.warning(f"Не удалось сообщить пользователю {user_id} позицию в очереди: {e}")
+            await future
+        except BaseException:
+            # Отмена или ошибка ожидания: слот не должен остаться занятым или выданным в пустоту
+            if future.done() and not future.cancelled():
+                # Слот уже выдан - возвращаем его
+                self._release(user_id)
+            else:
+                self._remove_waiter(future)
+            raise
+
+        wait_time = loop.time() - enqueued_at
+        self.started += 1
+        self.total_wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+
+        try:
+            yield
+        finally:
+            self._release(user_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику планировщика"""
+        return {
+            'workers': self.workers,
+            'active': self._active,
+            'queue_depth': len(self._waiting),
+            'queue_capacity': self.max_queue_size,
+            'started': self.started,
+            'rejected': self.rejected,
+            'avg_wait_time': (self.total_wait_time / self.started) if self.started else 0.0,
+            'max_wait_time': self.max_wait_time,
+        }
+
+    def shutdown(self) -> None:
+        """Останавливает пул потоков или процессов"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+    def _create_executor(self, max_workers: int) -> Executor:
+        if self.backend == "process":
+            logger.info(f"yt-dlp выполняется в пуле из {max_workers} процессов")
+            return ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        logger.info(f"yt-dlp выполняется в пуле из {max_workers} потоков")
+        return ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="yt-dlp"
+        )
+
+    def _can_start(self, user_id: int) -> bool:
+        return (
+            self._active < self.workers
+            and self._active_per_user[user_id] < self.per_user_limit
+        )
+
+    def _acquire(self, user_id: int) -> None:
+        self._active += 1
+        self._active_per_user[user_id] += 1
+
+    def _release(self, user_id: int) -> None:
+        self._active -= 1
+        self._active_per_user[user_id] -= 1
+        if self._active_per_user[user_id] <= 0:
+            del self._active_per_user[user_id]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Выдает освободившиеся слоты ожидающим в порядке очереди"""
+        for user_id, future in list(self._waiting):
+            if self._active >= self.workers:
+                break
+            if future.done():
+                self._remove_waiter(future)
+                continue
+            if self._active_per_user[user_id] < self.per_user_limit:
+                self._remove_waiter(future)
+                self._acquire(user_id)
+                future.set_result(None)
+
+    def _waiter_position(self, future: asyncio.Future) -> int:
+        for position, (_, waiting_future) in enumerate(self._waiting, 1):
+            if waiting_future is future:
+                return position
+        return 0
+
+    def _remove_waiter(self, future: asyncio.Future) -> None:
+        for item in self._waiting:
+            if item[1] is future:
+                self._waiting.remove(item)
+                break
+
+
+# Глобальный экземпляр планировщика
+download_scheduler = DownloadScheduler()
@@ -0,0 +1,118 @@
+"""
+Кэш Telegram file_id для повторной отправки уже загруженных файлов
+"""
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple, NamedTuple
+
+from app.models import DownloadHistory, DownloadStatus
+from app.config.settings import settings
+from app.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class CachedFile(NamedTuple):
+    """Файл, уже загруженный в Telegram (для файла, отправленного частями, - file_id всех частей)"""
+    file_id: str
+    file_size: Optional[int] = None
+    parts: Tuple[str, ...] = ()
+
+
+class FileIdCache:
+    """
+    Кэш file_id по ключу (video_id, quality, format_type).
+
+    Сначала проверяется память процесса, затем история скачиваний в базе
+    данных, поэтому file_id, полученный одним процессом бота, доступен и другим.
+    """
+
+    def __init__(self, max_size: int = None):
+        self.max_size = max_size or settings.file_id_cache_size
+        self._cache: "OrderedDict[Tuple[int, str, str], CachedFile]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(video_id: int, quality: str, format_type: str) -> Tuple[int, str, str]:
+        """Формирует ключ кэша"""
+        return video_id, quality, format_type
+
+    async def get(self, video_id: int, quality: str, format_type: str) -> Optional[CachedFile]:
+        """Возвращает закэшированный файл или None"""
+        key = self.make_key(video_id, quality, format_type)
+
+        cached = self._cache.get(key)
+        if cached:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached
+
+        # Ищем file_id в истории скачиваний
+        record = await DownloadHistory.filter(
+            video_id=video_id,
+            quality=quality,
+            format_type=format_type,
+            status=DownloadStatus.COMPLETED,
+            telegram_file_id__not_isnull=True
+        ).order_by("-completed_at").first()
+
+        if record and record.telegram_file_id:
+            parts = tuple((record.metadata or {}).get('part_file_ids', ()))
+            cached = CachedFile(record.telegram_file_id, record.file_size, parts)
+            self._store(key, cached)
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        return None
+
+    def put(
+        self,
+        video_id: int,
+        quality: str,
+        format_type: str,
+        file_id: str,
+        file_size: Optional[int] = None,
+        parts: Tuple[str, ...] = ()
+    ) -> None:
+        """Сохраняет file_id в кэш"""
+        self._store(self.make_key(video_id, quality, format_type), CachedFile(file_id, file_size, parts))
+
+    async def invalidate(self, video_id: int, quality: str, format_type: str, file_id: str) -> None:
+        """Удаляет устаревший file_id из кэша и из истории скачиваний"""
+        key = self.make_key(video_id, quality, format_type)
+        cached = self._cache.get(key)
+        if cached and cached.file_id == file_id:
+            del self._cache[key]
+
+        await DownloadHistory.filter(
+            video_id=video_id,
+            quality=quality,
+            format_type=format_type,
+            telegram_file_id=file_id
+        ).update(telegram_file_id=None)
+
+        self.invalidations += 1
+        logger.warning(f"file_id для {key} отклонен Telegram и удален из кэша")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику кэша"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_rate': (self.hits / total * 100) if total > 0 else 0,
+        }
+
+    def _store(self, key: Tuple[int, str, str], cached: CachedFile) -> None:
+        self._cache[key] = cached
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+
+# Глобальный экземпляр кэша
+file_id_cache = FileIdCache()
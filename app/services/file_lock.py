@@ -0,0 +1,70 @@
+"""
+Блокировка файлов между процессами бота (flock)
+"""
+import asyncio
+import fcntl
+import os
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import Optional
+
+# Как часто проверять занятую блокировку, секунды
+_POLL_INTERVAL = 0.5
+
+
+def try_lock(path: Path) -> Optional[int]:
+    """
+    Берет эксклюзивную блокировку файла path, не дожидаясь ее освобождения.
+
+    Возвращает дескриптор файла (блокировка снимается при его закрытии)
+    или None, если блокировка занята. Владелец блокировки может удалить
+    файл блокировки перед закрытием: тот, кто ждал на удаленном файле,
+    заметит это и возьмет блокировку заново.
+    """
+    return _lock(path, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def _lock(path: Path, operation: int) -> Optional[int]:
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, operation)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+
+    try:
+        replaced = os.fstat(fd).st_ino != os.stat(path).st_ino
+    except FileNotFoundError:
+        replaced = True
+    if replaced:
+        os.close(fd)
+        return _lock(path, operation)
+    return fd
+
+
+@contextmanager
+def locked(path: Path):
+    """
+    Берет эксклюзивную блокировку файла path, блокируя поток до ее освобождения.
+    Только для коротких операций, например чтения и записи индекса
+    """
+    fd = _lock(path, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        os.close(fd)
+
+
+@asynccontextmanager
+async def file_lock(path: Path):
+    """Ждет эксклюзивную блокировку файла path, не блокируя event loop"""
+    while True:
+        fd = try_lock(path)
+        if fd is not None:
+            break
+        await asyncio.sleep(_POLL_INTERVAL)
+
+    try:
+        yield
+    finally:
+        os.close(fd)
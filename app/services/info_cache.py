@@ -0,0 +1,151 @@
+"""
+Кэш информации о видео (info dict yt-dlp) для скачивания без повторного извлечения
+"""
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from app.config.settings import settings
+from app.services.redis_client import get_redis
+from app.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Поля info dict, которые не нужны для скачивания
+_UNUSED_FIELDS = (
+    'description',
+    'thumbnails',
+    'subtitles',
+    'automatic_captions',
+    'heatmap',
+    'chapters',
+    'comments',
+    'tags',
+    'categories',
+    'requested_formats',
+    'requested_downloads',
+    'requested_subtitles',
+)
+
+# Запас до истечения ссылок на форматы: скачивание должно успеть начаться
+_EXPIRY_MARGIN = 600
+
+
+class InfoCache:
+    """
+    Кэш info dict по video_id.
+
+    Ссылки на форматы YouTube действуют несколько часов (параметр expire),
+    поэтому запись хранится не дольше, чем живут ее ссылки, и не дольше
+    info_cache_ttl. Если Redis включен, записи доступны всем процессам бота.
+    """
+
+    def __init__(self, max_size: int = None, ttl: int = None):
+        self.max_size = max_size or settings.info_cache_size
+        self.ttl = ttl or settings.info_cache_ttl
+        # video_id -> (время сохранения, время истечения, info dict)
+        self._cache: "OrderedDict[str, Tuple[float, float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self._served_age_sum = 0.0
+
+    async def get(self, video_id: str) -> Optional[Dict[str, Any]]:
+        """Возвращает info dict или None, если его нет или ссылки истекли"""
+        now = time.time()
+        entry = self._cache.get(video_id)
+        if entry is None:
+            entry = await self._get_from_redis(video_id)
+            if entry is not None:
+                self._store(video_id, entry)
+
+        if entry is None or entry[1] <= now:
+            self._cache.pop(video_id, None)
+            self.misses += 1
+            return None
+
+        self._cache.move_to_end(video_id)
+        self.hits += 1
+        self._served_age_sum += now - entry[0]
+        return entry[2]
+
+    async def put(self, video_id: str, info: Dict[str, Any]) -> None:
+        """Сохраняет info dict, оставляя только нужные для скачивания поля"""
+        now = time.time()
+        expires_at = min(now + self.ttl, self._links_expire_at(info) - _EXPIRY_MARGIN)
+        if expires_at <= now:
+            return
+
+        entry = (now, expires_at, self.trim(info))
+        self._store(video_id, entry)
+
+        redis = get_redis()
+        if redis is None:
+            return
+        try:
+            await redis.set(
+                f"info:{video_id}",
+                json.dumps(entry),
+                ex=max(int(expires_at - now), 1)
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить информацию о видео {video_id} в Redis: {e}")
+
+    def record_fallback(self, video_id: str) -> None:
+        """Отмечает, что закэшированная информация не подошла и видео извлекалось заново"""
+        self.fallbacks += 1
+        self._cache.pop(video_id, None)
+        logger.info(f"Информация о видео {video_id} устарела, выполнено повторное извлечение")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику кэша"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'fallbacks': self.fallbacks,
+            'hit_rate': (self.hits / total * 100) if total > 0 else 0,
+            'avg_age': (self._served_age_sum / self.hits) if self.hits else 0.0,
+        }
+
+    @staticmethod
+    def trim(info: Dict[str, Any]) -> Dict[str, Any]:
+        """Удаляет из info dict поля, не нужные для скачивания"""
+        return {key: value for key, value in info.items() if key not in _UNUSED_FIELDS}
+
+    @staticmethod
+    def _links_expire_at(info: Dict[str, Any]) -> float:
+        """Время истечения самой ранней ссылки на формат"""
+        expire_times = []
+        for fmt in info.get('formats') or []:
+            expire = parse_qs(urlparse(fmt.get('url') or '').query).get('expire')
+            if expire and expire[0].isdigit():
+                expire_times.append(float(expire[0]))
+        return min(expire_times) if expire_times else float('inf')
+
+    async def _get_from_redis(self, video_id: str) -> Optional[Tuple[float, float, Dict[str, Any]]]:
+        redis = get_redis()
+        if redis is None:
+            return None
+        try:
+            data = await redis.get(f"info:{video_id}")
+        except Exception as e:
+            logger.warning(f"Не удалось получить информацию о видео {video_id} из Redis: {e}")
+            return None
+        if not data:
+            return None
+        stored_at, expires_at, info = json.loads(data)
+        return stored_at, expires_at, info
+
+    def _store(self, video_id: str, entry: Tuple[float, float, Dict[str, Any]]) -> None:
+        self._cache[video_id] = entry
+        self._cache.move_to_end(video_id)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+
+# Глобальный экземпляр кэша
+info_cache = InfoCache()
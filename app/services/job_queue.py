@@ -0,0 +1,381 @@
+"""
+Очередь скачиваний в PostgreSQL
+
+Задания хранятся в таблице download_history: запись в статусе PENDING
+ожидает обработчика, обработчик забирает ее через
+SELECT ... FOR UPDATE SKIP LOCKED, переводит в DOWNLOADING и периодически
+обновляет heartbeat_at. Задания обработчиков, переставших подавать сигналы
+жизни (упавший или перезапущенный процесс), возвращаются в очередь.
+
+Скачанное задание остается за обработчиком до отправки файла в Telegram:
+если процесс не успел отправить файл, отправка повторяется без скачивания.
+"""
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot
+from tortoise.expressions import F
+from tortoise.queryset import Q
+from tortoise.transactions import in_transaction
+
+from app.models import User, Video, DownloadHistory, DownloadStatus
+from app.config.settings import settings
+from app.services.youtube_service import YouTubeService
+from app.services.delivery_service import DeliveryService
+from app.services.download_scheduler import QueueFullError
+from app.services.progress_reporter import ProgressReporter
+from app.services.upload_queue import UploadQueue
+from app.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Забирает самое старое задание пользователя, у которого меньше
+# download_per_user_limit активных скачиваний
+_CLAIM_SQL = """
+UPDATE "download_history"
+SET "status" = 'downloading',
+    "worker_id" = $1,
+    "heartbeat_at" = $2,
+    "started_at" = $2,
+    "attempts" = "attempts" + 1
+WHERE "id" = (
+    SELECT "id" FROM "download_history"
+    WHERE "status" = 'pending'
+      AND "chat_id" IS NOT NULL
+      AND "user_id" NOT IN (
+          SELECT "user_id" FROM "download_history"
+          WHERE "status" = 'downloading'
+          GROUP BY "user_id"
+          HAVING COUNT(*) >= $3
+      )
+    ORDER BY "created_at"
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING "id"
+"""
+
+# Ключ advisory-блокировки, под которой задания ставятся в очередь по одному
+_ENQUEUE_LOCK_KEY = 0x79745F71
+
+
+class DownloadJobQueue:
+    """Очередь скачиваний с обработчиками и восстановлением после сбоев"""
+
+    def __init__(self, bot: Bot, workers: int = None):
+        self.bot = bot
+        self.workers = workers or settings.download_workers
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.youtube_service = YouTubeService()
+        self.delivery_service = DeliveryService(bot)
+        self.upload_queue = UploadQueue(self.delivery_service)
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+
+    async def enqueue(
+        self,
+        video: Video,
+        user: User,
+        quality: str,
+        format_type: str,
+        chat_id: int,
+        message_id: Optional[int] = None
+    ) -> int:
+        """
+        Ставит скачивание в очередь и возвращает позицию в ней.
+
+        При переполнении очереди выбрасывает QueueFullError.
+
+        Проверка заполненности и создание задания выполняются в одной
+        транзакции под advisory-блокировкой: иначе одновременные запросы
+        (в том числе из разных процессов бота) увидели бы одно и то же
+        количество заданий и превысили бы лимит очереди.
+        """
+        async with in_transaction() as connection:
+            await connection.execute_query("SELECT pg_advisory_xact_lock($1)", [_ENQUEUE_LOCK_KEY])
+            pending = await DownloadHistory.filter(
+                status=DownloadStatus.PENDING,
+                chat_id__not_isnull=True
+            ).using_db(connection).count()
+            if pending >= settings.download_queue_size:
+                raise QueueFullError(pending + 1, settings.download_queue_size)
+
+            await DownloadHistory.create(
+                user=user,
+                video=video,
+                quality=quality,
+                format_type=format_type,
+                status=DownloadStatus.PENDING,
+                chat_id=chat_id,
+                message_id=message_id,
+                using_db=connection
+            )
+        self._wakeup.set()
+        return pending + 1
+
+    async def start(self) -> None:
+        """Возвращает в очередь зависшие задания и запускает обработчики"""
+        await self.reclaim_stale_jobs()
+        await self.youtube_service.cleanup_partial_downloads()
+
+        await self.upload_queue.start()
+        for index in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker_loop(index)))
+        self._tasks.append(asyncio.create_task(self._reclaim_loop()))
+
+        logger.info(f"Очередь скачиваний запущена: {self.workers} обработчиков, worker_id={self.worker_id}")
+
+    async def stop(self) -> None:
+        """Останавливает обработчики и возвращает незавершенные задания в очередь"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        await self.upload_queue.stop()
+
+        # Плановая остановка - не сбой скачивания, попытка не засчитывается
+        returned = await DownloadHistory.filter(
+            worker_id=self.worker_id,
+            status=DownloadStatus.DOWNLOADING
+        ).update(
+            status=DownloadStatus.PENDING,
+            worker_id=None,
+            heartbeat_at=None,
+            attempts=F("attempts") - 1
+        )
+        if returned:
+            logger.info(f"Возвращено в очередь незавершенных скачиваний: {returned}")
+
+    async def reclaim_stale_jobs(self) -> int:
+        """Возвращает в очередь задания обработчиков, переставших подавать сигналы жизни"""
+        stale_before = datetime.utcnow() - timedelta(seconds=settings.job_stale_timeout)
+        stale_jobs = await DownloadHistory.filter(
+            status=DownloadStatus.DOWNLOADING,
+            heartbeat_at__lt=stale_before
+        )
+        # Записи, созданные до появления очереди, не имеют heartbeat_at
+        stale_jobs += await DownloadHistory.filter(
+            status=DownloadStatus.DOWNLOADING,
+            heartbeat_at__isnull=True,
+            started_at__lt=stale_before
+        )
+
+        reclaimed = 0
+        for job in stale_jobs:
+            if job.chat_id is None or job.attempts >= settings.job_max_attempts:
+                await job.mark_as_failed("Скачивание прервано перезапуском бота")
+                # Задание больше никто не обрабатывает - отправка ему не нужна
+                await DownloadHistory.filter(id=job.id).update(worker_id=None, heartbeat_at=None)
+                if job.chat_id is not None:
+                    try:
+                        await self.delivery_service.edit_status(
+                            job.chat_id,
+                            job.message_id,
+                            "❌ Не удалось скачать видео: скачивание несколько раз прерывалось.\n"
+                            "Попробуйте позже."
+                        )
+                    except Exception as e:
+                        logger.warning(f"Не удалось сообщить об ошибке скачивания {job.id}: {e}")
+                continue
+
+            updated = await DownloadHistory.filter(
+                id=job.id,
+                status=DownloadStatus.DOWNLOADING,
+                worker_id=job.worker_id
+            ).update(status=DownloadStatus.PENDING, worker_id=None, heartbeat_at=None)
+            reclaimed += updated
+
+        if reclaimed:
+            logger.warning(f"Возвращено в очередь зависших скачиваний: {reclaimed}")
+            self._wakeup.set()
+
+        await self.reclaim_stale_uploads(stale_before)
+        return reclaimed
+
+    async def reclaim_stale_uploads(self, stale_before: datetime) -> int:
+        """Снова ставит в очередь отправки файлы, которые скачал и не отправил другой обработчик"""
+        stale_uploads = await DownloadHistory.filter(
+            Q(heartbeat_at__lt=stale_before) | Q(heartbeat_at__isnull=True),
+            status__in=[DownloadStatus.COMPLETED, DownloadStatus.FAILED],
+            worker_id__not_isnull=True,
+            chat_id__not_isnull=True
+        )
+
+        resubmitted = 0
+        for download in stale_uploads:
+            # Забираем отправку себе, если ее не забрал другой обработчик
+            updated = await DownloadHistory.filter(
+                id=download.id,
+                worker_id=download.worker_id
+            ).update(worker_id=self.worker_id, heartbeat_at=datetime.utcnow())
+            if not updated:
+                continue
+
+            if download.telegram_file_id:
+                # Telegram уже принял файл, обработчик не успел освободить задание
+                await DownloadHistory.filter(id=download.id).update(worker_id=None, heartbeat_at=None)
+                continue
+
+            video = await Video.get(id=download.video_id)
+            self.upload_queue.submit(download, video)
+            resubmitted += 1
+
+        if resubmitted:
+            logger.warning(f"Повторно поставлено в очередь отправки файлов: {resubmitted}")
+        return resubmitted
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику очереди"""
+        pending = await DownloadHistory.filter(
+            status=DownloadStatus.PENDING,
+            chat_id__not_isnull=True
+        ).count()
+        downloading = await DownloadHistory.filter(status=DownloadStatus.DOWNLOADING).count()
+        oldest = await DownloadHistory.filter(
+            status=DownloadStatus.PENDING,
+            chat_id__not_isnull=True
+        ).order_by("created_at").first()
+
+        return {
+            'pending': pending,
+            'downloading': downloading,
+            'oldest_wait': (datetime.utcnow() - oldest.created_at.replace(tzinfo=None)).total_seconds()
+            if oldest else 0.0,
+        }
+
+    @staticmethod
+    def queue_full_text(error: QueueFullError) -> str:
+        """Текст ответа при переполненной очереди"""
+        return (
+            "⏳ Очередь скачиваний заполнена.\n"
+            f"Ваша позиция была бы {error.position}, а мест в очереди {error.capacity}.\n"
+            "Попробуйте через несколько минут."
+        )
+
+    async def _claim(self) -> Optional[DownloadHistory]:
+        """Забирает следующее задание из очереди"""
+        async with in_transaction() as connection:
+            rows = await connection.execute_query_dict(
+                _CLAIM_SQL,
+                [self.worker_id, datetime.utcnow(), settings.download_per_user_limit]
+            )
+        if not rows:
+            return None
+        return await DownloadHistory.get(id=rows[0]["id"])
+
+    async def _worker_loop(self, index: int) -> None:
+        while True:
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка получения задания из очереди: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.job_poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heartbeat = asyncio.create_task(self._heartbeat_loop(job.id))
+            try:
+                await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка обработки задания {job.id}: {e}")
+            finally:
+                heartbeat.cancel()
+
+    async def _process(self, job: DownloadHistory) -> None:
+        """Скачивает видео задания и отправляет результат в чат"""
+        video = await Video.get(id=job.video_id)
+        user = await User.get(id=job.user_id)
+
+        header = (
+            f"⏳ Скачиваем видео: <b>{video.title}</b>\n"
+            f"📹 Качество: {job.quality}\n"
+            f"📁 Формат: {job.format_type.upper()}"
+        )
+        await self.delivery_service.edit_status(
+            job.chat_id,
+            job.message_id,
+            f"{header}\n\nЭто может занять некоторое время..."
+        )
+        progress = ProgressReporter(self.delivery_service, job.chat_id, job.message_id, header)
+
+        async def notify_queued(position: int) -> None:
+            await self.delivery_service.edit_status(
+                job.chat_id,
+                job.message_id,
+                f"🕐 Скачивание в очереди: <b>{video.title}</b>\n"
+                f"📹 Качество: {job.quality}\n"
+                f"📁 Формат: {job.format_type.upper()}\n\n"
+                f"Ваша позиция в очереди: {position}"
+            )
+
+        # Небольшие файлы отправляются потоком со ссылки формата, без записи на диск
+        stream_source = await self.youtube_service.plan_stream(video, job.quality, job.format_type)
+        if stream_source and await self.delivery_service.deliver_stream(job, video, user, stream_source):
+            await DownloadHistory.filter(id=job.id).update(worker_id=None, heartbeat_at=None)
+            return
+
+        try:
+            download = await self.youtube_service.download_video(
+                video=video,
+                user=user,
+                quality=job.quality,
+                format_type=job.format_type,
+                on_queued=notify_queued,
+                on_progress=progress,
+                download=job
+            )
+        except QueueFullError as e:
+            await self.delivery_service.edit_status(job.chat_id, job.message_id, self.queue_full_text(e))
+            # Задание завершено - освобождаем его
+            await DownloadHistory.filter(id=job.id).update(worker_id=None, heartbeat_at=None)
+        else:
+            await progress.finish()
+            if progress.average_speed is not None:
+                download.download_speed = progress.average_speed
+                await download.save(update_fields=["download_speed"])
+            # Отправкой занимается отдельная очередь, обработчик сразу берет следующее скачивание.
+            # Задание освобождает очередь отправки, когда Telegram примет файл
+            if download.is_completed:
+                await self.delivery_service.edit_status(
+                    job.chat_id,
+                    job.message_id,
+                    f"{header}\n\n📤 Файл скачан, отправляем..."
+                )
+            self.upload_queue.submit(download, video)
+
+    async def _heartbeat_loop(self, job_id: int) -> None:
+        while True:
+            await asyncio.sleep(settings.job_heartbeat_interval)
+            try:
+                await DownloadHistory.filter(
+                    id=job_id,
+                    worker_id=self.worker_id
+                ).update(heartbeat_at=datetime.utcnow())
+            except Exception as e:
+                logger.warning(f"Не удалось обновить heartbeat задания {job_id}: {e}")
+
+    async def _reclaim_loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.job_stale_timeout)
+            try:
+                await self.reclaim_stale_jobs()
+            except Exception as e:
+                logger.error(f"Ошибка восстановления зависших скачиваний: {e}")
+            try:
+                await self.youtube_service.cleanup_partial_downloads()
+            except Exception as e:
+                logger.error(f"Ошибка удаления недокачанных файлов: {e}")
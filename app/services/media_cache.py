@@ -0,0 +1,366 @@
+"""
+Кэш скачанных файлов на диске с ограничением по объему
+"""
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from app.config.settings import settings
+from app.services.file_lock import locked
+from app.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Недавно выданные файлы не вытесняются, пока очередь отправки их не закрепила
+_EVICTION_GRACE_PERIOD = 300
+
+
+class MediaCache:
+    """
+    Кэш файлов по ключу (video_id, format_id, ext).
+
+    Файлы хранятся в {download_path}/cache/{video_id}/{format_id}.{ext}.
+    Запрос пользователя (video_id, quality, format_type) связывается с ключом
+    файла, который yt-dlp выбрал для него, поэтому повторный запрос не
+    обращается к yt-dlp. При превышении бюджета вытесняются файлы по
+    политике LRU или LFU, кроме закрепленных на время отправки.
+
+    Индекс хранится в index.json. Папку кэша могут использовать несколько
+    процессов бота: перед каждой записью индекс блокируется (index.lock)
+    и объединяется с записанным другими процессами, поэтому процесс видит
+    чужие файлы и закрепления и не вытесняет отправляемые другими файлы.
+    """
+
+    def __init__(self, root: Path = None, max_bytes: int = None, policy: str = None):
+        self.root = Path(root or Path(settings.download_path) / "cache")
+        self.max_bytes = max_bytes or settings.media_cache_max_bytes
+        self.policy = policy or settings.media_cache_policy
+        self.index_path = self.root / "index.json"
+        self.lock_path = self.root / "index.lock"
+
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._aliases: Dict[str, str] = {}
+        # Файлы, отправляемые этим процессом, и количество их отправок.
+        # В индексе закрепления хранятся по владельцам - экземплярам кэша
+        self._pins: Dict[str, int] = {}
+        self._owner = uuid.uuid4().hex
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_evicted = 0
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def content_key(video_id: str, format_id: str, ext: str) -> str:
+        """Ключ файла в кэше"""
+        return f"{video_id}/{format_id.replace('/', '_')}.{ext}"
+
+    @staticmethod
+    def request_key(video_id: str, quality: str, format_type: str) -> str:
+        """Ключ запроса пользователя"""
+        return f"{video_id}:{quality}:{format_type}"
+
+    def get(self, video_id: str, quality: str, format_type: str) -> Optional[Tuple[str, int]]:
+        """Возвращает путь и размер закэшированного файла для запроса"""
+        key = self._aliases.get(self.request_key(video_id, quality, format_type))
+        entry = self._entries.get(key) if key else None
+
+        if entry is None or not self._path(key).exists():
+            if entry is not None:
+                self._forget(key)
+            self.misses += 1
+            return None
+
+        entry['last_access'] = time.time()
+        entry['hits'] += 1
+        self.hits += 1
+        return str(self._path(key)), entry['size']
+
+    def put(
+        self,
+        video_id: str,
+        quality: str,
+        format_type: str,
+        format_id: str,
+        ext: str,
+        source_path: str,
+        height: Optional[int] = None,
+        transcode: Optional[Dict[str, Any]] = None
+    ) -> Tuple[str, int]:
+        """
+        Перемещает скачанный файл в кэш и возвращает его новый путь и размер.
+        transcode - статистика задания ffmpeg, которым получен файл
+        """
+        key = self.content_key(video_id, format_id or "unknown", ext)
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self._shared_index():
+            os.replace(source_path, path)
+            size = path.stat().st_size
+            self._entries[key] = {
+                'size': size,
+                'last_access': time.time(),
+                'hits': 0,
+                'format_type': format_type,
+                'height': height,
+            }
+            if transcode:
+                self._entries[key]['transcode'] = transcode
+            self._aliases[self.request_key(video_id, quality, format_type)] = key
+
+            self._enforce_budget(keep=key)
+        return str(path), size
+
+    def find_master(self, video_id: str, min_height: Optional[int] = None) -> Optional[Tuple[str, str, int]]:
+        """
+        Ищет в кэше видео этого ролика, из которого можно получить файл
+        качества min_height (или MP3, если min_height не задан).
+
+        Возвращает ключ, путь и высоту самого легкого подходящего файла.
+        """
+        candidates = [
+            (entry['size'], key, entry['height'])
+            for key, entry in self._entries.items()
+            if key.startswith(f"{video_id}/")
+            and entry.get('format_type') == 'mp4'
+            and entry.get('height')
+            and (min_height is None or entry['height'] >= min_height)
+            and self._path(key).exists()
+        ]
+        if not candidates:
+            return None
+
+        _, key, height = min(candidates)
+        self._entries[key]['last_access'] = time.time()
+        return key, str(self._path(key)), height
+
+    def add_alias(self, video_id: str, quality: str, format_type: str, key: str) -> Optional[Tuple[str, int]]:
+        """
+        Связывает запрос с уже закэшированным файлом.
+        Возвращает None, если файл тем временем вытеснил другой процесс
+        """
+        with self._shared_index():
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry['last_access'] = time.time()
+            self._aliases[self.request_key(video_id, quality, format_type)] = key
+        return str(self._path(key)), entry['size']
+
+    def transcode_job(self, file_path: str) -> Optional[Dict[str, Any]]:
+        """Статистика перекодирования, которым получен закэшированный файл"""
+        key = self._key(file_path)
+        entry = self._entries.get(key) if key else None
+        return entry.get('transcode') if entry else None
+
+    def contains_path(self, file_path: str) -> bool:
+        """Проверяет, принадлежит ли файл кэшу"""
+        return self._key(file_path) is not None
+
+    def pin(self, file_path: str) -> None:
+        """
+        Закрепляет файл кэша на время отправки: его не вытесняет ни этот,
+        ни другие процессы. В индексе закрепление действует job_stale_timeout
+        секунд и продлевается renew_pins, поэтому файлы упавшего процесса
+        снова можно вытеснять
+        """
+        key = self._key(file_path)
+        if key is None:
+            return
+        self._pins[key] = self._pins.get(key, 0) + 1
+        self.save()
+
+    def unpin(self, file_path: str) -> None:
+        """Снимает закрепление файла после отправки"""
+        key = self._key(file_path)
+        if key not in self._pins:
+            return
+        self._pins[key] -= 1
+        if not self._pins[key]:
+            del self._pins[key]
+            self.save()
+
+    def renew_pins(self) -> None:
+        """Продлевает в индексе закрепление файлов, которые еще отправляются"""
+        if self._pins:
+            self.save()
+
+    def enforce_budget(self) -> int:
+        """Вытесняет файлы сверх бюджета и возвращает количество освобожденных байт"""
+        before = self.bytes_evicted
+        with self._shared_index():
+            self._enforce_budget()
+        return self.bytes_evicted - before
+
+    @property
+    def size_bytes(self) -> int:
+        """Текущий объем кэша в байтах"""
+        return sum(entry['size'] for entry in self._entries.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику кэша"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'size_bytes': self.size_bytes,
+            'max_bytes': self.max_bytes,
+            'policy': self.policy,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / total * 100) if total > 0 else 0,
+            'evictions': self.evictions,
+            'bytes_evicted': self.bytes_evicted,
+        }
+
+    def save(self) -> None:
+        """Сохраняет индекс (время последнего обращения, счетчики и закрепления)"""
+        with self._shared_index():
+            pass
+
+    @contextmanager
+    def _shared_index(self):
+        """
+        Блокирует индекс между процессами на время изменения: перед ним
+        объединяет индекс с записанным на диск, после - сохраняет
+        """
+        with locked(self.lock_path):
+            self._merge_index(self._read_index())
+            yield
+            self._stamp_pins()
+            self._save_index()
+
+    def _stamp_pins(self) -> None:
+        """Записывает закрепления этого процесса в индекс и убирает истекшие"""
+        now = time.time()
+        for key, entry in self._entries.items():
+            pins = {
+                owner: until for owner, until in entry.pop('pins', {}).items()
+                if owner != self._owner and until > now
+            }
+            if key in self._pins:
+                pins[self._owner] = now + settings.job_stale_timeout
+            if pins:
+                entry['pins'] = pins
+
+    @staticmethod
+    def _is_pinned(entry: Dict[str, Any], now: float) -> bool:
+        return any(until > now for until in entry.get('pins', {}).values())
+
+    def _enforce_budget(self, keep: str = None) -> None:
+        total = self.size_bytes
+        if total <= self.max_bytes:
+            return
+
+        now = time.time()
+        if self.policy == "lfu":
+            order = sorted(self._entries.items(), key=lambda item: (item[1]['hits'], item[1]['last_access']))
+        else:
+            order = sorted(self._entries.items(), key=lambda item: item[1]['last_access'])
+
+        for key, entry in order:
+            if total <= self.max_bytes:
+                break
+            if (
+                key == keep
+                or key in self._pins
+                or self._is_pinned(entry, now)
+                or now - entry['last_access'] < _EVICTION_GRACE_PERIOD
+            ):
+                continue
+
+            try:
+                self._path(key).unlink(missing_ok=True)
+            except OSError as e:
+                logger.error(f"Ошибка удаления файла кэша {key}: {e}")
+                continue
+
+            total -= entry['size']
+            self.evictions += 1
+            self.bytes_evicted += entry['size']
+            self._forget(key)
+            logger.info(f"Файл {key} вытеснен из кэша ({entry['size']} байт)")
+
+    def _forget(self, key: str) -> None:
+        self._entries.pop(key, None)
+        for alias, target in list(self._aliases.items()):
+            if target == key:
+                del self._aliases[alias]
+
+        parent = self._path(key).parent
+        if parent.exists() and not any(parent.iterdir()):
+            parent.rmdir()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key
+
+    def _key(self, file_path: str) -> Optional[str]:
+        """Ключ файла по его пути или None, если файл не из кэша"""
+        try:
+            return Path(file_path).resolve().relative_to(self.root.resolve()).as_posix()
+        except ValueError:
+            return None
+
+    def _load_index(self) -> None:
+        with locked(self.lock_path):
+            self._merge_index(self._read_index())
+        logger.info(f"Кэш файлов загружен: {len(self._entries)} файлов, {self.size_bytes} байт")
+
+    def _read_index(self) -> Dict[str, Any]:
+        if not self.index_path.exists():
+            return {}
+
+        try:
+            return json.loads(self.index_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать индекс кэша файлов: {e}")
+            return {}
+
+    def _merge_index(self, data: Dict[str, Any]) -> None:
+        """
+        Объединяет индекс в памяти с записанным на диск: добавляет файлы
+        других процессов, берет более поздние обращения и закрепления с диска
+        и забывает файлы, которые вытеснили другие процессы
+        """
+        for key, stored in data.get('entries', {}).items():
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = stored
+                continue
+            entry['last_access'] = max(entry['last_access'], stored.get('last_access', 0))
+            entry['hits'] = max(entry['hits'], stored.get('hits', 0))
+            entry.pop('pins', None)
+            if stored.get('pins'):
+                entry['pins'] = stored['pins']
+        for alias, key in data.get('aliases', {}).items():
+            self._aliases.setdefault(alias, key)
+
+        # Оставляем только файлы, которые действительно есть на диске
+        for key in [key for key in self._entries if not self._path(key).exists()]:
+            self._entries.pop(key)
+        self._aliases = {
+            alias: key for alias, key in self._aliases.items()
+            if key in self._entries
+        }
+
+    def _save_index(self) -> None:
+        tmp_path = self.index_path.with_suffix(".tmp")
+        try:
+            tmp_path.write_text(
+                json.dumps({'entries': self._entries, 'aliases': self._aliases}),
+                encoding="utf-8"
+            )
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить индекс кэша файлов: {e}")
+
+
+# Глобальный экземпляр кэша
+media_cache = MediaCache()
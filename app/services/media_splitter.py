@@ -0,0 +1,145 @@
+"""
+Разбиение больших файлов на части для отправки в Telegram
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from app.config.settings import settings
+from app.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Части режутся по ключевым кадрам и могут получиться больше расчетной длины
+_SPLIT_MARGIN = 0.9
+# Во сколько раз уменьшать длину части, если какая-то часть не поместилась в лимит
+_SPLIT_SHRINK = 0.7
+_SPLIT_ATTEMPTS = 3
+
+
+class MediaSplitter:
+    """
+    Делит видео или аудио на последовательные части без перекодирования.
+
+    ffmpeg копирует потоки (-c copy) и режет их по ключевым кадрам, поэтому
+    каждая часть воспроизводится отдельно, а разбиение стоит только чтения
+    и записи файла. Одновременно выполняется не больше split_workers разбиений.
+    """
+
+    def __init__(self, workers: int = None, max_parts: int = None):
+        self.ffmpeg = shutil.which("ffmpeg")
+        self.ffprobe = shutil.which("ffprobe")
+        self.max_parts = max_parts or settings.split_max_parts
+        self._semaphore = asyncio.Semaphore(workers or settings.split_workers)
+
+        self.splits = 0
+        self.parts_created = 0
+        self.failures = 0
+
+    @property
+    def available(self) -> bool:
+        """Установлены ли ffmpeg и ffprobe"""
+        return bool(self.ffmpeg and self.ffprobe)
+
+    @property
+    def max_output_size(self) -> int:
+        """Максимальный размер файла, который можно отправить (целиком или частями)"""
+        parts = self.max_parts if self.available else 1
+        return settings.max_file_size * parts
+
+    async def split(self, file_path: str, part_size: int = None) -> Tuple[Path, List[str]]:
+        """
+        Делит файл на части не больше part_size байт.
+
+        Возвращает временную папку с частями (ее удаляет вызывающий код)
+        и пути частей по порядку.
+        """
+        part_size = part_size or settings.max_file_size
+
+        async with self._semaphore:
+            duration = await self._probe_duration(file_path)
+            file_size = os.path.getsize(file_path)
+            segment_time = duration * part_size * _SPLIT_MARGIN / file_size
+
+            # Префикс tmp: брошенные папки удаляет cleanup_partial_downloads
+            parts_dir = Path(tempfile.mkdtemp(prefix="tmp_parts_", dir=settings.download_path))
+            try:
+                for _ in range(_SPLIT_ATTEMPTS):
+                    parts = await self._segment(file_path, parts_dir, segment_time)
+                    if all(os.path.getsize(part) <= part_size for part in parts):
+                        break
+                    segment_time *= _SPLIT_SHRINK
+                else:
+                    raise Exception("Не удалось разделить файл на части допустимого размера")
+
+                if len(parts) > self.max_parts:
+                    raise Exception(f"Файл делится на {len(parts)} частей, допустимо не больше {self.max_parts}")
+            except Exception:
+                self.failures += 1
+                shutil.rmtree(parts_dir, ignore_errors=True)
+                raise
+
+        self.splits += 1
+        self.parts_created += len(parts)
+        logger.info(f"Файл {file_path} разделен на {len(parts)} частей")
+        return parts_dir, parts
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику разбиения"""
+        return {
+            'available': self.available,
+            'splits': self.splits,
+            'parts_created': self.parts_created,
+            'failures': self.failures,
+        }
+
+    async def _segment(self, file_path: str, parts_dir: Path, segment_time: float) -> List[str]:
+        """Режет файл на части длиной около segment_time секунд"""
+        for old_part in parts_dir.iterdir():
+            old_part.unlink()
+
+        ext = Path(file_path).suffix
+        args = [
+            self.ffmpeg, "-v", "error", "-y",
+            "-i", file_path,
+            "-map", "0",
+            "-c", "copy",
+            "-f", "segment",
+            "-segment_time", f"{segment_time:.3f}",
+            "-reset_timestamps", "1",
+        ]
+        if ext == ".mp4":
+            # Метаданные в начале файла, чтобы Telegram показывал превью и длительность
+            args += ["-segment_format_options", "movflags=+faststart"]
+        args.append(str(parts_dir / f"part%03d{ext}"))
+
+        await self._run(*args)
+        return sorted(str(part) for part in parts_dir.iterdir())
+
+    async def _probe_duration(self, file_path: str) -> float:
+        output = await self._run(
+            self.ffprobe, "-v", "error",
+            "-show_entries", "format=duration",
+            "-of", "default=noprint_wrappers=1:nokey=1",
+            file_path
+        )
+        return float(output.strip())
+
+    @staticmethod
+    async def _run(*args: str) -> str:
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise Exception(f"{Path(args[0]).name}: {stderr.decode(errors='replace')[-500:]}")
+        return stdout.decode()
+
+
+# Глобальный экземпляр
+media_splitter = MediaSplitter()
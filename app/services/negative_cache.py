@@ -0,0 +1,154 @@
+"""
+Кэш отказов: видео, которые нельзя скачать (приватные, удаленные, слишком длинные)
+"""
+import json
+import time
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from app.services.redis_client import get_redis
+from app.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Время хранения отказа по классу ошибки в секундах
+_TTL_BY_REASON = {
+    'private': 6 * 60 * 60,
+    'unavailable': 24 * 60 * 60,
+    'geo': 24 * 60 * 60,
+    'too_long': 7 * 24 * 60 * 60,
+    'transient': 60,
+}
+
+# Ответы пользователю по классу ошибки
+_TEXT_BY_REASON = {
+    'private': "🔒 Это приватное видео, скачать его нельзя.",
+    'unavailable': "❌ Видео удалено или недоступно на YouTube.",
+    'geo': "🌍 Видео недоступно в регионе сервера бота.",
+    'too_long': "⏱ Видео слишком длинное для скачивания.",
+    'transient': "⚠️ YouTube временно не отвечает.\nПопробуйте через минуту.",
+}
+
+# Фрагменты сообщений yt-dlp, по которым определяется класс ошибки (проверяются по порядку)
+_ERROR_PATTERNS = (
+    ('private', ('private video', 'video is private')),
+    ('geo', ('your country', 'geo restrict', 'geo-restrict')),
+    ('unavailable', ('video unavailable', 'has been removed', 'account associated with this video has been terminated',
+                     'does not exist', 'is not available')),
+)
+
+
+class Rejection(NamedTuple):
+    """Закэшированный отказ"""
+    reason: str
+    text: str
+
+
+class VideoUnavailableError(Exception):
+    """Видео нельзя скачать, text - ответ пользователю"""
+
+    def __init__(self, rejection: Rejection):
+        self.reason = rejection.reason
+        self.text = rejection.text
+        super().__init__(rejection.text)
+
+
+class NegativeCache:
+    """
+    Кэш отказов по video_id в памяти процесса и в Redis (если включен).
+
+    Время хранения зависит от класса ошибки: временные сбои хранятся
+    минуту, приватные и удаленные видео - часы, слишком длинные - неделю.
+    """
+
+    def __init__(self):
+        # video_id -> (время истечения, отказ)
+        self._cache: Dict[str, Tuple[float, Rejection]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.stored = {reason: 0 for reason in _TTL_BY_REASON}
+
+    @staticmethod
+    def classify(error: BaseException) -> str:
+        """Определяет класс ошибки извлечения информации"""
+        message = str(error).lower()
+        for reason, patterns in _ERROR_PATTERNS:
+            if any(pattern in message for pattern in patterns):
+                return reason
+        return 'transient'
+
+    async def get(self, video_id: str) -> Optional[Rejection]:
+        """Возвращает закэшированный отказ или None"""
+        entry = self._cache.get(video_id)
+        if entry is None:
+            entry = await self._get_from_redis(video_id)
+            if entry is not None:
+                self._cache[video_id] = entry
+
+        if entry is None or entry[0] <= time.time():
+            self._cache.pop(video_id, None)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry[1]
+
+    async def put(self, video_id: str, reason: str, text: Optional[str] = None) -> Rejection:
+        """Сохраняет отказ с временем хранения по его классу"""
+        rejection = Rejection(reason, text or _TEXT_BY_REASON[reason])
+        ttl = _TTL_BY_REASON[reason]
+        expires_at = time.time() + ttl
+        self._cache[video_id] = (expires_at, rejection)
+        self.stored[reason] += 1
+
+        # Память процесса не должна расти без ограничений
+        if len(self._cache) > 10000:
+            self._purge_expired()
+
+        redis = get_redis()
+        if redis is not None:
+            try:
+                await redis.set(f"negative:{video_id}", json.dumps([expires_at, *rejection]), ex=ttl)
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить отказ для видео {video_id} в Redis: {e}")
+
+        logger.info(f"Видео {video_id} отклонено ({reason}) на {ttl}s")
+        return rejection
+
+    async def record_error(self, video_id: str, error: BaseException) -> Rejection:
+        """Сохраняет отказ по ошибке yt-dlp"""
+        return await self.put(video_id, self.classify(error))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику кэша"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / total * 100) if total > 0 else 0,
+            'stored': dict(self.stored),
+        }
+
+    async def _get_from_redis(self, video_id: str) -> Optional[Tuple[float, Rejection]]:
+        redis = get_redis()
+        if redis is None:
+            return None
+        try:
+            data = await redis.get(f"negative:{video_id}")
+        except Exception as e:
+            logger.warning(f"Не удалось получить отказ для видео {video_id} из Redis: {e}")
+            return None
+        if not data:
+            return None
+        expires_at, reason, text = json.loads(data)
+        return expires_at, Rejection(reason, text)
+
+    def _purge_expired(self) -> None:
+        now = time.time()
+        for video_id, (expires_at, _) in list(self._cache.items()):
+            if expires_at <= now:
+                del self._cache[video_id]
+
+
+# Глобальный экземпляр кэша
+negative_cache = NegativeCache()
@@ -0,0 +1,122 @@
+"""
+Отображение прогресса скачивания в сообщении со статусом
+"""
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+from app.config.settings import settings
+from app.services.delivery_service import DeliveryService
+from app.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Время последнего редактирования сообщений по чатам, общее для всех скачиваний.
+# Записи старше progress_edit_interval больше ничего не ограничивают и удаляются
+_last_edit_by_chat: Dict[int, float] = {}
+_last_prune = 0.0
+
+
+def _record_edit(chat_id: int, now: float, interval: float) -> None:
+    """Запоминает время редактирования и не чаще раза в interval удаляет устаревшие записи"""
+    global _last_prune
+
+    _last_edit_by_chat[chat_id] = now
+    if now - _last_prune < interval:
+        return
+    _last_prune = now
+    for stale_chat_id in [
+        key for key, edited_at in _last_edit_by_chat.items() if now - edited_at >= interval
+    ]:
+        del _last_edit_by_chat[stale_chat_id]
+
+
+class ProgressReporter:
+    """
+    Принимает события прогресса yt-dlp и обновляет сообщение со статусом.
+
+    Вызывается из event loop (события читаются из канала планировщика),
+    поэтому не блокирует поток скачивания. Сообщения одного чата
+    редактируются не чаще, чем раз в progress_edit_interval секунд.
+    """
+
+    def __init__(self, delivery_service: DeliveryService, chat_id: int, message_id: Optional[int], header: str):
+        self.delivery_service = delivery_service
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.header = header
+        self.interval = settings.progress_edit_interval
+
+        self._edit_task: Optional[asyncio.Task] = None
+        self._speed_sum = 0.0
+        self._speed_samples = 0
+
+    def __call__(self, event: Dict[str, Any]) -> None:
+        """Обрабатывает событие прогресса"""
+        speed = event.get('speed')
+        if speed:
+            self._speed_sum += speed
+            self._speed_samples += 1
+
+        if not self.message_id or (self._edit_task and not self._edit_task.done()):
+            return
+
+        now = time.monotonic()
+        if now - _last_edit_by_chat.get(self.chat_id, 0.0) < self.interval and event.get('status') != 'finished':
+            return
+
+        _record_edit(self.chat_id, now, self.interval)
+        self._edit_task = asyncio.create_task(
+            self.delivery_service.edit_status(self.chat_id, self.message_id, self.render(event))
+        )
+
+    @property
+    def average_speed(self) -> Optional[float]:
+        """Средняя скорость скачивания в Мб/с"""
+        if not self._speed_samples:
+            return None
+        return self._speed_sum / self._speed_samples * 8 / 1_000_000
+
+    async def finish(self) -> None:
+        """Дожидается последнего редактирования сообщения"""
+        if self._edit_task and not self._edit_task.done():
+            try:
+                await self._edit_task
+            except Exception as e:
+                logger.debug(f"Ошибка обновления прогресса: {e}")
+
+    def render(self, event: Dict[str, Any]) -> str:
+        """Формирует текст сообщения с прогрессом"""
+        if event.get('status') == 'finished':
+            return f"{self.header}\n\n🔧 Обрабатываем файл..."
+
+        downloaded = event.get('downloaded_bytes') or 0
+        total = event.get('total_bytes') or event.get('total_bytes_estimate')
+
+        lines = [self.header, ""]
+        if total:
+            percent = min(downloaded / total * 100, 100.0)
+            filled = int(percent // 10)
+            lines.append(f"{'▓' * filled}{'░' * (10 - filled)} {percent:.1f}%")
+            lines.append(f"📦 {self._format_size(downloaded)} из {self._format_size(total)}")
+        else:
+            lines.append(f"📦 Скачано: {self._format_size(downloaded)}")
+
+        details = []
+        if event.get('speed'):
+            details.append(f"🚀 {self._format_size(event['speed'])}/с")
+        if event.get('eta') is not None:
+            minutes, seconds = divmod(int(event['eta']), 60)
+            details.append(f"⏱ {minutes:02d}:{seconds:02d}")
+        if details:
+            lines.append(" • ".join(details))
+
+        return "\n".join(lines)
+
+    @staticmethod
+    def _format_size(size: float) -> str:
+        for unit in ['Б', 'КБ', 'МБ']:
+            if size < 1024.0:
+                return f"{size:.1f} {unit}"
+            size /= 1024.0
+        return f"{size:.1f} ГБ"
@@ -0,0 +1,154 @@
+"""
+Ограничение частоты запросов пользователей по алгоритму GCRA
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+from app.config.settings import settings
+from app.services.redis_client import get_redis
+from app.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Погрешность сложения дробных стоимостей: 50 действий по 0.1 укладываются в бюджет 5
+_TOLERANCE = 1e-9
+
+# GCRA: в ключе хранится теоретическое время следующего запроса (TAT) с
+# точностью до микросекунды, запрос сдвигает его на ARGV[1] секунд, ARGV[3] -
+# допустимая погрешность.
+# Возвращает 0, если запрос разрешен, иначе сколько секунд ждать.
+# Время берется из Redis, поэтому часы процессов бота не обязаны совпадать
+_ACQUIRE_SCRIPT = """
+local now_parts = redis.call("time")
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local increment = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local tat = tonumber(redis.call("get", KEYS[1]))
+if tat == nil or tat < now then
+    tat = now
+end
+local new_tat = tat + increment
+local retry_after = new_tat - period - now
+if retry_after > tonumber(ARGV[3]) then
+    return tostring(retry_after)
+end
+redis.call("set", KEYS[1], string.format("%.6f", new_tat), "px", math.ceil((new_tat - now) * 1000))
+return "0"
+"""
+
+
+class MemoryRateLimiter:
+    """
+    Ограничение расхода limit единиц бюджета за period секунд в памяти процесса.
+
+    GCRA хранит на пользователя одно число - теоретическое время следующего
+    запроса (TAT). Запрос стоимостью cost сдвигает TAT на cost * period / limit,
+    запрос отклоняется, если TAT ушел бы вперед больше чем на period. Бюджет
+    пользователя - limit единиц: их можно потратить сразу, дальше они
+    восстанавливаются по одной раз в period / limit секунд. Проверка и
+    очистка устаревших записей выполняются за O(1) на запрос.
+    """
+
+    backend = "memory"
+
+    def __init__(self, limit: int = None, period: float = 60.0):
+        self.limit = limit or settings.rate_limit_requests
+        self.period = period
+        self.interval = self.period / self.limit
+        # ключ -> TAT, в порядке последнего обновления
+        self._tat: "OrderedDict[Hashable, float]" = OrderedDict()
+
+        self.allowed = 0
+        self.rejected = 0
+
+    async def acquire(self, key: Hashable, cost: float = 1.0) -> float:
+        """Учитывает запрос; возвращает 0, если он разрешен, иначе сколько секунд ждать"""
+        return self._count(self._acquire_local(key, self._increment(cost)))
+
+    def _increment(self, cost: float) -> float:
+        # Запрос дороже всего бюджета не был бы разрешен никогда
+        return min(cost, self.limit) * self.interval
+
+    def _acquire_local(self, key: Hashable, increment: float) -> float:
+        now = time.monotonic()
+        new_tat = max(self._tat.get(key, now), now) + increment
+        retry_after = new_tat - self.period - now
+        if retry_after > _TOLERANCE:
+            return retry_after
+
+        self._tat[key] = new_tat
+        self._tat.move_to_end(key)
+        # Записи в начале обновлялись раньше всех; истекшая запись не отличается от отсутствующей
+        while self._tat:
+            oldest_key, oldest_tat = next(iter(self._tat.items()))
+            if oldest_tat > now:
+                break
+            del self._tat[oldest_key]
+        return 0.0
+
+    def _count(self, retry_after: float) -> float:
+        if retry_after > 0:
+            self.rejected += 1
+        else:
+            self.allowed += 1
+        return retry_after
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику ограничения"""
+        return {
+            'backend': self.backend,
+            'limit': self.limit,
+            'period': self.period,
+            'tracked': len(self._tat),
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+        }
+
+
+class RedisRateLimiter(MemoryRateLimiter):
+    """
+    Ограничение частоты запросов, общее для всех процессов бота.
+
+    Проверка и обновление TAT выполняются одним Lua скриптом в Redis, то есть
+    за один запрос к Redis. Если Redis недоступен, используется ограничение
+    в памяти процесса с той же семантикой.
+    """
+
+    backend = "redis"
+
+    def __init__(self, limit: int = None, period: float = 60.0):
+        super().__init__(limit, period)
+        self.fallbacks = 0
+
+    async def acquire(self, key: Hashable, cost: float = 1.0) -> float:
+        redis = get_redis()
+        if redis is None:
+            return await super().acquire(key, cost)
+
+        try:
+            result = await redis.eval(
+                _ACQUIRE_SCRIPT, 1, f"rate_limit:{key}",
+                repr(self._increment(cost)), repr(self.period), repr(_TOLERANCE)
+            )
+        except Exception as e:
+            logger.warning(f"Ошибка ограничения запросов в Redis, используется память процесса: {e}")
+            self.fallbacks += 1
+            return await super().acquire(key, cost)
+        return self._count(float(result))
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = super().get_stats()
+        stats['fallbacks'] = self.fallbacks
+        return stats
+
+
+def create_rate_limiter(limit: int = None, period: float = 60.0) -> MemoryRateLimiter:
+    """Ограничение в Redis, если он включен, иначе в памяти процесса"""
+    if settings.redis_enabled:
+        return RedisRateLimiter(limit, period)
+    return MemoryRateLimiter(limit, period)
+
+
+# Глобальный экземпляр
+rate_limiter = create_rate_limiter()
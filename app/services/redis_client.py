@@ -0,0 +1,62 @@
+"""
+Подключение к Redis
+"""
+from typing import Optional, Any
+
+from app.config.settings import settings
+from app.services.logger import get_logger
+
+try:
+    from redis import asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+logger = get_logger(__name__)
+
+_redis: Optional[Any] = None
+# Об отсутствии клиента сообщаем один раз, а не при каждом обращении
+_missing_client_logged = False
+
+
+def get_redis() -> Optional[Any]:
+    """Возвращает клиент Redis или None, если Redis отключен или недоступен"""
+    global _redis, _missing_client_logged
+
+    if not settings.redis_enabled:
+        return None
+
+    if aioredis is None:
+        if not _missing_client_logged:
+            _missing_client_logged = True
+            logger.error(
+                "Redis включен в настройках, но пакет redis не установлен: блокировки, "
+                "кэши и ограничение запросов работают только в памяти процесса"
+            )
+        return None
+
+    if _redis is None:
+        _redis = aioredis.from_url(settings.redis_url, decode_responses=True)
+    return _redis
+
+
+async def close_redis() -> None:
+    """Закрывает соединение с Redis"""
+    global _redis
+
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
+        logger.info("Соединение с Redis закрыто")
+
+
+async def check_redis() -> None:
+    """Проверяет подключение к Redis при запуске, если он включен"""
+    redis = get_redis()
+    if redis is None:
+        return
+
+    try:
+        await redis.ping()
+        logger.info("Подключение к Redis установлено")
+    except Exception as e:
+        logger.error(f"Redis недоступен, до восстановления блокировки и кэши работают в памяти процесса: {e}")
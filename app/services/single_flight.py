@@ -0,0 +1,132 @@
+"""
+Объединение одновременных одинаковых операций (single-flight)
+"""
+import asyncio
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+from app.config.settings import settings
+from app.services.redis_client import get_redis
+from app.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# Удаляет ключ блокировки, только если он принадлежит текущему владельцу
+_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    Выполняет не более одной операции на ключ одновременно.
+
+    Первый вызов становится лидером и выполняет операцию, остальные ждут
+    ее результата. Ошибка лидера передается всем ожидающим. Если включен
+    Redis, лидер дополнительно берет распределенную блокировку, и лидеры
+    из разных процессов бота выполняются по очереди.
+    """
+
+    def __init__(self, name: str, lock_ttl: int = None):
+        self.name = name
+        self.lock_ttl = lock_ttl or settings.single_flight_lock_ttl
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        Выполняет func для ключа или ждет уже идущее выполнение.
+
+        Возвращает кортеж (результат, shared), где shared=True означает,
+        что результат получен от другого вызова.
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.leaders += 1
+
+        try:
+            async with self._distributed_lock(key):
+                result = await func()
+        except asyncio.CancelledError:
+            future.set_exception(RuntimeError("Операция была отменена"))
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self._calls.pop(key, None)
+            # Помечаем исключение как полученное, даже если ожидающих не было
+            if future.done() and not future.cancelled():
+                future.exception()
+
+    def in_flight(self) -> int:
+        """Количество выполняющихся операций"""
+        return len(self._calls)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику объединения"""
+        return {
+            'in_flight': self.in_flight(),
+            'leaders': self.leaders,
+            'shared': self.shared,
+        }
+
+    @asynccontextmanager
+    async def _distributed_lock(self, key: Hashable):
+        """Распределенная блокировка в Redis (если включена)"""
+        redis = get_redis()
+        if redis is None:
+            yield
+            return
+
+        lock_key = f"single_flight:{self.name}:{self._format_key(key)}"
+        token = uuid.uuid4().hex
+        acquired = await self._acquire(redis, lock_key, token)
+
+        try:
+            yield
+        finally:
+            if acquired:
+                try:
+                    await redis.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+                except Exception as e:
+                    logger.warning(f"Не удалось снять блокировку {lock_key}: {e}")
+
+    async def _acquire(self, redis: Any, lock_key: str, token: str) -> bool:
+        """Ждет распределенную блокировку не дольше ее TTL"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.lock_ttl
+
+        try:
+            while True:
+                if await redis.set(lock_key, token, nx=True, px=self.lock_ttl * 1000):
+                    return True
+                if loop.time() >= deadline:
+                    logger.warning(f"Блокировка {lock_key} не освобождена за {self.lock_ttl}s")
+                    return False
+                await asyncio.sleep(0.5)
+        except Exception as e:
+            # Redis недоступен - продолжаем без распределенной блокировки
+            logger.warning(f"Ошибка распределенной блокировки {lock_key}: {e}")
+            return False
+
+    @staticmethod
+    def _format_key(key: Hashable) -> str:
+        if isinstance(key, tuple):
+            return ":".join(str(part) for part in key)
+        return str(key)
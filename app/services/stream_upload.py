@@ -0,0 +1,111 @@
+"""
+Отправка небольших файлов в Telegram потоком со ссылки формата, без записи на диск
+"""
+import asyncio
+from typing import Any, AsyncGenerator, Dict, Optional
+
+from aiogram import Bot
+from aiogram.types import InputFile
+
+from app.config.settings import settings
+from app.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# YouTube ограничивает скорость запросов без Range, поэтому файл читается
+# кусками, как это делает yt-dlp (http_chunk_size)
+_RANGE_SIZE = 10 * 1024 * 1024
+_CHUNK_SIZE = 64 * 1024
+
+
+class StreamInputFile(InputFile):
+    """
+    Файл для multipart загрузки в Telegram, который читается со ссылки формата.
+
+    Чтение и отправка идут одновременно через буфер размером stream_buffer_size:
+    если Telegram принимает данные медленнее, чтение приостанавливается,
+    поэтому расход памяти не зависит от размера файла.
+    """
+
+    def __init__(self, url: str, headers: Dict[str, str], size: int, filename: str):
+        super().__init__(filename=filename, chunk_size=_CHUNK_SIZE)
+        self.url = url
+        self.headers = headers
+        self.size = size
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        buffer: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue(
+            maxsize=max(settings.stream_buffer_size // _CHUNK_SIZE, 1)
+        )
+        reader = asyncio.create_task(self._fetch(bot, buffer))
+        try:
+            while True:
+                chunk = await buffer.get()
+                if chunk is None:
+                    break
+                yield chunk
+            # Пробрасываем ошибку чтения, чтобы Telegram не получил обрезанный файл
+            await reader
+        finally:
+            reader.cancel()
+
+    async def _fetch(self, bot: Bot, buffer: "asyncio.Queue[Optional[bytes]]") -> None:
+        """Читает файл кусками по _RANGE_SIZE и складывает его в буфер"""
+        position = 0
+        try:
+            while position < self.size:
+                end = min(position + _RANGE_SIZE, self.size) - 1
+                range_start = position
+                async for chunk in bot.session.stream_content(
+                    self.url,
+                    headers={**self.headers, 'Range': f"bytes={position}-{end}"},
+                    timeout=settings.telegram_upload_timeout,
+                    chunk_size=_CHUNK_SIZE
+                ):
+                    await buffer.put(chunk)
+                    position += len(chunk)
+                if position == range_start:
+                    raise Exception(f"Ссылка вернула пустой ответ на позиции {position}")
+            if position != self.size:
+                raise Exception(f"Прочитано {position} байт из {self.size}")
+        except asyncio.CancelledError:
+            # Отправка прервана - читать буфер больше некому
+            raise
+        except Exception:
+            await buffer.put(None)
+            raise
+        await buffer.put(None)
+
+
+class StreamUploader:
+    """Создает потоковые файлы и ведет статистику потоковой отправки"""
+
+    def __init__(self):
+        self.streamed = 0
+        self.bytes_streamed = 0
+        self.fallbacks = 0
+
+    def input_file(self, source: Dict[str, Any], filename: str) -> StreamInputFile:
+        """Файл для отправки по описанию формата из plan_stream"""
+        return StreamInputFile(source['url'], source['headers'], source['size'], filename)
+
+    def record_success(self, size: int) -> None:
+        self.streamed += 1
+        self.bytes_streamed += size
+
+    def record_fallback(self) -> None:
+        self.fallbacks += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику потоковой отправки"""
+        return {
+            'enabled': settings.stream_max_size > 0,
+            'max_size': settings.stream_max_size,
+            'streamed': self.streamed,
+            'bytes_streamed': self.bytes_streamed,
+            'fallbacks': self.fallbacks,
+        }
+
+
+# Глобальный экземпляр
+stream_uploader = StreamUploader()
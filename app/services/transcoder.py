@@ -0,0 +1,215 @@
+"""
+Перекодирование ffmpeg: получение файлов другого качества из уже
+скачанного видео и извлечение аудио (MP3 или копирование потока)
+"""
+import asyncio
+import re
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config.settings import settings
+from app.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Во сколько раз быстрее реального времени выполняется задание на settings.transcode_threads потоках
+_TRANSCODE_SPEED = {
+    'video': 4.0,
+    'mp3': 40.0,
+    'remux': 400.0,
+}
+# Расширение файла для аудио потока, который копируется без перекодирования
+_REMUX_EXTS = {
+    'aac': 'm4a',
+    'mp3': 'mp3',
+    'opus': 'ogg',
+    'vorbis': 'ogg',
+}
+# Получение информации и подготовка yt-dlp перед началом скачивания, секунды
+_FETCH_OVERHEAD = 5.0
+# Скорость скачивания до первых замеров, байт в секунду
+_DEFAULT_FETCH_SPEED = 2 * 1024 * 1024
+# Вес нового замера скорости скачивания в скользящем среднем
+_SPEED_SMOOTHING = 0.2
+
+# Строка статистики ffmpeg -benchmark
+_BENCH_RE = re.compile(r"bench: utime=([\d.]+)s stime=([\d.]+)s")
+
+
+class Transcoder:
+    """
+    Пул перекодирования ffmpeg с ограничением по CPU.
+
+    Одновременно выполняется не больше transcode_workers заданий, каждое на
+    transcode_threads потоках. Модель стоимости сравнивает ожидаемое время
+    перекодирования (с учетом очереди пула) со временем повторного
+    скачивания при средней наблюдаемой скорости и выбирает более быстрый путь.
+
+    Задания делятся на режимы: video (уменьшение высоты), mp3 (кодирование
+    в MP3) и remux (копирование аудио потока без перекодирования). Для каждого
+    режима учитываются CPU-время ffmpeg и размер полученных файлов, а
+    статистика отдельного задания возвращается вызывающему и сохраняется
+    в метаданных скачивания.
+    """
+
+    def __init__(self, workers: int = None, threads: int = None):
+        self.ffmpeg = shutil.which("ffmpeg")
+        self.ffprobe = shutil.which("ffprobe")
+        self.workers = workers or settings.transcode_workers
+        self.threads = threads or settings.transcode_threads
+        self._semaphore = asyncio.Semaphore(self.workers)
+        self._pending = 0
+
+        self.fetch_speed = float(_DEFAULT_FETCH_SPEED)
+        self.refetch_chosen = 0
+        self.failures = 0
+        self.modes = {
+            mode: {'jobs': 0, 'cpu_time': 0.0, 'output_bytes': 0}
+            for mode in _TRANSCODE_SPEED
+        }
+
+    @property
+    def available(self) -> bool:
+        """Установлены ли ffmpeg и ffprobe"""
+        return bool(self.ffmpeg and self.ffprobe)
+
+    def record_fetch(self, size: int, seconds: float) -> None:
+        """Учитывает скорость скачивания для модели стоимости"""
+        if size > 0 and seconds > 0:
+            self.fetch_speed += _SPEED_SMOOTHING * (size / seconds - self.fetch_speed)
+
+    def should_transcode(self, duration: Optional[int], mode: str, estimated_size: Optional[int]) -> bool:
+        """Выбирает между перекодированием в режиме mode и повторным скачиванием"""
+        if not duration:
+            return False
+
+        transcode_time = duration / _TRANSCODE_SPEED[mode]
+        # Задания в очереди пула отодвигают начало перекодирования
+        queued = max(self._pending - self.workers + 1, 0)
+        transcode_time *= 1 + queued / self.workers
+
+        if estimated_size:
+            fetch_time = _FETCH_OVERHEAD + estimated_size / self.fetch_speed
+            if fetch_time < transcode_time:
+                self.refetch_chosen += 1
+                return False
+        return True
+
+    async def transcode(self, source_path: str, output_path: str, height: int) -> Dict[str, Any]:
+        """Перекодирует видео в высоту height, возвращает статистику задания"""
+        return await self._execute('video', source_path, output_path, [
+            "-vf", f"scale=-2:{height}",
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
+            "-c:a", "aac", "-b:a", "128k",
+            "-movflags", "+faststart",
+        ])
+
+    async def extract_audio(self, source_path: str, output_stem: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Извлекает аудио в режиме audio_mode: mp3 кодирует в MP3, remux копирует
+        поток в подходящий контейнер (AAC - m4a, Opus и Vorbis - ogg), а
+        неизвестные кодеки кодирует в MP3. Возвращает путь файла и статистику задания.
+        """
+        mode, ext = 'mp3', 'mp3'
+        codec_args = ["-vn", "-c:a", "libmp3lame", "-q:a", "2"]
+        if settings.audio_mode == 'remux':
+            codec = await self._probe_audio_codec(source_path)
+            if codec in _REMUX_EXTS:
+                mode, ext = 'remux', _REMUX_EXTS[codec]
+                codec_args = ["-vn", "-c:a", "copy"]
+                if ext == 'm4a':
+                    codec_args += ["-movflags", "+faststart"]
+
+        output_path = f"{output_stem}.{ext}"
+        job = await self._execute(mode, source_path, output_path, codec_args)
+        return output_path, job
+
+    async def _execute(self, mode: str, source_path: str, output_path: str, codec_args: List[str]) -> Dict[str, Any]:
+        """
+        Выполняет задание в пуле и учитывает его CPU-время и размер результата.
+
+        Возвращает статистику задания: mode, cpu_time, wall_time, input_bytes
+        и output_bytes.
+        """
+        self._pending += 1
+        try:
+            async with self._semaphore:
+                started = time.monotonic()
+                cpu_time = await self._run(
+                    # Строка bench выводится на уровне info
+                    self.ffmpeg, "-hide_banner", "-nostats", "-benchmark", "-y",
+                    "-i", source_path,
+                    "-threads", str(self.threads),
+                    *codec_args,
+                    output_path
+                )
+                wall_time = time.monotonic() - started
+        except Exception:
+            self.failures += 1
+            Path(output_path).unlink(missing_ok=True)
+            raise
+        finally:
+            self._pending -= 1
+
+        size = Path(output_path).stat().st_size
+        stats = self.modes[mode]
+        stats['jobs'] += 1
+        stats['cpu_time'] += cpu_time
+        stats['output_bytes'] += size
+        logger.info(f"Файл {output_path} получен из {source_path} ({mode}): {size} байт, CPU {cpu_time:.1f}s")
+        return {
+            'mode': mode,
+            'cpu_time': round(cpu_time, 3),
+            'wall_time': round(wall_time, 3),
+            'input_bytes': Path(source_path).stat().st_size,
+            'output_bytes': size,
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику пула"""
+        return {
+            'available': self.available,
+            'workers': self.workers,
+            'audio_mode': settings.audio_mode,
+            'pending': self._pending,
+            'refetch_chosen': self.refetch_chosen,
+            'failures': self.failures,
+            'fetch_speed': self.fetch_speed,
+            'modes': {mode: dict(stats) for mode, stats in self.modes.items()},
+        }
+
+    async def _probe_audio_codec(self, file_path: str) -> Optional[str]:
+        """Возвращает кодек первого аудио потока файла"""
+        process = await asyncio.create_subprocess_exec(
+            self.ffprobe, "-v", "error",
+            "-select_streams", "a:0",
+            "-show_entries", "stream=codec_name",
+            "-of", "default=noprint_wrappers=1:nokey=1",
+            file_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, _ = await process.communicate()
+        return stdout.decode().strip() or None
+
+    @staticmethod
+    async def _run(*args: str) -> float:
+        """Запускает ffmpeg и возвращает затраченное им CPU-время"""
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+        output = stdout.decode(errors='replace') + stderr.decode(errors='replace')
+        if process.returncode != 0:
+            raise Exception(f"ffmpeg: {output[-500:]}")
+
+        match = _BENCH_RE.search(output)
+        return float(match.group(1)) + float(match.group(2)) if match else 0.0
+
+
+# Глобальный экземпляр пула
+transcoder = Transcoder()
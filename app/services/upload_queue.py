@@ -0,0 +1,182 @@
+"""
+Очередь отправки скачанных файлов в Telegram
+
+Обработчики очереди скачиваний только скачивают файлы и передают их сюда,
+поэтому медленная отправка не занимает слот скачивания. Очередь отправки
+имеет свое количество обработчиков и ограничение на суммарный размер
+одновременно отправляемых файлов, а при FloodWait и сетевых ошибках
+повторяет отправку без повторного скачивания.
+
+Пока файл не отправлен, запись download_history остается за обработчиком
+(worker_id), а очередь отправки обновляет ее heartbeat_at. Если процесс
+упал или остановился до отправки, очередь скачиваний находит такие записи
+по устаревшему heartbeat_at и снова ставит их в очередь отправки.
+
+Файлы из кэша закрепляются в MediaCache на все время ожидания и отправки,
+чтобы их не вытеснил ни этот, ни другой процесс бота.
+"""
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+from app.models import Video, DownloadHistory
+from app.config.settings import settings
+from app.services.delivery_service import DeliveryService
+from app.services.media_cache import media_cache
+from app.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Задержка перед повторной отправкой после сетевой ошибки, удваивается с каждой попыткой
+_RETRY_BASE_DELAY = 2.0
+
+
+class UploadQueue:
+    """Очередь отправки с ограничением параллельности и объема"""
+
+    def __init__(self, delivery_service: DeliveryService, workers: int = None, inflight_bytes: int = None):
+        self.delivery_service = delivery_service
+        self.workers = workers or settings.upload_workers
+        self.inflight_limit = inflight_bytes or settings.upload_inflight_bytes
+        self._queue: "asyncio.Queue[Tuple[DownloadHistory, Video]]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        # Скачивания, принятые в очередь и еще не отправленные
+        self._pending: Set[int] = set()
+        self._inflight = 0
+        self._inflight_changed = asyncio.Condition()
+
+        self.uploaded = 0
+        self.failed = 0
+        self.retries = 0
+        self.flood_waits = 0
+
+    def submit(self, download: DownloadHistory, video: Video) -> None:
+        """Ставит скачанный файл в очередь отправки"""
+        if download.id in self._pending:
+            return
+        self._pending.add(download.id)
+        if download.file_path:
+            media_cache.pin(download.file_path)
+        self._queue.put_nowait((download, video))
+
+    async def start(self) -> None:
+        """Запускает обработчики отправки"""
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker_loop()))
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        logger.info(f"Очередь отправки запущена: {self.workers} обработчиков")
+
+    async def stop(self) -> None:
+        """
+        Останавливает обработчики. Неотправленные файлы сразу становятся
+        доступны для повторной отправки после перезапуска
+        """
+        tasks = self._tasks + ([self._heartbeat_task] if self._heartbeat_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._heartbeat_task = None
+
+        if self._pending:
+            try:
+                await DownloadHistory.filter(id__in=list(self._pending)).update(heartbeat_at=None)
+            except Exception as e:
+                logger.warning(f"Не удалось вернуть неотправленные файлы в очередь: {e}")
+            logger.warning(f"Не отправлено файлов при остановке, отправка будет повторена: {len(self._pending)}")
+            self._pending.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику отправки"""
+        return {
+            'workers': self.workers,
+            'queue_depth': self._queue.qsize(),
+            'pending': len(self._pending),
+            'inflight_bytes': self._inflight,
+            'inflight_limit': self.inflight_limit,
+            'uploaded': self.uploaded,
+            'failed': self.failed,
+            'retries': self.retries,
+            'flood_waits': self.flood_waits,
+        }
+
+    async def _worker_loop(self) -> None:
+        while True:
+            download, video = await self._queue.get()
+            size = download.file_size or 0
+            try:
+                await self._acquire(size)
+                try:
+                    await self._deliver(download, video)
+                finally:
+                    await self._release(size)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка отправки скачивания {download.id}: {e}")
+            finally:
+                self._queue.task_done()
+
+            # Отправка завершена (или окончательно не удалась) - освобождаем задание
+            try:
+                await DownloadHistory.filter(id=download.id).update(worker_id=None, heartbeat_at=None)
+            except Exception as e:
+                logger.warning(f"Не удалось освободить скачивание {download.id}: {e}")
+            self._pending.discard(download.id)
+            if download.file_path:
+                media_cache.unpin(download.file_path)
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.job_heartbeat_interval)
+            if not self._pending:
+                continue
+            try:
+                await DownloadHistory.filter(id__in=list(self._pending)).update(heartbeat_at=datetime.utcnow())
+                media_cache.renew_pins()
+            except Exception as e:
+                logger.warning(f"Не удалось обновить heartbeat отправки: {e}")
+
+    async def _deliver(self, download: DownloadHistory, video: Video) -> None:
+        """Отправляет файл, повторяя попытку при FloodWait и сетевых ошибках"""
+        for attempt in range(1, settings.upload_max_attempts + 1):
+            try:
+                await self.delivery_service.deliver(download, video)
+                self.uploaded += 1
+                return
+            except TelegramRetryAfter as e:
+                self.flood_waits += 1
+                delay = e.retry_after
+                logger.warning(f"FloodWait при отправке скачивания {download.id}: ждем {delay}s")
+            except (TelegramNetworkError, TelegramServerError) as e:
+                delay = _RETRY_BASE_DELAY * 2 ** (attempt - 1)
+                logger.warning(f"Ошибка сети при отправке скачивания {download.id}: {e}, повтор через {delay}s")
+
+            if attempt < settings.upload_max_attempts:
+                self.retries += 1
+                await asyncio.sleep(delay)
+
+        self.failed += 1
+        await self.delivery_service.edit_status(
+            download.chat_id,
+            download.message_id,
+            "❌ Ошибка при отправке файла.\n"
+            "Попробуйте позже."
+        )
+
+    async def _acquire(self, size: int) -> None:
+        """Ждет, пока суммарный размер отправляемых файлов позволит начать отправку"""
+        async with self._inflight_changed:
+            # Файл больше всего бюджета отправляется, когда других отправок нет
+            await self._inflight_changed.wait_for(
+                lambda: self._inflight == 0 or self._inflight + size <= self.inflight_limit
+            )
+            self._inflight += size
+
+    async def _release(self, size: int) -> None:
+        async with self._inflight_changed:
+            self._inflight -= size
+            self._inflight_changed.notify_all()
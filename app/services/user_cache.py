@@ -0,0 +1,181 @@
+"""
+Кэш пользователей для AuthMiddleware и отложенная запись last_activity
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.models import User
+from app.config.settings import settings
+from app.services.redis_client import get_redis
+from app.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class UserCache:
+    """
+    Кэш записей User по telegram_id в памяти процесса и в Redis (если включен).
+
+    Запись в памяти живет user_cache_ttl секунд, поэтому блокировка,
+    сделанная другим процессом бота, вступает в силу не позже этого срока;
+    в своем процессе block_user и unblock_user удаляют запись сразу.
+
+    Время последней активности не записывается на каждое событие: отметки
+    копятся в памяти и раз в activity_flush_interval секунд записываются
+    одним UPDATE для всех пользователей.
+    """
+
+    def __init__(self, max_size: int = None, ttl: int = None):
+        self.max_size = max_size or settings.user_cache_size
+        self.ttl = ttl or settings.user_cache_ttl
+        # telegram_id -> (время истечения, пользователь)
+        self._cache: "OrderedDict[int, Tuple[float, User]]" = OrderedDict()
+        # id -> пользователь с новым last_activity, еще не записанным в базу
+        self._activity: Dict[int, User] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.flushes = 0
+        self.activity_written = 0
+
+    async def get(self, telegram_id: int) -> Optional[User]:
+        """Возвращает пользователя из кэша или None"""
+        entry = self._cache.get(telegram_id)
+        if entry is None or entry[0] <= time.monotonic():
+            user = await self._get_from_redis(telegram_id)
+            if user is None:
+                self._cache.pop(telegram_id, None)
+                self.misses += 1
+                return None
+            self._store(user)
+            self.hits += 1
+            return user
+
+        self._cache.move_to_end(telegram_id)
+        self.hits += 1
+        return entry[1]
+
+    async def put(self, user: User) -> None:
+        """Сохраняет пользователя в кэш"""
+        self._store(user)
+
+        redis = get_redis()
+        if redis is not None:
+            try:
+                await redis.set(f"user:{user.telegram_id}", self._serialize(user), ex=self.ttl)
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить пользователя {user.telegram_id} в Redis: {e}")
+
+    async def invalidate(self, telegram_id: int) -> None:
+        """Удаляет пользователя из кэша после изменения в базе"""
+        self._cache.pop(telegram_id, None)
+        self.invalidations += 1
+
+        redis = get_redis()
+        if redis is not None:
+            try:
+                await redis.delete(f"user:{telegram_id}")
+            except Exception as e:
+                logger.warning(f"Не удалось удалить пользователя {telegram_id} из Redis: {e}")
+
+    def touch(self, user: User) -> None:
+        """Отмечает активность пользователя, в базу она попадет при следующей записи"""
+        user.last_activity = datetime.utcnow()
+        self._activity[user.id] = user
+
+    async def flush_activity(self) -> int:
+        """Записывает накопленные отметки активности одним запросом"""
+        if not self._activity:
+            return 0
+
+        users: List[User] = list(self._activity.values())
+        self._activity = {}
+        try:
+            await User.bulk_update(users, fields=["last_activity"])
+        except Exception:
+            # Отметки, появившиеся за время записи, новее - их не перезаписываем
+            for user in users:
+                self._activity.setdefault(user.id, user)
+            raise
+
+        self.flushes += 1
+        self.activity_written += len(users)
+        return len(users)
+
+    async def start(self) -> None:
+        """Запускает периодическую запись активности"""
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Останавливает запись активности и записывает оставшиеся отметки"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+
+        try:
+            written = await self.flush_activity()
+            if written:
+                logger.info(f"Записана активность пользователей при остановке: {written}")
+        except Exception as e:
+            logger.error(f"Не удалось записать активность пользователей при остановке: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику кэша"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / total * 100) if total > 0 else 0,
+            'invalidations': self.invalidations,
+            'pending_activity': len(self._activity),
+            'flushes': self.flushes,
+            'activity_written': self.activity_written,
+        }
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.activity_flush_interval)
+            try:
+                await self.flush_activity()
+            except Exception as e:
+                logger.error(f"Ошибка записи активности пользователей: {e}")
+
+    def _store(self, user: User) -> None:
+        self._cache[user.telegram_id] = (time.monotonic() + self.ttl, user)
+        self._cache.move_to_end(user.telegram_id)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    @staticmethod
+    def _serialize(user: User) -> str:
+        row = {
+            column: getattr(user, field)
+            for field, column in User._meta.fields_db_projection.items()
+        }
+        return json.dumps(row, default=lambda value: value.isoformat())
+
+    async def _get_from_redis(self, telegram_id: int) -> Optional[User]:
+        redis = get_redis()
+        if redis is None:
+            return None
+        try:
+            data = await redis.get(f"user:{telegram_id}")
+        except Exception as e:
+            logger.warning(f"Не удалось получить пользователя {telegram_id} из Redis: {e}")
+            return None
+        if not data:
+            return None
+        # Запись восстанавливается как загруженная из базы, поэтому save() выполнит UPDATE
+        return User._init_from_db(**json.loads(data))
+
+
+# Глобальный экземпляр кэша
+user_cache = UserCache()
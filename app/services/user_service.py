@@ -9,61 +9,99 @@ from tortoise.exceptions import DoesNotExist
 
 from app.models import User, DownloadHistory
 from app.config.settings import settings
+from app.services.user_cache import user_cache
 from app.services.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Создает пользователя или обновляет его профиль, если он изменился, и возвращает
+# запись за один запрос. Если профиль не изменился, UPDATE не выполняется и запись
+# берется вторым SELECT того же запроса; inserted - была ли запись создана
+_UPSERT_USER_SQL = """
+WITH upserted AS (
+    INSERT INTO "users" ("telegram_id", "username", "first_name", "last_name", "language_code",
+                         "is_admin", "last_activity")
+    VALUES ($1, $2, $3, $4, $5, $6, $7)
+    ON CONFLICT ("telegram_id") DO UPDATE
+    SET "username" = EXCLUDED."username",
+        "first_name" = EXCLUDED."first_name",
+        "last_name" = EXCLUDED."last_name",
+        "language_code" = EXCLUDED."language_code",
+        "updated_at" = CURRENT_TIMESTAMP
+    WHERE ("users"."username", "users"."first_name", "users"."last_name", "users"."language_code")
+        IS DISTINCT FROM
+        (EXCLUDED."username", EXCLUDED."first_name", EXCLUDED."last_name", EXCLUDED."language_code")
+    RETURNING "users".*, (xmax = 0) AS "inserted"
+)
+SELECT * FROM upserted
+UNION ALL
+SELECT "users".*, FALSE AS "inserted" FROM "users"
+WHERE "telegram_id" = $1 AND NOT EXISTS (SELECT 1 FROM upserted)
+"""
+
+# Поля профиля, которые берутся из Telegram
+_PROFILE_FIELDS = ("username", "first_name", "last_name", "language_code")
+
 
 class UserService:
     """Сервис для работы с пользователями"""
     
     @staticmethod
     async def get_or_create_user(telegram_user: TelegramUser) -> User:
-        """Получает или создает пользователя"""
-        try:
-            user = await User.get(telegram_id=telegram_user.id)
-            
-            # Обновляем информацию пользователя
-            updated = False
-            if user.username != telegram_user.username:
-                user.username = telegram_user.username
-                updated = True
-            if user.first_name != telegram_user.first_name:
-                user.first_name = telegram_user.first_name
-                updated = True
-            if user.last_name != telegram_user.last_name:
-                user.last_name = telegram_user.last_name
-                updated = True
-            if user.language_code != telegram_user.language_code:
-                user.language_code = telegram_user.language_code
-                updated = True
-            
-            if updated:
-                await user.save()
-                
-            await user.update_activity()
-            
-        except DoesNotExist:
-            # Создаем нового пользователя
-            is_admin = telegram_user.id in settings.admin_ids
-            
-            user = await User.create(
-                telegram_id=telegram_user.id,
-                username=telegram_user.username,
-                first_name=telegram_user.first_name,
-                last_name=telegram_user.last_name,
-                language_code=telegram_user.language_code,
-                is_admin=is_admin,
-                last_activity=datetime.utcnow()
-            )
-            
+        """
+        Получает или создает пользователя.
+        
+        Запись берется из кэша пользователей, а время активности
+        записывается в базу отложенно, поэтому для известного пользователя
+        с неизменившимся профилем запросов к базе нет. Регистрация, загрузка
+        пользователя и обновление профиля выполняются одним запросом.
+        """
+        user = await user_cache.get(telegram_user.id)
+        if user is None or any(
+            getattr(user, field) != getattr(telegram_user, field) for field in _PROFILE_FIELDS
+        ):
+            user = await UserService.upsert_user(telegram_user)
+            await user_cache.put(user)
+        
+        user_cache.touch(user)
+        return user
+    
+    @staticmethod
+    async def upsert_user(telegram_user: TelegramUser) -> User:
+        """
+        Создает пользователя или обновляет изменившийся профиль одним
+        INSERT ... ON CONFLICT, без гонки при одновременных первых сообщениях
+        """
+        connection = User._meta.db
+        rows = await connection.execute_query_dict(
+            _UPSERT_USER_SQL,
+            [
+                telegram_user.id,
+                telegram_user.username,
+                telegram_user.first_name,
+                telegram_user.last_name,
+                telegram_user.language_code,
+                telegram_user.id in settings.admin_ids,
+                datetime.utcnow(),
+            ]
+        )
+        if not rows:
+            # Запись вставлена параллельным запросом после начала нашего и не видна его SELECT
+            return await User.get(telegram_id=telegram_user.id)
+        
+        row = rows[0]
+        inserted = row.pop("inserted")
+        user = User._init_from_db(**row)
+        if inserted:
             logger.info(f"Создан новый пользователь: {user}")
-            
         return user
     
     @staticmethod
     async def is_user_blocked(telegram_id: int) -> bool:
         """Проверяет, заблокирован ли пользователь"""
+        user = await user_cache.get(telegram_id)
+        if user is not None:
+            return user.is_blocked
         try:
             user = await User.get(telegram_id=telegram_id)
             return user.is_blocked
@@ -77,6 +115,7 @@ class UserService:
             user = await User.get(telegram_id=telegram_id)
             user.is_blocked = True
             await user.save()
+            await user_cache.invalidate(telegram_id)
             logger.info(f"Пользователь {telegram_id} заблокирован")
             return True
         except DoesNotExist:
@@ -89,6 +128,7 @@ class UserService:
             user = await User.get(telegram_id=telegram_id)
             user.is_blocked = False
             await user.save()
+            await user_cache.invalidate(telegram_id)
             logger.info(f"Пользователь {telegram_id} разблокирован")
             return True
         except DoesNotExist:
@@ -164,6 +204,7 @@ class UserService:
             user = await User.get(telegram_id=telegram_id)
             user.is_admin = True
             await user.save()
+            await user_cache.invalidate(telegram_id)
             logger.info(f"Пользователь {telegram_id} повышен до администратора")
             return True
         except DoesNotExist:
@@ -176,6 +217,7 @@ class UserService:
             user = await User.get(telegram_id=telegram_id)
             user.is_admin = False
             await user.save()
+            await user_cache.invalidate(telegram_id)
             logger.info(f"У пользователя {telegram_id} сняты права администратора")
             return True
         except DoesNotExist:
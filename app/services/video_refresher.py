@@ -0,0 +1,96 @@
+"""
+Фоновое обновление информации о видео (stale-while-revalidate)
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from app.config.settings import settings
+from app.services.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class VideoRefresher:
+    """
+    Очередь обновления устаревших записей Video.
+
+    Устаревшая запись сразу отдается пользователю, а ее video_id ставится
+    в ограниченную очередь. Повторные запросы того же видео, пока оно
+    ожидает обновления, в очередь не добавляются. При переполнении очереди
+    обновление пропускается: запись будет поставлена снова при следующем запросе.
+    """
+
+    def __init__(self, max_queue_size: int = None, workers: int = None):
+        self.max_queue_size = max_queue_size or settings.video_refresh_queue_size
+        self.workers = workers or settings.video_refresh_workers
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=self.max_queue_size)
+        self._pending: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+        self._refresh: Optional[Callable[[str], Awaitable[None]]] = None
+
+        self.scheduled = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.refreshed = 0
+        self.failed = 0
+
+    def schedule(self, video_id: str) -> bool:
+        """Ставит видео в очередь обновления, возвращает False, если оно уже в очереди или очередь заполнена"""
+        if video_id in self._pending:
+            self.deduplicated += 1
+            return False
+
+        try:
+            self._queue.put_nowait(video_id)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+        self._pending.add(video_id)
+        self.scheduled += 1
+        return True
+
+    async def start(self, refresh: Callable[[str], Awaitable[None]]) -> None:
+        """Запускает обработчики, refresh обновляет запись видео по video_id"""
+        self._refresh = refresh
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker_loop()))
+        logger.info(f"Обновление информации о видео запущено: {self.workers} обработчиков")
+
+    async def stop(self) -> None:
+        """Останавливает обработчики"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику обновления"""
+        return {
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self.max_queue_size,
+            'scheduled': self.scheduled,
+            'deduplicated': self.deduplicated,
+            'dropped': self.dropped,
+            'refreshed': self.refreshed,
+            'failed': self.failed,
+        }
+
+    async def _worker_loop(self) -> None:
+        while True:
+            video_id = await self._queue.get()
+            try:
+                await self._refresh(video_id)
+                self.refreshed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"Не удалось обновить информацию о видео {video_id}: {e}")
+            finally:
+                self._pending.discard(video_id)
+                self._queue.task_done()
+
+
+# Глобальный экземпляр очереди обновления
+video_refresher = VideoRefresher()
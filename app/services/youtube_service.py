@@ -4,21 +4,40 @@
 import os
 import re
 import asyncio
-import tempfile
+import shutil
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Tuple, Callable, Awaitable
 from datetime import datetime, date, timedelta
 from urllib.parse import urlparse, parse_qs
 
-import yt_dlp
 from tortoise.exceptions import DoesNotExist
 
 from app.models import Video, User, DownloadHistory, DownloadStatus
 from app.config.settings import settings
+from app.services.single_flight import SingleFlight
+from app.services.download_scheduler import download_scheduler, QueueFullError
+from app.services import ytdlp_worker
+from app.services.media_cache import media_cache
+from app.services.media_splitter import media_splitter
+from app.services.transcoder import transcoder
+from app.services.bandwidth_governor import bandwidth_governor
+from app.services.info_cache import info_cache
+from app.services.file_lock import file_lock, try_lock
+from app.services.download_counters import download_counters
+from app.services.video_refresher import video_refresher
+from app.services.negative_cache import negative_cache, VideoUnavailableError
 from app.services.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Объединение одновременных скачиваний одного и того же файла
+download_flight = SingleFlight("download")
+
+# Запас на неточность оценки размера и контейнер при объединении видео и аудио
+_SIZE_ESTIMATE_MARGIN = 0.95
+
 
 class YouTubeService:
     """Сервис для работы с YouTube"""
@@ -26,6 +45,8 @@ class YouTubeService:
     def __init__(self):
         self.download_path = Path(settings.download_path)
         self.download_path.mkdir(parents=True, exist_ok=True)
+        self.partial_path = self.download_path / "partial"
+        self.partial_path.mkdir(parents=True, exist_ok=True)
     
     @staticmethod
     def extract_video_id(url: str) -> Optional[str]:
@@ -52,44 +73,60 @@ class YouTubeService:
     async def get_video_info(self, url: str) -> Optional[Dict[str, Any]]:
         """Получает информацию о видео"""
         try:
-            video_id = self.extract_video_id(url)
-            if not video_id:
-                return None
-            
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'extractaudio': False,
-                'format': 'bestvideo[height<=720]+bestaudio/best[height<=720]/best',
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = await asyncio.get_event_loop().run_in_executor(
-                    None, ydl.extract_info, url, False
-                )
-                
-                return info
-                
+            return await self._extract_video_info(url)
         except Exception as e:
             logger.error(f"Ошибка получения информации о видео {url}: {e}")
             return None
     
+    async def _extract_video_info(self, url: str) -> Optional[Dict[str, Any]]:
+        """Получает информацию о видео, ошибки yt-dlp не перехватываются"""
+        video_id = self.extract_video_id(url)
+        if not video_id:
+            return None
+        
+        ydl_opts = {
+            'quiet': True,
+            'no_warnings': True,
+            'format': 'bestvideo[height<=720]+bestaudio/best[height<=720]/best',
+        }
+        
+        return await download_scheduler.run_blocking(
+            ytdlp_worker.extract_info, url, ydl_opts
+        )
+    
     async def get_or_create_video(self, url: str) -> Optional[Video]:
-        """Получает или создает запись видео в базе данных"""
+        """
+        Получает или создает запись видео в базе данных.
+        
+        Если видео нельзя скачать (приватное, удаленное, слишком длинное),
+        выбрасывает VideoUnavailableError с ответом для пользователя.
+        Отказ кэшируется, поэтому повторные ссылки отклоняются без обращения к YouTube.
+        """
         try:
             video_id = self.extract_video_id(url)
             if not video_id:
                 return None
             
-            # Проверяем, есть ли видео в базе
+            rejection = await negative_cache.get(video_id)
+            if rejection:
+                raise VideoUnavailableError(rejection)
+            
+            # Проверяем, есть ли видео в базе. Устаревшая запись отдается сразу,
+            # а обновляется в фоне
             try:
                 video = await Video.get(video_id=video_id)
+                if self.is_stale(video):
+                    video_refresher.schedule(video_id)
                 return video
             except DoesNotExist:
                 pass
             
             # Получаем информацию о видео
-            info = await self.get_video_info(url)
+            try:
+                info = await self._extract_video_info(url)
+            except Exception as e:
+                logger.error(f"Ошибка получения информации о видео {url}: {e}")
+                raise VideoUnavailableError(await negative_cache.record_error(video_id, e))
             if not info:
                 return None
             
@@ -97,43 +134,85 @@ class YouTubeService:
             duration = info.get('duration', 0)
             if duration and duration > settings.max_video_duration:
                 logger.warning(f"Видео {video_id} слишком длинное: {duration}s")
-                return None
+                raise VideoUnavailableError(await negative_cache.put(
+                    video_id,
+                    'too_long',
+                    f"⏱ Видео слишком длинное: {duration // 60} мин.\n"
+                    f"Максимальная длительность - {settings.max_video_duration // 60} мин."
+                ))
             
-            # Создаем запись в базе
-            upload_date = None
-            if info.get('upload_date'):
-                try:
-                    upload_date = datetime.strptime(info['upload_date'], '%Y%m%d').date()
-                except ValueError:
-                    pass
+            # Сохраняем информацию для скачивания без повторного извлечения
+            await info_cache.put(video_id, info)
             
-            video = await Video.create(
-                video_id=video_id,
-                title=info.get('title', 'Без названия'),
-                description=info.get('description'),
-                duration=duration,
-                view_count=info.get('view_count'),
-                like_count=info.get('like_count'),
-                channel_name=info.get('uploader') or info.get('channel'),
-                channel_id=info.get('channel_id'),
-                upload_date=upload_date,
-                thumbnail_url=info.get('thumbnail'),
-                available_formats=self._extract_formats(info)
-            )
+            # Создаем запись в базе
+            video = await Video.create(video_id=video_id, **self._video_fields(info))
             
             logger.info(f"Создано новое видео: {video}")
             return video
             
+        except VideoUnavailableError:
+            raise
         except Exception as e:
             logger.error(f"Ошибка создания видео {url}: {e}")
             return None
     
+    @staticmethod
+    def is_stale(video: Video) -> bool:
+        """Проверяет, пора ли обновить информацию о видео"""
+        if video.refreshed_at is None:
+            return True
+        age = datetime.utcnow() - video.refreshed_at.replace(tzinfo=None)
+        return age.total_seconds() > settings.video_refresh_ttl
+    
+    async def refresh_video(self, video_id: str) -> None:
+        """Заново получает информацию о видео и обновляет запись в базе"""
+        video = await Video.get(video_id=video_id)
+        
+        try:
+            info = await self._extract_video_info(video.youtube_url)
+        except Exception as e:
+            # Не пытаемся обновить видео снова до истечения TTL
+            await Video.filter(id=video.id).update(refreshed_at=datetime.utcnow())
+            # Видео стало приватным или удалено - отклоняем следующие ссылки сразу
+            if negative_cache.classify(e) != 'transient':
+                await negative_cache.record_error(video_id, e)
+            raise
+        
+        await info_cache.put(video_id, info)
+        await Video.filter(id=video.id).update(**self._video_fields(info))
+        logger.info(f"Информация о видео {video_id} обновлена")
+    
+    def _video_fields(self, info: Dict[str, Any]) -> Dict[str, Any]:
+        """Поля записи Video из информации yt-dlp"""
+        upload_date = None
+        if info.get('upload_date'):
+            try:
+                upload_date = datetime.strptime(info['upload_date'], '%Y%m%d').date()
+            except ValueError:
+                pass
+        
+        return {
+            'title': info.get('title', 'Без названия'),
+            'description': info.get('description'),
+            'duration': info.get('duration', 0),
+            'view_count': info.get('view_count'),
+            'like_count': info.get('like_count'),
+            'channel_name': info.get('uploader') or info.get('channel'),
+            'channel_id': info.get('channel_id'),
+            'upload_date': upload_date,
+            'thumbnail_url': info.get('thumbnail'),
+            'available_formats': self._extract_formats(info),
+            'refreshed_at': datetime.utcnow(),
+        }
+    
     def _extract_formats(self, info: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Извлекает доступные форматы видео"""
         formats = []
         if 'formats' in info:
             for fmt in info['formats']:
-                if fmt.get('vcodec') != 'none':  # Только видео форматы
+                # Видео и аудио форматы (аудио нужны для оценки размера пары видео+аудио),
+                # без раскадровок
+                if fmt.get('vcodec') != 'none' or fmt.get('acodec') != 'none':
                     formats.append({
                         'format_id': fmt.get('format_id'),
                         'ext': fmt.get('ext'),
@@ -141,107 +220,208 @@ class YouTubeService:
                         'height': fmt.get('height'),
                         'width': fmt.get('width'),
                         'filesize': fmt.get('filesize'),
+                        'filesize_approx': fmt.get('filesize_approx'),
+                        'tbr': fmt.get('tbr'),
                         'fps': fmt.get('fps'),
                         'vcodec': fmt.get('vcodec'),
                         'acodec': fmt.get('acodec'),
                     })
         return formats
     
+    @staticmethod
+    def estimate_format_size(fmt: Dict[str, Any], duration: Optional[int]) -> Optional[int]:
+        """Оценивает размер формата в байтах по filesize, filesize_approx или tbr × длительность"""
+        size = fmt.get('filesize') or fmt.get('filesize_approx')
+        if size:
+            return int(size)
+        
+        # tbr - средний битрейт в Кбит/с
+        if fmt.get('tbr') and duration:
+            return int(fmt['tbr'] * 1000 / 8 * duration)
+        return None
+    
+    def plan_format(self, video: Video, quality: str, format_type: str) -> Optional[Dict[str, Any]]:
+        """
+        Подбирает лучший формат (или пару видео+аудио), который можно отправить
+        целиком или частями (max_file_size × split_max_parts).
+        
+        Возвращает словарь с format (строка формата yt-dlp, None если ничего
+        не помещается), height и estimated_size. Если по сохраненным форматам
+        размер оценить нельзя, возвращает None.
+        """
+        formats = video.available_formats or []
+        audio_formats = []
+        for fmt in formats:
+            if fmt.get('vcodec') == 'none':
+                size = self.estimate_format_size(fmt, video.duration)
+                if size:
+                    audio_formats.append((size, fmt))
+        
+        # Видео, сохраненные до появления аудио форматов в available_formats, оценить нельзя
+        if not audio_formats:
+            return None
+        
+        max_size = int(media_splitter.max_output_size * _SIZE_ESTIMATE_MARGIN)
+        candidates = []
+        
+        if format_type == 'mp3':
+            # AAC копируется в m4a без перекодирования
+            if settings.audio_mode == 'remux':
+                aac_formats = [
+                    item for item in audio_formats
+                    if (item[1].get('acodec') or '').startswith('mp4a')
+                ]
+                audio_formats = aac_formats or audio_formats
+            for size, fmt in audio_formats:
+                candidates.append((0, size, fmt['format_id']))
+        else:
+            max_height = int(quality[:-1]) if quality[:-1].isdigit() else 720
+            audio_by_size = sorted(audio_formats, key=lambda item: item[0])
+            
+            for fmt in formats:
+                height = fmt.get('height')
+                if not height or height > max_height or fmt.get('vcodec') == 'none':
+                    continue
+                size = self.estimate_format_size(fmt, video.duration)
+                if not size:
+                    continue
+                
+                if fmt.get('acodec') != 'none':
+                    candidates.append((height, size, fmt['format_id']))
+                    continue
+                
+                # Лучшее аудио, с которым пара помещается в ограничение, иначе самое маленькое
+                fitting_audio = [item for item in audio_by_size if size + item[0] <= max_size]
+                audio_size, audio_fmt = fitting_audio[-1] if fitting_audio else audio_by_size[0]
+                candidates.append((height, size + audio_size, f"{fmt['format_id']}+{audio_fmt['format_id']}"))
+        
+        if not candidates:
+            return None
+        
+        fitting = [candidate for candidate in candidates if candidate[1] <= max_size]
+        if not fitting:
+            return {
+                'format': None,
+                'height': None,
+                'estimated_size': min(candidate[1] for candidate in candidates),
+            }
+        
+        height, size, format_spec = max(fitting, key=lambda candidate: (candidate[0], candidate[1]))
+        return {
+            'format': format_spec,
+            'height': height or None,
+            'estimated_size': size,
+        }
+    
+    async def plan_stream(self, video: Video, quality: str, format_type: str) -> Optional[Dict[str, Any]]:
+        """
+        Подбирает формат для отправки потоком без записи на диск: один файл
+        (без объединения видео и аудио и без перекодирования) по прямой ссылке
+        с точно известным размером не больше stream_max_size.
+        
+        Возвращает url, headers, size и ext формата или None, если файл
+        нужно скачивать на диск.
+        """
+        if not settings.stream_max_size:
+            return None
+        # MP3 требует перекодирования, без диска можно отправить только AAC в режиме remux
+        if format_type == 'mp3' and settings.audio_mode != 'remux':
+            return None
+        
+        # Ссылки на форматы есть только в info dict, полученном недавно
+        info = await info_cache.get(video.video_id)
+        if not info:
+            return None
+        
+        if format_type == 'mp3':
+            target_height = None
+        else:
+            # Та же высота, которую получил бы пользователь при скачивании на диск
+            format_plan = self.plan_format(video, quality, format_type)
+            if not format_plan or not format_plan['height']:
+                return None
+            target_height = format_plan['height']
+        
+        candidates = []
+        for fmt in info.get('formats') or []:
+            size = fmt.get('filesize')
+            if not fmt.get('url') or fmt.get('protocol') not in ('http', 'https'):
+                continue
+            if not size or size > settings.stream_max_size:
+                continue
+            if format_type == 'mp3':
+                if fmt.get('vcodec') == 'none' and (fmt.get('acodec') or '').startswith('mp4a'):
+                    candidates.append((size, fmt))
+            elif (fmt.get('height') == target_height and fmt.get('ext') == 'mp4'
+                  and fmt.get('vcodec') != 'none' and fmt.get('acodec') != 'none'):
+                candidates.append((size, fmt))
+        
+        if not candidates:
+            return None
+        
+        size, fmt = max(candidates, key=lambda candidate: candidate[0])
+        return {
+            'url': fmt['url'],
+            'headers': fmt.get('http_headers') or {},
+            'size': size,
+            'ext': 'm4a' if format_type == 'mp3' else 'mp4',
+        }
+    
     async def download_video(
         self,
         video: Video,
         user: User,
         quality: str = "720p",
-        format_type: str = "mp4"
+        format_type: str = "mp4",
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+        on_progress: Optional[Callable[[Dict[str, Any]], Any]] = None,
+        download: Optional[DownloadHistory] = None
     ) -> Optional[DownloadHistory]:
-        """Скачивает видео"""
+        """
+        Скачивает видео.
+        
+        Если передана запись download (например, задание из очереди), результат
+        сохраняется в нее, иначе создается новая запись. Если очередь скачиваний
+        переполнена, запись отмечается отмененной и выбрасывается QueueFullError.
+        """
         
         # Создаем запись о скачивании
-        download = await DownloadHistory.create(
-            user=user,
-            video=video,
-            quality=quality,
-            format_type=format_type,
-            status=DownloadStatus.PENDING
-        )
+        if download is None:
+            download = await DownloadHistory.create(
+                user=user,
+                video=video,
+                quality=quality,
+                format_type=format_type,
+                status=DownloadStatus.PENDING
+            )
         
         try:
             await download.mark_as_started()
             
-            # Создаем временную папку для скачивания
-            temp_dir = tempfile.mkdtemp(dir=self.download_path)
-            
-            # Настройки yt-dlp
-            output_template = os.path.join(
-                temp_dir,
-                f"%(title)s.%(ext)s"
-            )
-            
-            # Определяем формат для скачивания
-            if format_type == 'mp3':
-                # Для аудио формата
-                format_selector = 'bestaudio/best'
-            else:
-                # Для видео формата с fallback стратегией
-                if quality == "480p":
-                    format_selector = 'bestvideo[height<=480]+bestaudio/best[height<=480]/best'
-                elif quality == "720p":
-                    format_selector = 'bestvideo[height<=720]+bestaudio/best[height<=720]/best'
-                elif quality == "1080p":
-                    format_selector = 'bestvideo[height<=1080]+bestaudio/best[height<=1080]/best'
-                elif quality == "360p":
-                    format_selector = 'bestvideo[height<=360]+bestaudio/best[height<=360]/best'
-                elif quality == "240p":
-                    format_selector = 'bestvideo[height<=240]+bestaudio/best[height<=240]/best'
-                else:
-                    # По умолчанию
-                    format_selector = 'bestvideo[height<=720]+bestaudio/best[height<=720]/best'
-            
-            ydl_opts = {
-                'format': format_selector,
-                'outtmpl': output_template,
-                'quiet': True,
-                'no_warnings': True,
-                'writeinfojson': False,
-                'writesubtitles': False,
-                'writeautomaticsub': False,
-                'ignoreerrors': False,
-                'extractaudio': format_type == 'mp3',
-                'audioformat': 'mp3' if format_type == 'mp3' else None,
-                'audioquality': '192' if format_type == 'mp3' else None,
-            }
-            
-            # Добавляем ограничение размера файла
-            if settings.max_file_size:
-                ydl_opts['max_filesize'] = settings.max_file_size
-            
-            # Скачиваем видео
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                await asyncio.get_event_loop().run_in_executor(
-                    None, ydl.download, [video.youtube_url]
+            # Одновременные запросы одного и того же файла скачиваются один раз
+            (file_path, file_size), shared = await download_flight.run(
+                (video.id, quality, format_type),
+                lambda: self._fetch_file_scheduled(
+                    video, user, quality, format_type, on_queued, on_progress
                 )
-            
-            # Находим скачанный файл
-            downloaded_files = list(Path(temp_dir).glob('*'))
-            if not downloaded_files:
-                raise Exception("Файл не был скачан")
-            
-            downloaded_file = downloaded_files[0]
-            file_size = downloaded_file.stat().st_size
-            
-            # Проверяем размер файла
-            if file_size > settings.max_file_size:
-                raise Exception(f"Файл слишком большой: {file_size} байт")
+            )
+            if shared:
+                logger.info(f"Скачивание {video.video_id} ({quality}, {format_type}) объединено с уже идущим")
             
             # Завершаем скачивание
             await download.mark_as_completed(
-                file_path=str(downloaded_file),
+                file_path=file_path,
                 file_size=file_size
             )
             
+            # CPU-время и размер перекодирования, которым получен файл
+            transcode_job = media_cache.transcode_job(file_path)
+            if transcode_job:
+                download.metadata = {**(download.metadata or {}), 'transcode': transcode_job}
+                await download.save(update_fields=['metadata'])
+            
             # Обновляем статистику
-            await video.increment_download_count()
-            await user.increment_downloads(file_size)
+            await download_counters.record(video, user, file_size)
             
             # Обновляем информацию о видео
             if not video.file_size:
@@ -253,12 +433,415 @@ class YouTubeService:
             logger.info(f"Видео успешно скачано: {video.title} для пользователя {user.telegram_id}")
             return download
             
+        except QueueFullError as e:
+            logger.warning(f"Скачивание {video.video_id} отклонено: {e}")
+            await download.mark_as_cancelled(str(e))
+            raise
         except Exception as e:
             error_msg = str(e)
             logger.error(f"Ошибка скачивания видео {video.video_id}: {error_msg}")
             await download.mark_as_failed(error_msg)
             return download
     
+    async def _find_downloaded_file(
+        self,
+        video: Video,
+        quality: str,
+        format_type: str
+    ) -> Optional[Tuple[str, int]]:
+        """Ищет файл, уже скачанный другим процессом бота"""
+        downloads = await DownloadHistory.filter(
+            video=video,
+            quality=quality,
+            format_type=format_type,
+            status=DownloadStatus.COMPLETED,
+            file_path__not_isnull=True
+        ).order_by('-completed_at').limit(5)
+        
+        for download in downloads:
+            if not download.file_path or not os.path.exists(download.file_path):
+                continue
+            transcode_job = (download.metadata or {}).get('transcode')
+            if self._is_sendable(format_type, transcode_job or media_cache.transcode_job(download.file_path)):
+                return download.file_path, os.path.getsize(download.file_path)
+        return None
+    
+    async def _fetch_file_scheduled(
+        self,
+        video: Video,
+        user: User,
+        quality: str,
+        format_type: str,
+        on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+        on_progress: Optional[Callable[[Dict[str, Any]], Any]] = None
+    ) -> Tuple[str, int]:
+        """Скачивает файл, дождавшись свободного слота планировщика"""
+        async with download_scheduler.slot(user.id, on_queued=on_queued):
+            return await self._fetch_file(video, quality, format_type, on_progress)
+    
+    async def _fetch_file(
+        self,
+        video: Video,
+        quality: str,
+        format_type: str,
+        on_progress: Optional[Callable[[Dict[str, Any]], Any]] = None
+    ) -> Tuple[str, int]:
+        """Скачивает файл с YouTube и возвращает путь и размер"""
+        
+        # Файл уже есть в кэше - yt-dlp не нужен
+        cached = media_cache.get(video.video_id, quality, format_type)
+        if cached and self._is_sendable(format_type, media_cache.transcode_job(cached[0])):
+            logger.info(f"Видео {video.video_id} ({quality}, {format_type}) взято из кэша файлов")
+            return cached
+        
+        existing = await self._find_downloaded_file(video, quality, format_type)
+        if existing:
+            return existing
+        
+        # Без ffmpeg пришлось бы отправить исходный webm/m4a под видом MP3
+        if format_type == 'mp3' and not transcoder.available:
+            raise Exception("Аудио сейчас недоступно: на сервере не установлен ffmpeg.")
+        
+        # Определяем формат для скачивания: по сохраненным форматам выбираем
+        # лучший вариант, помещающийся в ограничение, еще до скачивания
+        format_plan = self.plan_format(video, quality, format_type)
+        
+        # Более низкое качество или MP3 можно получить из уже скачанного видео
+        derived = await self._derive_from_master(video, quality, format_type, format_plan)
+        if derived:
+            return derived
+        
+        # Постоянная папка запроса: после сбоя или перезапуска yt-dlp
+        # продолжит скачивание с .part файлов и фрагментов. Папка общая для
+        # всех процессов бота, поэтому в нее пишет только владелец блокировки
+        async with self._staging(video, quality, format_type) as staging_dir:
+            # Пока ждали блокировку, файл мог скачать другой процесс
+            existing = await self._find_downloaded_file(video, quality, format_type)
+            if existing:
+                return existing
+            return await self._download_to_staging(video, quality, format_type, format_plan, staging_dir, on_progress)
+    
+    async def _download_to_staging(
+        self,
+        video: Video,
+        quality: str,
+        format_type: str,
+        format_plan: Optional[Dict[str, Any]],
+        staging_dir: Path,
+        on_progress: Optional[Callable[[Dict[str, Any]], Any]] = None
+    ) -> Tuple[str, int]:
+        """Скачивает файл yt-dlp в папку запроса и переносит его в кэш файлов"""
+        
+        # Настройки yt-dlp
+        output_template = os.path.join(
+            staging_dir,
+            "%(id)s.%(format_id)s.%(ext)s"
+        )
+        
+        if format_plan and not format_plan['format']:
+            raise Exception(
+                f"Файл слишком большой: около {format_plan['estimated_size'] // (1024 * 1024)} МБ "
+                f"при ограничении {media_splitter.max_output_size // (1024 * 1024)} МБ. "
+                "Выберите более низкое качество."
+            )
+        
+        if format_plan:
+            format_selector = format_plan['format']
+            logger.info(
+                f"Для видео {video.video_id} ({quality}, {format_type}) выбран формат {format_selector}, "
+                f"оценка размера {format_plan['estimated_size']} байт"
+            )
+        elif format_type == 'mp3':
+            # Для аудио формата
+            if settings.audio_mode == 'remux':
+                format_selector = 'bestaudio[acodec^=mp4a]/bestaudio/best'
+            else:
+                format_selector = 'bestaudio/best'
+        else:
+            # Для видео формата с fallback стратегией
+            if quality == "480p":
+                format_selector = 'bestvideo[height<=480]+bestaudio/best[height<=480]/best'
+            elif quality == "720p":
+                format_selector = 'bestvideo[height<=720]+bestaudio/best[height<=720]/best'
+            elif quality == "1080p":
+                format_selector = 'bestvideo[height<=1080]+bestaudio/best[height<=1080]/best'
+            elif quality == "360p":
+                format_selector = 'bestvideo[height<=360]+bestaudio/best[height<=360]/best'
+            elif quality == "240p":
+                format_selector = 'bestvideo[height<=240]+bestaudio/best[height<=240]/best'
+            else:
+                # По умолчанию
+                format_selector = 'bestvideo[height<=720]+bestaudio/best[height<=720]/best'
+        
+        ydl_opts = {
+            'format': format_selector,
+            'outtmpl': output_template,
+            'quiet': True,
+            'no_warnings': True,
+            'writeinfojson': False,
+            'writesubtitles': False,
+            'writeautomaticsub': False,
+            'ignoreerrors': False,
+            'continuedl': True,
+            'nopart': False,
+        }
+        
+        # Добавляем ограничение размера файла
+        if settings.max_file_size:
+            ydl_opts['max_filesize'] = media_splitter.max_output_size
+        
+        # Информация, полученная при создании видео, избавляет от повторного извлечения страницы
+        cached_info = await info_cache.get(video.video_id)
+        
+        # Потоки фрагментов и ограничение скорости задания зависят от числа
+        # одновременных скачиваний
+        bandwidth_job = bandwidth_governor.start_job(f"{video.video_id} {quality} {format_type}")
+        ydl_opts['concurrent_fragment_downloads'] = bandwidth_job.fragments
+        
+        def handle_progress(event: Dict[str, Any]) -> None:
+            bandwidth_job.record(event)
+            if on_progress:
+                on_progress(event)
+        
+        # Скачиваем видео, прогресс передается из пула через канал
+        progress_channel = download_scheduler.create_progress_channel()
+        progress_task = asyncio.create_task(
+            download_scheduler.pump_progress(progress_channel, handle_progress)
+        )
+        
+        try:
+            try:
+                started = time.monotonic()
+                result = await download_scheduler.run_blocking(
+                    ytdlp_worker.download, video.youtube_url, ydl_opts, progress_channel, cached_info,
+                    bandwidth_job.rate_limit
+                )
+                if cached_info is not None and result.get('reextracted'):
+                    info_cache.record_fallback(video.video_id)
+            finally:
+                try:
+                    await asyncio.wait_for(progress_task, timeout=5)
+                except asyncio.TimeoutError:
+                    pass
+                bandwidth_governor.finish_job(bandwidth_job)
+            
+            # Находим скачанный файл
+            downloaded_file = result.get('filepath')
+            if not downloaded_file or not os.path.exists(downloaded_file):
+                downloaded_files = [
+                    path for path in staging_dir.glob('*')
+                    if not self._is_partial_file(path)
+                ]
+                if not downloaded_files:
+                    raise Exception("Файл не был скачан")
+                downloaded_file = str(downloaded_files[0])
+            
+            file_size = os.path.getsize(downloaded_file)
+            
+            # Проверяем размер файла - докачивать такой файл бессмысленно
+            if file_size > media_splitter.max_output_size:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                raise Exception(f"Файл слишком большой: {file_size} байт")
+            
+            transcoder.record_fetch(file_size, time.monotonic() - started)
+            
+            format_id = result.get('format_id')
+            ext = result.get('ext') or Path(downloaded_file).suffix.lstrip('.')
+            
+            # yt-dlp скачивает аудио в исходном контейнере: делаем MP3
+            # или копируем поток в m4a/ogg в режиме remux
+            transcode_job = None
+            if format_type == 'mp3':
+                downloaded_file, transcode_job = await transcoder.extract_audio(
+                    downloaded_file, str(staging_dir / f"{video.video_id}.audio")
+                )
+                file_size = transcode_job['output_bytes']
+                if file_size > media_splitter.max_output_size:
+                    shutil.rmtree(staging_dir, ignore_errors=True)
+                    raise Exception(f"Файл слишком большой: {file_size} байт")
+                format_id = f"{format_id}-{settings.audio_mode}"
+                ext = Path(downloaded_file).suffix.lstrip('.')
+            
+            # Перемещаем файл в кэш
+            cached = media_cache.put(
+                video.video_id,
+                quality,
+                format_type,
+                format_id,
+                ext,
+                downloaded_file,
+                height=result.get('height'),
+                transcode=transcode_job
+            )
+        except Exception:
+            logger.info(f"Частично скачанные файлы сохранены в {staging_dir}")
+            raise
+        
+        # Файл перемещен в кэш - остатки скачивания больше не нужны
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        return cached
+    
+    async def _derive_from_master(
+        self,
+        video: Video,
+        quality: str,
+        format_type: str,
+        format_plan: Optional[Dict[str, Any]]
+    ) -> Optional[Tuple[str, int]]:
+        """
+        Получает файл из закэшированного видео этого ролика не ниже нужного
+        качества: файл той же высоты переиспользуется как есть, остальное
+        перекодируется, если по модели стоимости это быстрее скачивания.
+        """
+        if not settings.derive_from_master or not transcoder.available:
+            return None
+        
+        if format_type == 'mp3':
+            target_height = None
+        elif format_plan and format_plan['height']:
+            target_height = format_plan['height']
+        elif quality[:-1].isdigit():
+            target_height = int(quality[:-1])
+        else:
+            return None
+        
+        master = media_cache.find_master(video.video_id, target_height)
+        if not master:
+            return None
+        master_key, master_path, master_height = master
+        
+        if master_height == target_height:
+            logger.info(f"Видео {video.video_id} ({quality}, {format_type}) совпадает с закэшированным {master_key}")
+            return media_cache.add_alias(video.video_id, quality, format_type, master_key)
+        
+        mode = settings.audio_mode if format_type == 'mp3' else 'video'
+        estimated_size = format_plan['estimated_size'] if format_plan else None
+        if not transcoder.should_transcode(video.duration, mode, estimated_size):
+            logger.info(f"Видео {video.video_id} ({quality}, {format_type}) быстрее скачать заново")
+            return None
+        
+        async with self._staging(video, quality, format_type) as staging_dir:
+            output_stem = str(staging_dir / f"{video.video_id}.derived")
+            try:
+                if format_type == 'mp3':
+                    output_path, transcode_job = await transcoder.extract_audio(master_path, output_stem)
+                else:
+                    output_path = f"{output_stem}.mp4"
+                    transcode_job = await transcoder.transcode(master_path, output_path, target_height)
+                transcode_job['source'] = master_key
+            except Exception as e:
+                logger.warning(f"Не удалось получить {video.video_id} ({quality}, {format_type}) из {master_key}: {e}")
+                return None
+            
+            cached = media_cache.put(
+                video.video_id,
+                quality,
+                format_type,
+                f"derived-{target_height}p" if target_height else f"derived-{mode}",
+                Path(output_path).suffix.lstrip('.'),
+                output_path,
+                height=target_height,
+                transcode=transcode_job
+            )
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            return cached
+    
+    @asynccontextmanager
+    async def _staging(self, video: Video, quality: str, format_type: str):
+        """
+        Постоянная папка скачивания запроса под блокировкой flock: процессы
+        бота с общей папкой скачиваний не пишут в нее одновременно и не
+        удаляют чужие недокачанные файлы
+        """
+        name = f"{video.video_id}_{quality}_{format_type}"
+        lock_path = self.partial_path / f"{name}.lock"
+        async with file_lock(lock_path):
+            staging_dir = self.partial_path / name
+            staging_dir.mkdir(parents=True, exist_ok=True)
+            # Обновляем время изменения, чтобы папку не удалил сборщик
+            os.utime(staging_dir)
+            try:
+                yield staging_dir
+            finally:
+                # Папка удалена после успешного скачивания - файл блокировки тоже не нужен
+                if not staging_dir.exists():
+                    lock_path.unlink(missing_ok=True)
+    
+    @staticmethod
+    def _is_sendable(format_type: str, transcode_job: Optional[Dict[str, Any]]) -> bool:
+        """
+        Аудио должно быть результатом extract_audio (у файла есть статистика
+        задания ffmpeg): исходные webm и m4a, сохраненные прежними версиями
+        без перекодирования, под видом MP3 не отправляются
+        """
+        return format_type != 'mp3' or transcode_job is not None
+    
+    @staticmethod
+    def _is_partial_file(path: Path) -> bool:
+        """Проверяет, является ли файл недокачанной частью (.part, фрагменты, .ytdl)"""
+        return '.part' in path.name or path.suffix == '.ytdl'
+    
+    async def register_cached_download(
+        self,
+        video: Video,
+        user: User,
+        quality: str,
+        format_type: str,
+        telegram_file_id: str,
+        file_size: Optional[int] = None,
+        part_file_ids: Tuple[str, ...] = ()
+    ) -> DownloadHistory:
+        """Записывает скачивание, отданное из кэша file_id без обращения к YouTube"""
+        metadata = {'source': 'file_id_cache'}
+        if part_file_ids:
+            metadata['part_file_ids'] = list(part_file_ids)
+        
+        download = await DownloadHistory.create(
+            user=user,
+            video=video,
+            quality=quality,
+            format_type=format_type,
+            status=DownloadStatus.PENDING,
+            metadata=metadata
+        )
+        await download.mark_as_completed(
+            file_path=None,
+            file_size=file_size,
+            telegram_file_id=telegram_file_id
+        )
+
+        await download_counters.record(video, user, file_size or 0)
+
+        logger.info(f"Видео {video.video_id} отдано из кэша file_id пользователю {user.telegram_id}")
+        return download
+
+    async def register_streamed_download(
+        self,
+        download: DownloadHistory,
+        video: Video,
+        user: User,
+        telegram_file_id: Optional[str],
+        file_size: int
+    ) -> None:
+        """Завершает скачивание, отправленное в Telegram потоком без записи на диск"""
+        download.metadata = {**(download.metadata or {}), 'source': 'stream'}
+        await download.save(update_fields=['metadata'])
+        await download.mark_as_completed(
+            file_path=None,
+            file_size=file_size,
+            telegram_file_id=telegram_file_id
+        )
+        
+        await download_counters.record(video, user, file_size)
+        
+        if not video.file_size:
+            video.file_size = file_size
+            video.quality = download.quality
+            video.format_id = download.format_type
+            await video.save(update_fields=['file_size', 'quality', 'format_id'])
+        
+        logger.info(f"Видео {video.video_id} отправлено потоком пользователю {user.telegram_id}")
+    
     async def get_available_qualities(self, video: Video) -> List[Dict[str, Any]]:
         """Получает доступные качества для скачивания"""
         if not video.available_formats:
@@ -266,16 +849,25 @@ class YouTubeService:
         
         # Группируем форматы по качеству
         qualities = {}
+        hidden = set()
         for fmt in video.available_formats:
             height = fmt.get('height')
             if height:
                 quality_name = f"{height}p"
-                if quality_name not in qualities:
+                if quality_name not in qualities and quality_name not in hidden:
+                    # Скрываем качества, которые не помещаются в ограничение размера:
+                    # для них был бы выбран формат более низкого качества
+                    format_plan = self.plan_format(video, quality_name, 'mp4')
+                    if format_plan and format_plan['height'] != height:
+                        hidden.add(quality_name)
+                        continue
+                    
                     qualities[quality_name] = {
                         'name': quality_name,
                         'height': height,
                         'format_id': fmt.get('format_id'),
                         'filesize': fmt.get('filesize'),
+                        'estimated_size': format_plan['estimated_size'] if format_plan else None,
                         'ext': fmt.get('ext', 'mp4')
                     }
         
@@ -295,6 +887,10 @@ class YouTubeService:
         
         for download in old_downloads:
             try:
+                # Файлами кэша управляет MediaCache
+                if download.file_path and media_cache.contains_path(download.file_path):
+                    continue
+                
                 if download.file_path and os.path.exists(download.file_path):
                     os.remove(download.file_path)
                     # Удаляем также пустую папку
@@ -309,9 +905,64 @@ class YouTubeService:
             except Exception as e:
                 logger.error(f"Ошибка удаления файла {download.file_path}: {e}")
         
+        # Кэш файлов может превышать бюджет, если файлы вытеснялись во время отправки
+        evicted_bytes = media_cache.enforce_budget()
+        if evicted_bytes:
+            logger.info(f"Из кэша файлов вытеснено {evicted_bytes} байт")
+        
         logger.info(f"Очищено {cleaned_count} старых файлов")
         return cleaned_count
     
+    async def cleanup_partial_downloads(self, ttl: Optional[int] = None) -> int:
+        """Удаляет недокачанные файлы, которые не изменялись дольше ttl секунд"""
+        ttl = ttl if ttl is not None else settings.partial_download_ttl
+        cutoff = time.time() - ttl
+        removed_count = 0
+        
+        # Папки запросов и временные папки, оставшиеся от прежних версий бота
+        candidates = list(self.partial_path.iterdir()) + list(self.download_path.glob('tmp*'))
+        
+        for staging_dir in candidates:
+            if not staging_dir.is_dir():
+                continue
+            lock_path = staging_dir.with_name(f"{staging_dir.name}.lock")
+            lock_fd = None
+            try:
+                # Идущее скачивание постоянно обновляет .part файл
+                last_modified = max(
+                    [staging_dir.stat().st_mtime] + [path.stat().st_mtime for path in staging_dir.iterdir()]
+                )
+                if last_modified >= cutoff:
+                    continue
+                
+                # Папка занята скачиванием в этом или другом процессе
+                lock_fd = try_lock(lock_path)
+                if lock_fd is None:
+                    continue
+                
+                shutil.rmtree(staging_dir)
+                lock_path.unlink(missing_ok=True)
+                removed_count += 1
+            except OSError as e:
+                logger.error(f"Ошибка удаления недокачанных файлов {staging_dir}: {e}")
+            finally:
+                if lock_fd is not None:
+                    os.close(lock_fd)
+        
+        # Файлы блокировок, оставшиеся без папки (например, после сбоя процесса)
+        for lock_path in self.partial_path.glob('*.lock'):
+            if lock_path.with_suffix('').exists():
+                continue
+            lock_fd = try_lock(lock_path)
+            if lock_fd is not None:
+                if not lock_path.with_suffix('').exists():
+                    lock_path.unlink(missing_ok=True)
+                os.close(lock_fd)
+        
+        if removed_count:
+            logger.info(f"Удалено недокачанных скачиваний: {removed_count}")
+        return removed_count
+    
     async def get_download_stats(self) -> Dict[str, Any]:
         """Получает статистику скачиваний"""
         total_downloads = await DownloadHistory.all().count()
@@ -0,0 +1,243 @@
+"""
+Функции yt-dlp, выполняемые в пуле потоков или процессов
+
+Модуль не должен зависеть от базы данных и event loop: его функции
+вызываются в рабочих процессах, поэтому аргументы и результаты должны
+сериализоваться через pickle.
+
+Экземпляры YoutubeDL долгоживущие: каждый поток пула (в режиме process -
+каждый процесс) хранит свои экземпляры, по одному на набор общих опций,
+и перед заданием накладывает на них опции задания (формат, шаблон имени,
+ограничение размера). Экземпляр используется только своим потоком,
+поэтому блокировки не нужны.
+
+Скорость всех скачиваний процесса ограничивается общим token bucket:
+хуки прогресса забирают из него скачанные байты и засыпают, если полоса
+исчерпана, и yt-dlp не читает следующий блок, пока хук не вернется.
+"""
+import copy
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import yt_dlp
+
+# Поля прогресса yt-dlp, которые передаются обратно в процесс бота
+_PROGRESS_FIELDS = (
+    'status',
+    'downloaded_bytes',
+    'total_bytes',
+    'total_bytes_estimate',
+    'speed',
+    'eta',
+    'elapsed',
+    'fragment_index',
+    'fragment_count',
+    'filename',
+)
+
+# Опции, которые меняются от задания к заданию и накладываются на готовый экземпляр
+_JOB_OPTIONS = ('format', 'outtmpl', 'max_filesize', 'concurrent_fragment_downloads')
+
+_local = threading.local()
+
+
+class _TokenBucket:
+    """
+    Token bucket, общий для всех потоков процесса.
+
+    Потребитель, забравший больше накопленного, уходит в долг и спит, пока
+    долг не погасится, поэтому суммарная скорость не превышает rate.
+    Неиспользованная полоса копится не дольше секунды.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rate = 0
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+
+    def set_rate(self, rate: int) -> None:
+        with self._lock:
+            self.rate = rate
+
+    def consume(self, amount: int) -> None:
+        with self._lock:
+            if not self.rate or amount <= 0:
+                return
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.rate)
+            self._updated = now
+            self._tokens -= amount
+            delay = -self._tokens / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+
+class _JobContext:
+    """
+    Задание, которое выполняет экземпляр YoutubeDL.
+
+    Хуки прогресса вызываются и из потоков фрагментов (concurrent_fragment_downloads),
+    поэтому состояние задания хранится рядом с экземпляром, а не в threading.local.
+    """
+
+    def __init__(self):
+        self.progress_channel = None
+        self._lock = threading.Lock()
+        self._downloaded: Dict[str, int] = {}
+
+    def reset(self, progress_channel: Any = None) -> None:
+        self.progress_channel = progress_channel
+        with self._lock:
+            self._downloaded = {}
+
+    def on_progress(self, event: Dict[str, Any]) -> None:
+        downloaded = event.get('downloaded_bytes')
+        if downloaded is not None:
+            key = event.get('filename') or ''
+            with self._lock:
+                # Первое событие файла включает часть, докачанную до перезапуска
+                previous = self._downloaded.get(key, downloaded)
+                self._downloaded[key] = max(previous, downloaded)
+            _bucket.consume(downloaded - previous)
+
+        progress_channel = self.progress_channel
+        if progress_channel is not None:
+            progress_channel.put({
+                field: event.get(field) for field in _PROGRESS_FIELDS
+            })
+
+
+_bucket = _TokenBucket()
+
+
+def extract_info(url: str, ydl_opts: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Получает информацию о видео без скачивания"""
+    with _job_ydl(ydl_opts) as (ydl, _):
+        info = ydl.extract_info(url, download=False)
+        return ydl.sanitize_info(info)
+
+
+def download(
+    url: str,
+    ydl_opts: Dict[str, Any],
+    progress_channel: Any = None,
+    info: Optional[Dict[str, Any]] = None,
+    rate_limit: int = 0
+) -> Dict[str, Any]:
+    """
+    Скачивает видео и возвращает выбранный формат и путь к файлу.
+
+    Если передан info (ранее извлеченная информация о видео), страница
+    не извлекается повторно, как при --load-info-json. Если ссылки из нее
+    уже не работают, видео извлекается заново и в результате reextracted=True.
+
+    Если передан progress_channel (queue.Queue или очередь multiprocessing.Manager),
+    в него отправляются события прогресса, а по завершении - None.
+
+    rate_limit - ограничение суммарной скорости скачиваний процесса
+    в байтах в секунду (0 - без ограничения).
+    """
+    _bucket.set_rate(rate_limit)
+
+    try:
+        with _job_ydl(ydl_opts) as (ydl, job):
+            job.reset(progress_channel)
+            reextracted = False
+            if info is not None:
+                try:
+                    # process_ie_result изменяет info, а в пуле потоков это объект из кэша
+                    result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+                    return _download_result(result, reextracted)
+                except yt_dlp.utils.DownloadError:
+                    reextracted = True
+
+            result = ydl.extract_info(url, download=True)
+            return _download_result(result, reextracted)
+    finally:
+        if progress_channel is not None:
+            progress_channel.put(None)
+
+
+def _download_result(info: Optional[Dict[str, Any]], reextracted: bool = False) -> Dict[str, Any]:
+    """Оставляет из информации о скачивании только нужные боту поля"""
+    info = info or {}
+    requested = info.get('requested_downloads') or [{}]
+    return {
+        'format_id': info.get('format_id'),
+        'ext': requested[0].get('ext') or info.get('ext'),
+        'filepath': requested[0].get('filepath'),
+        'height': info.get('height'),
+        'reextracted': reextracted,
+    }
+
+
+@contextmanager
+def _job_ydl(ydl_opts: Dict[str, Any]) -> Iterator[Tuple[yt_dlp.YoutubeDL, _JobContext]]:
+    """
+    Выдает экземпляр YoutubeDL потока с опциями задания и его задание,
+    после ошибки экземпляр пересоздается
+    """
+    key = repr(sorted(
+        (name, value) for name, value in ydl_opts.items() if name not in _JOB_OPTIONS
+    ))
+    instances = _instances()
+    if key not in instances or not _apply_job_options(instances[key][0], ydl_opts):
+        if key in instances:
+            instances.pop(key)[0].close()
+        instances[key] = _create_ydl(ydl_opts)
+    ydl, job = instances[key]
+
+    try:
+        yield ydl, job
+    except BaseException:
+        # Состояние экземпляра после ошибки не гарантировано
+        instances.pop(key, None)
+        ydl.close()
+        raise
+    finally:
+        job.reset()
+
+
+def _instances() -> Dict[str, Tuple[yt_dlp.YoutubeDL, _JobContext]]:
+    if not hasattr(_local, 'instances'):
+        _local.instances = {}
+    return _local.instances
+
+
+def _create_ydl(ydl_opts: Dict[str, Any]) -> Tuple[yt_dlp.YoutubeDL, _JobContext]:
+    """Создает экземпляр YoutubeDL, прогресс которого передается заданию экземпляра"""
+    ydl = yt_dlp.YoutubeDL(dict(ydl_opts))
+    job = _JobContext()
+    ydl.add_progress_hook(job.on_progress)
+    return ydl, job
+
+
+def _apply_job_options(ydl: yt_dlp.YoutubeDL, ydl_opts: Dict[str, Any]) -> bool:
+    """
+    Накладывает опции задания на готовый экземпляр так же, как это делает YoutubeDL.__init__
+
+    Шаблон имени разбирается приватным методом yt-dlp. Если в установленной
+    версии его нет, возвращает False: экземпляр нужно создать заново.
+    """
+    parse_outtmpl = getattr(ydl, '_parse_outtmpl', None)
+    if not callable(parse_outtmpl):
+        return False
+
+    for name in _JOB_OPTIONS:
+        if name in ydl_opts:
+            ydl.params[name] = ydl_opts[name]
+        else:
+            ydl.params.pop(name, None)
+
+    # Шаблон имени и селектор формата разбираются при создании экземпляра
+    parse_outtmpl()
+    format_spec = ydl.params.get('format')
+    ydl.format_selector = (
+        format_spec if format_spec in (None, '-')
+        else ydl.build_format_selector(format_spec)
+    )
+    return True
+
@@ -0,0 +1,91 @@
+"""
+Бенчмарк задержки хендлеров во время работы скачиваний
+
+Сравнивает бэкенды yt-dlp thread и process. В пул планировщика отправляются
+задачи, нагружающие CPU кодом на чистом Python (так же, как сортировка
+форматов и расшифровка подписей в yt-dlp), а event loop в это время
+обрабатывает легкий "хендлер" вроде /start. Измеряется, на сколько
+позже запланированного хендлер успевает выполниться.
+
+Запуск из корня репозитория:
+    python -m benchmarks.handler_latency
+    python -m benchmarks.handler_latency --jobs 8 --iterations 20000000
+"""
+import os
+
+os.environ.setdefault("BOT_TOKEN", "benchmark")
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Dict, List
+
+from app.services.download_scheduler import DownloadScheduler
+
+
+def cpu_job(iterations: int) -> int:
+    """Нагрузка на CPU на чистом Python, удерживающая GIL"""
+    total = 0
+    for i in range(iterations):
+        total = (total + i * i) % 1_000_003
+    return total
+
+
+def handler_work() -> str:
+    """Работа, сравнимая с формированием ответа на /start"""
+    return "\n".join(f"• пункт {i}" for i in range(50))
+
+
+async def measure(backend: str, jobs: int, iterations: int, interval: float) -> Dict[str, float]:
+    """Измеряет задержку хендлера, пока в пуле выполняются задачи"""
+    scheduler = DownloadScheduler(workers=jobs, backend=backend)
+    try:
+        # Прогреваем пул, чтобы не учитывать запуск процессов
+        await asyncio.gather(*(scheduler.run_blocking(cpu_job, 1) for _ in range(jobs)))
+
+        load = asyncio.gather(*(scheduler.run_blocking(cpu_job, iterations) for _ in range(jobs)))
+        latencies: List[float] = []
+        started = time.perf_counter()
+
+        while not load.done():
+            before = time.perf_counter()
+            await asyncio.sleep(interval)
+            handler_work()
+            latencies.append((time.perf_counter() - before - interval) * 1000)
+
+        await load
+        elapsed = time.perf_counter() - started
+    finally:
+        scheduler.shutdown()
+
+    latencies.sort()
+    return {
+        'samples': len(latencies),
+        'p50': statistics.median(latencies),
+        'p95': latencies[int(len(latencies) * 0.95) - 1] if len(latencies) > 1 else latencies[0],
+        'max': latencies[-1],
+        'load_time': elapsed,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=4, help="Количество одновременных задач в пуле")
+    parser.add_argument("--iterations", type=int, default=10_000_000, help="Итераций нагрузки на задачу")
+    parser.add_argument("--interval", type=float, default=0.01, help="Интервал вызова хендлера в секундах")
+    args = parser.parse_args()
+
+    print(f"Задач: {args.jobs}, итераций: {args.iterations}, интервал хендлера: {args.interval * 1000:.0f} мс\n")
+    print(f"{'бэкенд':<10}{'замеров':>9}{'p50, мс':>10}{'p95, мс':>10}{'max, мс':>10}{'нагрузка, с':>14}")
+
+    for backend in ("thread", "process"):
+        result = await measure(backend, args.jobs, args.iterations, args.interval)
+        print(
+            f"{backend:<10}{result['samples']:>9}{result['p50']:>10.2f}"
+            f"{result['p95']:>10.2f}{result['max']:>10.2f}{result['load_time']:>14.2f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
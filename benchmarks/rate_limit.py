@@ -0,0 +1,119 @@
+"""
+Бенчмарк накладных расходов RateLimitMiddleware на одно событие
+
+Пропускает через миддлвар поток событий от множества пользователей
+(ссылки на видео, кнопки навигации и скачивания) с бэкендами ограничения
+memory и redis и измеряет время вызова миддлвара с пустым хендлером. Лимит
+выбран так, чтобы все события проходили: ответ об отказе требует бота.
+Бэкенд redis измеряется, только если Redis доступен по REDIS_URL.
+
+Запуск из корня репозитория:
+    python -m benchmarks.rate_limit
+    python -m benchmarks.rate_limit --updates 50000 --users 5000
+"""
+import os
+
+os.environ.setdefault("BOT_TOKEN", "benchmark")
+os.environ.setdefault("REDIS_ENABLED", "true")
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Any, Dict, List, Tuple
+
+from aiogram.types import Update
+
+from app.middlewares import RateLimitMiddleware
+from app.services.rate_limiter import MemoryRateLimiter, RedisRateLimiter
+from app.services.redis_client import get_redis, close_redis
+
+
+async def empty_handler(event, data) -> None:
+    """Хендлер без работы: измеряется только миддлвар"""
+
+
+def make_update(index: int, user_id: int) -> Update:
+    """Событие пользователя: ссылка, кнопка навигации или скачивание"""
+    user = {'id': user_id, 'is_bot': False, 'first_name': "benchmark"}
+    kind = index % 4
+    if kind == 0:
+        return Update.model_validate({
+            'update_id': index,
+            'message': {
+                'message_id': index,
+                'date': 0,
+                'chat': {'id': user_id, 'type': "private"},
+                'from': user,
+                'text': "https://youtu.be/dQw4w9WgXcQ",
+            },
+        })
+    data = ("info:1", "back_to_download:1", "download:1:mp4:720p")[kind - 1]
+    return Update.model_validate({
+        'update_id': index,
+        'callback_query': {'id': str(index), 'from': user, 'chat_instance': "1", 'data': data},
+    })
+
+
+async def measure(middleware: RateLimitMiddleware, updates: int, users: int) -> Dict[str, float]:
+    """Время вызова миддлвара на каждое событие в микросекундах"""
+    events: List[Tuple[Update, Dict[str, Any]]] = []
+    for index in range(updates):
+        update = make_update(index, 1_000_000 + index % users)
+        events.append((update, {'event_from_user': update.event.from_user}))
+
+    timings: List[float] = []
+    for update, data in events:
+        started = time.perf_counter()
+        await middleware(empty_handler, update, data)
+        timings.append((time.perf_counter() - started) * 1_000_000)
+
+    timings.sort()
+    stats = middleware.limiter.get_stats()
+    return {
+        'p50': statistics.median(timings),
+        'p95': timings[int(len(timings) * 0.95) - 1],
+        'total': sum(timings) / 1_000_000,
+        'rejected': stats['rejected'],
+    }
+
+
+async def redis_available() -> bool:
+    redis = get_redis()
+    if redis is None:
+        return False
+    try:
+        await redis.ping()
+    except Exception:
+        return False
+    return True
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=20000, help="Количество событий")
+    parser.add_argument("--users", type=int, default=1000, help="Количество пользователей")
+    parser.add_argument("--limit", type=int, default=1_000_000, help="Бюджет в минуту на пользователя")
+    args = parser.parse_args()
+
+    print(f"Событий: {args.updates}, пользователей: {args.users}, бюджет: {args.limit} в минуту\n")
+    print(f"{'бэкенд':<10}{'p50, мкс':>10}{'p95, мкс':>10}{'всего, с':>11}{'отклонено':>11}")
+
+    backends = [("memory", MemoryRateLimiter(args.limit))]
+    if await redis_available():
+        backends.append(("redis", RedisRateLimiter(args.limit)))
+
+    for name, limiter in backends:
+        result = await measure(RateLimitMiddleware(limiter), args.updates, args.users)
+        print(
+            f"{name:<10}{result['p50']:>10.1f}{result['p95']:>10.1f}"
+            f"{result['total']:>11.2f}{result['rejected']:>11}"
+        )
+
+    if len(backends) == 1:
+        print("\nRedis недоступен, бэкенд redis не измерялся")
+    await close_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+"""
+Бенчмарк создания экземпляров YoutubeDL
+
+Сравнивает создание нового экземпляра YoutubeDL на каждое задание
+(как было раньше) с переиспользованием экземпляра потока из ytdlp_worker,
+на который накладываются опции задания. Сеть не используется: измеряется
+только подготовка экземпляра к заданию.
+
+Запуск из корня репозитория:
+    python -m benchmarks.ytdlp_instances
+    python -m benchmarks.ytdlp_instances --jobs 500
+"""
+import argparse
+import statistics
+import time
+from typing import Callable, Dict, List
+
+import yt_dlp
+
+from app.services import ytdlp_worker
+
+
+def job_options(index: int) -> Dict:
+    """Опции задания скачивания: общие опции плюс свои формат и шаблон имени"""
+    height = (240, 360, 480, 720, 1080)[index % 5]
+    return {
+        'format': f'bestvideo[height<={height}]+bestaudio/best[height<={height}]/best',
+        'outtmpl': f'/tmp/benchmark/{index}/%(id)s.%(format_id)s.%(ext)s',
+        'quiet': True,
+        'no_warnings': True,
+        'writeinfojson': False,
+        'writesubtitles': False,
+        'writeautomaticsub': False,
+        'ignoreerrors': False,
+        'continuedl': True,
+        'nopart': False,
+        'max_filesize': 50 * 1024 * 1024,
+    }
+
+
+def fresh_instance(opts: Dict) -> None:
+    """Новый экземпляр на каждое задание"""
+    with yt_dlp.YoutubeDL(opts):
+        pass
+
+
+def pooled_instance(opts: Dict) -> None:
+    """Экземпляр потока с наложенными опциями задания"""
+    with ytdlp_worker._job_ydl(opts):
+        pass
+
+
+def measure(func: Callable[[Dict], None], jobs: int) -> List[float]:
+    """Время подготовки экземпляра для каждого задания в миллисекундах"""
+    timings = []
+    for index in range(jobs):
+        opts = job_options(index)
+        started = time.perf_counter()
+        func(opts)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=200, help="Количество заданий")
+    args = parser.parse_args()
+
+    print(f"yt-dlp {yt_dlp.version.__version__}, заданий: {args.jobs}\n")
+    print(f"{'режим':<10}{'p50, мс':>10}{'p95, мс':>10}{'всего, с':>11}")
+
+    for name, func in (("new", fresh_instance), ("pooled", pooled_instance)):
+        timings = sorted(measure(func, args.jobs))
+        print(
+            f"{name:<10}{statistics.median(timings):>10.3f}"
+            f"{timings[int(len(timings) * 0.95) - 1]:>10.3f}{sum(timings) / 1000:>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "download_history" ADD "chat_id" BIGINT;
+        ALTER TABLE "download_history" ADD "message_id" BIGINT;
+        ALTER TABLE "download_history" ADD "worker_id" VARCHAR(255);
+        ALTER TABLE "download_history" ADD "heartbeat_at" TIMESTAMPTZ;
+        ALTER TABLE "download_history" ADD "attempts" INT NOT NULL DEFAULT 0;
+        CREATE INDEX IF NOT EXISTS "idx_download_hi_status_8d4f7e" ON "download_history" ("status", "created_at");
+        COMMENT ON COLUMN "download_history"."chat_id" IS 'ID чата для отправки файла';
+        COMMENT ON COLUMN "download_history"."message_id" IS 'ID сообщения со статусом скачивания';
+        COMMENT ON COLUMN "download_history"."worker_id" IS 'Обработчик, выполняющий скачивание';
+        COMMENT ON COLUMN "download_history"."heartbeat_at" IS 'Последний сигнал жизни обработчика';
+        COMMENT ON COLUMN "download_history"."attempts" IS 'Количество попыток скачивания';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_download_hi_status_8d4f7e";
+        ALTER TABLE "download_history" DROP COLUMN "chat_id";
+        ALTER TABLE "download_history" DROP COLUMN "message_id";
+        ALTER TABLE "download_history" DROP COLUMN "worker_id";
+        ALTER TABLE "download_history" DROP COLUMN "heartbeat_at";
+        ALTER TABLE "download_history" DROP COLUMN "attempts";"""
@@ -0,0 +1,12 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "videos" ADD "refreshed_at" TIMESTAMPTZ;
+        COMMENT ON COLUMN "videos"."refreshed_at" IS 'Дата последнего получения информации с YouTube';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "videos" DROP COLUMN "refreshed_at";"""
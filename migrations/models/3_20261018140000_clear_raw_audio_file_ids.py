@@ -0,0 +1,19 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    # file_id MP3, загруженных до перекодирования (исходный webm/m4a), больше
+    # не отдаются из кэша: такие файлы скачиваются и перекодируются заново.
+    # Остаются файлы с заданием ffmpeg и AAC, отправленный потоком в режиме remux
+    return """
+        UPDATE "download_history" SET "telegram_file_id" = NULL
+        WHERE "format_type" = 'mp3'
+          AND "telegram_file_id" IS NOT NULL
+          AND NOT (COALESCE("metadata", '{}'::jsonb) ? 'transcode')
+          AND COALESCE("metadata"->>'source', '') <> 'stream';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    # Удаленные file_id не восстановить
+    return """
+        SELECT 1;"""
@@ -0,0 +1,13 @@
+"""
+Общие настройки тестов
+"""
+import os
+import tempfile
+
+# Настройки читаются при импорте app.config.settings: тестам не нужны
+# токен бота, Redis и папки рабочего окружения
+_TEST_ROOT = tempfile.mkdtemp(prefix="youtube-bot-tests-")
+os.environ.setdefault("BOT_TOKEN", "123456:test-token")
+os.environ.setdefault("REDIS_ENABLED", "false")
+os.environ.setdefault("DOWNLOAD_PATH", os.path.join(_TEST_ROOT, "downloads"))
+os.environ.setdefault("LOG_FILE", os.path.join(_TEST_ROOT, "bot.log"))
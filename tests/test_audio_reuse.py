@@ -0,0 +1,68 @@
+"""
+Повторное использование скачанного аудио: под видом MP3 отправляется
+только результат перекодирования
+"""
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import youtube_service as youtube_service_module
+from app.services.media_cache import MediaCache
+from app.services.youtube_service import YouTubeService
+
+VIDEO = SimpleNamespace(video_id="dQw4w9WgXcQ")
+TRANSCODE_JOB = {'mode': "mp3", 'cpu_time': 1.0, 'wall_time': 1.0, 'input_bytes': 10, 'output_bytes': 8}
+
+
+@pytest.fixture
+def cache(tmp_path: Path, monkeypatch) -> MediaCache:
+    cache = MediaCache(root=tmp_path / "cache", max_bytes=10 ** 9, policy="lru")
+    monkeypatch.setattr(youtube_service_module, "media_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def service(monkeypatch) -> YouTubeService:
+    async def not_downloaded(*args):
+        return None
+
+    service = YouTubeService()
+    monkeypatch.setattr(service, "_find_downloaded_file", not_downloaded)
+    # Без ffmpeg скачивание MP3 завершается ошибкой до обращения к yt-dlp
+    monkeypatch.setattr(youtube_service_module.transcoder, "ffmpeg", None)
+    return service
+
+
+def _put(cache: MediaCache, tmp_path: Path, format_id: str, ext: str, transcode=None) -> str:
+    source = tmp_path / f"source.{ext}"
+    source.write_bytes(b"audio")
+    path, _ = cache.put(VIDEO.video_id, "audio", "mp3", format_id, ext, str(source), transcode=transcode)
+    return path
+
+
+@pytest.mark.parametrize(
+    "format_type, transcode_job, sendable",
+    [
+        ("mp4", None, True),
+        ("mp3", TRANSCODE_JOB, True),
+        ("mp3", None, False),
+    ],
+)
+def test_is_sendable(format_type, transcode_job, sendable):
+    assert YouTubeService._is_sendable(format_type, transcode_job) is sendable
+
+
+async def test_transcoded_audio_is_reused_from_cache(cache, service, tmp_path: Path):
+    path = _put(cache, tmp_path, "140-mp3", "mp3", transcode=TRANSCODE_JOB)
+
+    assert await service._fetch_file(VIDEO, "audio", "mp3") == (path, 5)
+
+
+@pytest.mark.parametrize("ext", ["m4a", "webm"])
+async def test_raw_audio_in_cache_is_not_sent_as_mp3(cache, service, tmp_path: Path, ext):
+    # Прежние версии сохраняли исходный поток без задания ffmpeg
+    _put(cache, tmp_path, "140", ext)
+
+    with pytest.raises(Exception, match="ffmpeg"):
+        await service._fetch_file(VIDEO, "audio", "mp3")
@@ -0,0 +1,114 @@
+"""
+Блокировка файлов между процессами (flock)
+"""
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from app.services import file_lock as file_lock_module
+from app.services.file_lock import file_lock, locked, try_lock
+
+# Держит блокировку, сообщает о ней и удаляет файл блокировки перед освобождением
+_HOLDER_SCRIPT = """
+import fcntl, os, sys, time
+path = sys.argv[1]
+fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+fcntl.flock(fd, fcntl.LOCK_EX)
+print("locked", flush=True)
+time.sleep(float(sys.argv[2]))
+os.unlink(path)
+os.close(fd)
+"""
+
+
+def test_lock_is_exclusive_until_closed(tmp_path: Path):
+    path = tmp_path / "job.lock"
+
+    fd = try_lock(path)
+    assert fd is not None
+    assert try_lock(path) is None
+
+    os.close(fd)
+    fd = try_lock(path)
+    assert fd is not None
+    os.close(fd)
+
+
+def test_lock_on_unlinked_file_is_retaken_on_the_new_file(tmp_path: Path, monkeypatch):
+    path = tmp_path / "job.lock"
+    real_flock = file_lock_module.fcntl.flock
+    unlinked = []
+
+    def flock(fd, operation):
+        real_flock(fd, operation)
+        # Прежний владелец удалил файл между нашими open и flock
+        if not unlinked:
+            unlinked.append(os.fstat(fd).st_ino)
+            os.unlink(path)
+
+    monkeypatch.setattr(file_lock_module.fcntl, "flock", flock)
+    fd = try_lock(path)
+
+    assert fd is not None
+    assert os.fstat(fd).st_ino == os.stat(path).st_ino
+    assert len(unlinked) == 1
+    os.close(fd)
+
+
+async def test_file_lock_waits_for_another_process(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(file_lock_module, "_POLL_INTERVAL", 0.01)
+    path = tmp_path / "job.lock"
+    holder = subprocess.Popen(
+        [sys.executable, "-c", _HOLDER_SCRIPT, str(path), "0.5"],
+        stdout=subprocess.PIPE,
+        text=True
+    )
+    try:
+        assert holder.stdout.readline().strip() == "locked"
+        started = time.monotonic()
+        async with file_lock(path):
+            waited = time.monotonic() - started
+            # Блокировка взята на новом файле, а не на удаленном
+            assert path.exists()
+            assert try_lock(path) is None
+    finally:
+        holder.wait(timeout=5)
+
+    assert waited >= 0.3
+    assert holder.returncode == 0
+
+
+async def test_file_lock_releases_on_error(tmp_path: Path):
+    path = tmp_path / "job.lock"
+
+    try:
+        async with file_lock(path):
+            raise RuntimeError("ошибка скачивания")
+    except RuntimeError:
+        pass
+
+    fd = try_lock(path)
+    assert fd is not None
+    os.close(fd)
+
+
+def test_locked_blocks_until_another_process_releases(tmp_path: Path):
+    path = tmp_path / "index.lock"
+    holder = subprocess.Popen(
+        [sys.executable, "-c", _HOLDER_SCRIPT, str(path), "0.5"],
+        stdout=subprocess.PIPE,
+        text=True
+    )
+    try:
+        assert holder.stdout.readline().strip() == "locked"
+        started = time.monotonic()
+        with locked(path):
+            waited = time.monotonic() - started
+            assert try_lock(path) is None
+    finally:
+        holder.wait(timeout=5)
+
+    assert waited >= 0.3
+    assert path.exists()
@@ -0,0 +1,101 @@
+"""
+Выбор формата по оценке размера до скачивания
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from app.config.settings import settings
+from app.handlers.download import size_warning_text
+from app.services.media_splitter import media_splitter
+from app.services.youtube_service import YouTubeService
+
+MB = 1024 * 1024
+
+FORMATS = [
+    {'format_id': "140", 'vcodec': "none", 'acodec': "mp4a.40.2", 'filesize': 5 * MB},
+    {'format_id': "251", 'vcodec': "none", 'acodec': "opus", 'filesize': 6 * MB},
+    {'format_id': "18", 'height': 360, 'vcodec': "avc1", 'acodec': "mp4a.40.2", 'filesize': 20 * MB},
+    {'format_id': "135", 'height': 480, 'vcodec': "avc1", 'acodec': "none", 'filesize': 40 * MB},
+    {'format_id': "136", 'height': 720, 'vcodec': "avc1", 'acodec': "none", 'filesize': 80 * MB},
+    {'format_id': "137", 'height': 1080, 'vcodec': "avc1", 'acodec': "none", 'filesize': 200 * MB},
+]
+
+
+def make_video(formats=FORMATS, duration: int = 600) -> SimpleNamespace:
+    return SimpleNamespace(available_formats=formats, duration=duration)
+
+
+@pytest.fixture
+def service(monkeypatch) -> YouTubeService:
+    # Без ffmpeg файл не делится на части: отправить можно не больше 100 МБ
+    monkeypatch.setattr(settings, "max_file_size", 100 * MB)
+    monkeypatch.setattr(media_splitter, "ffmpeg", None)
+    monkeypatch.setattr(settings, "audio_mode", "mp3")
+    return YouTubeService()
+
+
+def test_best_quality_that_fits_is_chosen_with_best_fitting_audio(service):
+    plan = service.plan_format(make_video(), "1080p", "mp4")
+
+    assert plan == {'format': "136+251", 'height': 720, 'estimated_size': 86 * MB}
+
+
+def test_requested_quality_is_an_upper_bound(service):
+    assert service.plan_format(make_video(), "480p", "mp4")['format'] == "135+251"
+    assert service.plan_format(make_video(), "360p", "mp4")['format'] == "18"
+
+
+def test_smaller_audio_is_used_when_the_best_one_does_not_fit(service, monkeypatch):
+    # Предел - 95% от 90 МБ: 80 + 5 помещается, 80 + 6 - нет
+    monkeypatch.setattr(settings, "max_file_size", 90 * MB)
+
+    assert service.plan_format(make_video(), "720p", "mp4")['format'] == "136+140"
+
+
+def test_nothing_fits(service, monkeypatch):
+    monkeypatch.setattr(settings, "max_file_size", 10 * MB)
+
+    plan = service.plan_format(make_video(), "1080p", "mp4")
+
+    assert plan == {'format': None, 'height': None, 'estimated_size': 20 * MB}
+
+
+@pytest.mark.parametrize("audio_mode, format_id", [("mp3", "251"), ("remux", "140")])
+def test_audio_format_depends_on_audio_mode(service, monkeypatch, audio_mode, format_id):
+    monkeypatch.setattr(settings, "audio_mode", audio_mode)
+
+    plan = service.plan_format(make_video(), "audio", "mp3")
+
+    assert plan['format'] == format_id
+    assert plan['height'] is None
+
+
+def test_size_is_estimated_from_bitrate(service):
+    formats = [
+        {'format_id': "140", 'vcodec': "none", 'acodec': "mp4a.40.2", 'tbr': 128},
+        {'format_id': "136", 'height': 720, 'vcodec': "avc1", 'acodec': "none", 'tbr': 1000},
+    ]
+
+    plan = service.plan_format(make_video(formats, duration=600), "720p", "mp4")
+
+    assert plan['estimated_size'] == (1000 + 128) * 1000 // 8 * 600
+
+
+def test_unknown_audio_size_means_no_plan(service):
+    formats = [fmt for fmt in FORMATS if fmt['vcodec'] != "none"]
+
+    assert service.plan_format(make_video(formats), "720p", "mp4") is None
+
+
+async def test_qualities_that_do_not_fit_are_hidden(service, monkeypatch):
+    video = make_video()
+
+    qualities = await service.get_available_qualities(video)
+    assert [quality['name'] for quality in qualities] == ["720p", "480p", "360p"]
+    assert size_warning_text(video, qualities) == ""
+
+    monkeypatch.setattr(settings, "max_file_size", 10 * MB)
+    qualities = await service.get_available_qualities(video)
+    assert qualities == []
+    assert "слишком большое" in size_warning_text(video, qualities)
@@ -0,0 +1,95 @@
+"""
+Отправка файлов через локальный сервер Bot API (заглушка на aiohttp)
+"""
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+
+from app.config.settings import Settings, settings, CLOUD_API_UPLOAD_LIMIT, LOCAL_API_UPLOAD_LIMIT
+from app.services.delivery_service import DeliveryService
+from app.bot import create_bot
+
+CHAT_ID = 1001
+VIDEO = SimpleNamespace(title="Тестовое видео", channel_name="Тестовый канал")
+# Папка скачиваний, как ее видит локальный сервер Bot API
+SERVER_DOWNLOAD_PATH = "/var/lib/telegram-bot-api/downloads"
+
+
+def _message(method: str) -> dict:
+    """Ответ Bot API на отправку файла"""
+    message = {'message_id': 1, 'date': 0, 'chat': {'id': CHAT_ID, 'type': "private"}}
+    if method == "sendAudio":
+        message['audio'] = {'file_id': "audio-file-id", 'file_unique_id': "audio", 'duration': 10}
+    else:
+        message['video'] = {
+            'file_id': "video-file-id", 'file_unique_id': "video", 'width': 640, 'height': 360, 'duration': 10
+        }
+    return message
+
+
+@pytest.fixture
+async def bot_api():
+    """Заглушка локального сервера Bot API, запоминающая полученные запросы"""
+    requests = []
+
+    async def handle(request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        requests.append((method, await request.post()))
+        return web.json_response({'ok': True, 'result': _message(method)})
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    yield f"http://127.0.0.1:{port}", requests
+    await runner.cleanup()
+
+
+@pytest.mark.parametrize(
+    "format_type, ext, method, field, file_id",
+    [
+        ("mp4", "mp4", "sendVideo", "video", "video-file-id"),
+        ("mp3", "mp3", "sendAudio", "audio", "audio-file-id"),
+    ],
+)
+async def test_upload_sends_server_path_instead_of_file(
+    bot_api, monkeypatch, tmp_path: Path, format_type, ext, method, field, file_id
+):
+    server, requests = bot_api
+    download_path = tmp_path / "downloads"
+    file_path = download_path / "cache" / "abc" / f"137.{ext}"
+    file_path.parent.mkdir(parents=True)
+    file_path.write_bytes(b"\0" * 1024)
+
+    monkeypatch.setattr(settings, "telegram_api_server", server)
+    monkeypatch.setattr(settings, "telegram_api_download_path", SERVER_DOWNLOAD_PATH)
+    monkeypatch.setattr(settings, "download_path", str(download_path))
+
+    bot = create_bot()
+    try:
+        uploaded = await DeliveryService(bot)._upload_file(CHAT_ID, VIDEO, format_type, str(file_path))
+    finally:
+        await bot.session.close()
+
+    assert [sent_method for sent_method, _ in requests] == [method]
+    form = requests[0][1]
+    assert form[field] == f"file://{SERVER_DOWNLOAD_PATH}/cache/abc/137.{ext}"
+    # Содержимое файла бот не передает
+    assert not any(isinstance(value, web.FileField) for value in form.values())
+    assert uploaded.file_id == file_id
+
+
+def test_max_file_size_is_clamped_to_bot_api_limit():
+    requested = 4000 * 1024 * 1024
+
+    local = Settings(_env_file=None, telegram_api_server="http://localhost:8081", max_file_size=requested)
+    cloud = Settings(_env_file=None, telegram_api_server=None, max_file_size=requested)
+
+    assert local.max_file_size == LOCAL_API_UPLOAD_LIMIT == 2000 * 1024 * 1024
+    assert cloud.max_file_size == CLOUD_API_UPLOAD_LIMIT
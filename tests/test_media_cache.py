@@ -0,0 +1,109 @@
+"""
+Кэш файлов с общей папкой у нескольких процессов бота
+"""
+from pathlib import Path
+
+import pytest
+
+from app.config.settings import settings
+from app.services import media_cache as media_cache_module
+from app.services.media_cache import MediaCache
+
+# Два файла по 8 байт не помещаются в бюджет
+MAX_BYTES = 10
+
+
+@pytest.fixture(autouse=True)
+def no_grace_period(monkeypatch):
+    monkeypatch.setattr(media_cache_module, "_EVICTION_GRACE_PERIOD", 0)
+
+
+def make_cache(tmp_path: Path) -> MediaCache:
+    """Экземпляр кэша отдельного процесса с общей папкой"""
+    return MediaCache(root=tmp_path / "cache", max_bytes=MAX_BYTES, policy="lru")
+
+
+def put(cache: MediaCache, tmp_path: Path, video_id: str) -> str:
+    source = tmp_path / f"{video_id}.mp4"
+    source.write_bytes(b"\0" * 8)
+    path, _ = cache.put(video_id, "720p", "mp4", "136", "mp4", str(source), height=720)
+    return path
+
+
+def test_processes_see_each_others_files(tmp_path: Path):
+    first, second = make_cache(tmp_path), make_cache(tmp_path)
+    first.max_bytes = second.max_bytes = 100
+
+    put(first, tmp_path, "aaa")
+    put(second, tmp_path, "bbb")
+    first.save()
+
+    # Запись второго процесса не затерла индекс первого
+    assert first.get("bbb", "720p", "mp4") is not None
+    assert second.get("aaa", "720p", "mp4") is not None
+    assert make_cache(tmp_path).get_stats()['entries'] == 2
+
+
+def test_file_pinned_by_another_process_is_not_evicted(tmp_path: Path):
+    uploader, other = make_cache(tmp_path), make_cache(tmp_path)
+    path = put(uploader, tmp_path, "aaa")
+    uploader.pin(path)
+
+    put(other, tmp_path, "bbb")
+
+    assert Path(path).exists()
+    assert other.evictions == 0
+
+
+def test_unpinned_file_is_evicted_by_another_process(tmp_path: Path):
+    uploader, other = make_cache(tmp_path), make_cache(tmp_path)
+    path = put(uploader, tmp_path, "aaa")
+    uploader.pin(path)
+    uploader.unpin(path)
+
+    put(other, tmp_path, "bbb")
+
+    assert not Path(path).exists()
+    assert other.evictions == 1
+    # Первый процесс забывает вытесненный файл при следующей записи индекса
+    uploader.save()
+    assert uploader.get("aaa", "720p", "mp4") is None
+
+
+def test_pin_of_crashed_process_expires(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(settings, "job_stale_timeout", 0)
+    crashed, other = make_cache(tmp_path), make_cache(tmp_path)
+    path = put(crashed, tmp_path, "aaa")
+    crashed.pin(path)
+
+    put(other, tmp_path, "bbb")
+
+    assert not Path(path).exists()
+
+
+def test_file_pinned_by_two_processes_stays_pinned_until_both_unpin(tmp_path: Path):
+    first, second, other = make_cache(tmp_path), make_cache(tmp_path), make_cache(tmp_path)
+    path = put(first, tmp_path, "aaa")
+    first.pin(path)
+    second.pin(path)
+
+    first.unpin(path)
+    put(other, tmp_path, "bbb")
+    assert Path(path).exists()
+
+    second.unpin(path)
+    assert other.enforce_budget() == 8
+    assert not Path(path).exists()
+
+
+def test_pinned_file_is_not_evicted_by_own_process(tmp_path: Path):
+    cache = make_cache(tmp_path)
+    path = put(cache, tmp_path, "aaa")
+    cache.pin(path)
+
+    put(cache, tmp_path, "bbb")
+    assert Path(path).exists()
+
+    cache.unpin(path)
+    assert cache.enforce_budget() == 8
+    assert not Path(path).exists()
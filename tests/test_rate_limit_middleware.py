@@ -0,0 +1,122 @@
+"""
+Стоимость действий в RateLimitMiddleware
+"""
+from typing import List, Tuple
+
+import pytest
+from aiogram.types import CallbackQuery, Update
+
+from app.config.settings import settings
+from app.middlewares.rate_limit_middleware import (
+    DOWNLOAD_COST,
+    NAVIGATION_COST,
+    VIDEO_LINK_COST,
+    RateLimitMiddleware,
+)
+
+USER_ID = 555
+ADMIN_ID = 777
+
+
+def message_update(text: str, user_id: int = USER_ID) -> Update:
+    return Update.model_validate({
+        'update_id': 1,
+        'message': {
+            'message_id': 1,
+            'date': 0,
+            'chat': {'id': user_id, 'type': "private"},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': "test"},
+            'text': text,
+        },
+    })
+
+
+def callback_update(data: str, user_id: int = USER_ID) -> Update:
+    return Update.model_validate({
+        'update_id': 1,
+        'callback_query': {
+            'id': "1",
+            'from': {'id': user_id, 'is_bot': False, 'first_name': "test"},
+            'chat_instance': "1",
+            'data': data,
+        },
+    })
+
+
+class RecordingLimiter:
+    """Ограничение, которое запоминает стоимость и возвращает заданное ожидание"""
+
+    def __init__(self, retry_after: float = 0.0):
+        self.retry_after = retry_after
+        self.calls: List[Tuple[int, float]] = []
+
+    async def acquire(self, key: int, cost: float = 1.0) -> float:
+        self.calls.append((key, cost))
+        return self.retry_after
+
+
+@pytest.mark.parametrize(
+    "update, cost",
+    [
+        (callback_update("download:12:mp4:720p"), DOWNLOAD_COST),
+        (callback_update("info:12"), NAVIGATION_COST),
+        (callback_update("back_to_download:12"), NAVIGATION_COST),
+        (message_update("https://youtu.be/dQw4w9WgXcQ"), VIDEO_LINK_COST),
+        (message_update("https://www.youtube.com/watch?v=dQw4w9WgXcQ"), VIDEO_LINK_COST),
+        (message_update("/start"), NAVIGATION_COST),
+    ],
+)
+def test_action_cost(update: Update, cost: float):
+    assert RateLimitMiddleware.action_cost(update) == cost
+
+
+def test_download_is_the_most_expensive_action():
+    assert DOWNLOAD_COST > VIDEO_LINK_COST > NAVIGATION_COST
+
+
+async def test_allowed_action_reaches_handler_and_spends_its_cost():
+    limiter = RecordingLimiter()
+    middleware = RateLimitMiddleware(limiter)
+    update = callback_update("download:12:mp4:720p")
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event)
+        return "ok"
+
+    result = await middleware(handler, update, {'event_from_user': update.callback_query.from_user})
+
+    assert result == "ok"
+    assert handled == [update]
+    assert limiter.calls == [(USER_ID, DOWNLOAD_COST)]
+
+
+async def test_rejected_callback_gets_alert_with_wait_time(monkeypatch):
+    answers = []
+
+    async def answer(self, text=None, show_alert=None, **kwargs):
+        answers.append((text, show_alert))
+
+    monkeypatch.setattr(CallbackQuery, "answer", answer)
+    middleware = RateLimitMiddleware(RecordingLimiter(retry_after=11.2))
+    update = callback_update("download:12:mp4:720p")
+
+    async def handler(event, data):
+        pytest.fail("Хендлер не должен вызываться при превышении лимита")
+
+    await middleware(handler, update, {'event_from_user': update.callback_query.from_user})
+
+    assert answers == [("⚠️ Слишком много запросов. Повторите через 12 сек.", True)]
+
+
+async def test_admins_are_not_limited(monkeypatch):
+    monkeypatch.setattr(settings, "admin_ids", [ADMIN_ID])
+    limiter = RecordingLimiter(retry_after=30)
+    middleware = RateLimitMiddleware(limiter)
+    update = message_update("https://youtu.be/dQw4w9WgXcQ", user_id=ADMIN_ID)
+
+    async def handler(event, data):
+        return "ok"
+
+    assert await middleware(handler, update, {'event_from_user': update.message.from_user}) == "ok"
+    assert limiter.calls == []
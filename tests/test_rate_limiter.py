@@ -0,0 +1,97 @@
+"""
+Ограничение частоты запросов по алгоритму GCRA
+"""
+import pytest
+
+from app.services import rate_limiter as rate_limiter_module
+from app.services.rate_limiter import MemoryRateLimiter, RedisRateLimiter
+
+
+class FakeClock:
+    """Время для time.monotonic, которое двигает тест"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter_module.time, "monotonic", clock)
+    return clock
+
+
+async def test_budget_can_be_spent_at_once_then_refills_one_unit_per_interval(clock):
+    limiter = MemoryRateLimiter(limit=5, period=60)
+
+    assert [await limiter.acquire("user") for _ in range(5)] == [0.0] * 5
+    assert await limiter.acquire("user") == pytest.approx(12.0)
+
+    clock.now += 11.9
+    assert await limiter.acquire("user") == pytest.approx(0.1)
+    clock.now += 0.1
+    assert await limiter.acquire("user") == 0.0
+    assert await limiter.acquire("user") == pytest.approx(12.0)
+
+    assert limiter.get_stats()['allowed'] == 6
+    assert limiter.get_stats()['rejected'] == 3
+
+
+async def test_cost_is_weighted_and_capped_by_budget(clock):
+    limiter = MemoryRateLimiter(limit=5, period=60)
+
+    assert [await limiter.acquire("cheap", 0.1) for _ in range(50)] == [0.0] * 50
+    assert await limiter.acquire("cheap", 0.1) > 0
+
+    # Действие дороже всего бюджета разрешено, когда бюджет полон
+    assert await limiter.acquire("expensive", 100) == 0.0
+    assert await limiter.acquire("expensive", 0.1) > 0
+
+
+async def test_users_have_separate_budgets_and_idle_users_are_forgotten(clock):
+    limiter = MemoryRateLimiter(limit=2, period=60)
+
+    for key in ("first", "second"):
+        assert await limiter.acquire(key) == 0.0
+        assert await limiter.acquire(key) == 0.0
+    assert await limiter.acquire("first") > 0
+    assert limiter.get_stats()['tracked'] == 2
+
+    # Бюджет восстановился полностью - запись не отличается от отсутствующей
+    clock.now += 60
+    assert await limiter.acquire("third") == 0.0
+    assert limiter.get_stats()['tracked'] == 1
+
+
+async def test_redis_backend_runs_gcra_script(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(rate_limiter_module, "get_redis", lambda: redis)
+    limiter = RedisRateLimiter(limit=3, period=60)
+
+    assert [await limiter.acquire(42) for _ in range(3)] == [0.0] * 3
+    assert await limiter.acquire(42) == pytest.approx(20.0, abs=0.5)
+    assert await limiter.acquire(42, 0.1) > 0
+    # Ключ живет, пока бюджет не восстановится полностью
+    assert 0 < await redis.pttl("rate_limit:42") <= 60_000
+
+    assert limiter.get_stats()['fallbacks'] == 0
+    assert limiter.get_stats()['rejected'] == 2
+    await redis.aclose()
+
+
+async def test_redis_errors_fall_back_to_process_memory(monkeypatch, clock):
+    class BrokenRedis:
+        async def eval(self, *args):
+            raise ConnectionError("Redis недоступен")
+
+    monkeypatch.setattr(rate_limiter_module, "get_redis", lambda: BrokenRedis())
+    limiter = RedisRateLimiter(limit=1, period=60)
+
+    assert await limiter.acquire("user") == 0.0
+    assert await limiter.acquire("user") == pytest.approx(60.0)
+    assert limiter.get_stats()['fallbacks'] == 2
@@ -0,0 +1,154 @@
+"""
+Функции yt-dlp для пула потоков или процессов
+"""
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from app.services import ytdlp_worker
+
+ROOT = Path(__file__).resolve().parent.parent
+OPTIONS = {'quiet': True, 'format': "18", 'outtmpl': "first/%(id)s.%(ext)s"}
+
+
+@pytest.fixture(autouse=True)
+def instances():
+    """Экземпляры YoutubeDL текущего потока, очищаемые после теста"""
+    instances = ytdlp_worker._instances()
+    yield instances
+    for ydl, _ in instances.values():
+        ydl.close()
+    instances.clear()
+
+
+class FakeClock:
+    """Часы для time.monotonic и time.sleep: сон только сдвигает время"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, delay: float) -> None:
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(ytdlp_worker.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(ytdlp_worker.time, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def bucket(clock, monkeypatch) -> ytdlp_worker._TokenBucket:
+    bucket = ytdlp_worker._TokenBucket()
+    monkeypatch.setattr(ytdlp_worker, "_bucket", bucket)
+    return bucket
+
+
+def test_bucket_without_rate_does_not_sleep(bucket, clock):
+    bucket.consume(10 ** 9)
+
+    assert clock.sleeps == []
+
+
+def test_consumer_sleeps_until_debt_is_repaid(bucket, clock):
+    bucket.set_rate(1000)
+
+    bucket.consume(2500)
+    bucket.consume(500)
+
+    assert clock.sleeps == [pytest.approx(2.5), pytest.approx(0.5)]
+
+
+def test_total_rate_does_not_exceed_limit(bucket, clock):
+    bucket.set_rate(1000)
+    started = clock.now
+
+    for _ in range(100):
+        bucket.consume(300)
+
+    assert 100 * 300 / (clock.now - started) <= 1000
+
+
+def test_unused_bandwidth_is_kept_for_at_most_one_second(bucket, clock):
+    bucket.set_rate(1000)
+    clock.now += 60
+
+    bucket.consume(1000)
+    assert clock.sleeps == []
+
+    bucket.consume(1000)
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+
+def test_progress_hook_consumes_only_new_bytes(bucket, clock):
+    bucket.set_rate(1000)
+    job = ytdlp_worker._JobContext()
+
+    # Первое событие учитывает докачанные до перезапуска 5000 байт как уже скачанные
+    job.on_progress({'filename': "a.mp4", 'downloaded_bytes': 5000})
+    job.on_progress({'filename': "a.mp4", 'downloaded_bytes': 6000})
+    job.on_progress({'filename': "a.m4a", 'downloaded_bytes': 0})
+    job.on_progress({'filename': "a.m4a", 'downloaded_bytes': 500})
+
+    assert clock.sleeps == [pytest.approx(1.0), pytest.approx(0.5)]
+
+
+def test_worker_process_imports_only_yt_dlp():
+    # Так модуль загружает рабочий процесс пула, запущенный методом spawn
+    script = (
+        "import sys, app.services.ytdlp_worker; "
+        "print(' '.join(sorted(name for name in sys.modules if name.startswith(('app', 'aiogram', 'tortoise')))))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+
+    assert result.stdout.split() == ["app", "app.services", "app.services.ytdlp_worker"]
+
+
+def test_spawned_process_does_not_start_the_bot():
+    # Процесс, созданный методом spawn, выполняет main.py под именем __mp_main__
+    script = (
+        "import runpy, sys; runpy.run_path('main.py', run_name='__mp_main__'); "
+        "print(' '.join(sorted(name for name in sys.modules if name.startswith(('app', 'aiogram', 'tortoise')))))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+
+    assert result.stdout.split() == []
+
+
+def test_instance_is_reused_with_job_options(instances):
+    with ytdlp_worker._job_ydl(OPTIONS) as (first, _):
+        pass
+    with ytdlp_worker._job_ydl({**OPTIONS, 'format': "22", 'outtmpl': "second/%(id)s.%(ext)s"}) as (second, _):
+        pass
+
+    assert second is first
+    assert second.params['format'] == "22"
+    assert second.params['outtmpl']['default'] == "second/%(id)s.%(ext)s"
+    assert len(instances) == 1
+
+
+def test_instance_is_recreated_without_private_outtmpl_parser(instances):
+    with ytdlp_worker._job_ydl(OPTIONS) as (first, _):
+        pass
+    # Так выглядит экземпляр версии yt-dlp, в которой приватный метод переименован
+    first._parse_outtmpl = None
+
+    with ytdlp_worker._job_ydl({**OPTIONS, 'outtmpl': "second/%(id)s.%(ext)s"}) as (second, _):
+        pass
+
+    assert second is not first
+    assert second.params['outtmpl']['default'] == "second/%(id)s.%(ext)s"
+    assert len(instances) == 1